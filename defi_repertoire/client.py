@@ -0,0 +1,360 @@
+import asyncio
+import contextlib
+
+from defabipedia.types import Blockchain, Chain
+from pydantic import BaseModel
+from roles_royce.protocols import ContractMethod
+from roles_royce.protocols.roles_modifier.contract_methods import (
+    get_exec_transaction_with_role_method,
+)
+from roles_royce.utils import multi_or_one
+from web3 import Web3
+
+from defi_repertoire import cowswap_orders, gas, metrics, option_search, planner, tokens
+from defi_repertoire.models import DecodeNode, StrategyCall, TransactableData
+from defi_repertoire.positions import Position, get_positions
+from defi_repertoire.providers import get_endpoint_for_blockchain
+from defi_repertoire.strategies.base import (
+    STRATEGIES,
+    ChecksumAddress,
+    GenericTxContext,
+    Strategy,
+    get_balance_queries,
+    get_strategy_id,
+    get_strategy_metadata,
+    prefetch_balances,
+    strategy_as_dict,
+)
+
+
+def _to_blockchain(blockchain: Blockchain | str) -> Blockchain:
+    if isinstance(blockchain, str):
+        return Chain.get_blockchain_by_name(blockchain)
+    return blockchain
+
+
+def _to_strategy_call(call: StrategyCall | dict) -> StrategyCall:
+    if isinstance(call, StrategyCall):
+        return call
+    return StrategyCall(**call)
+
+
+class Repertoire:
+    """
+    In-process client of the strategies. It builds, batches and role-wraps strategy calls in the
+    same way the API does, sharing its web3 providers and caches.
+
+    Example:
+        repertoire = Repertoire()
+        txns = repertoire.build(
+            "ethereum",
+            avatar,
+            [{"id": "dsr__withdraw_without_proxy", "arguments": {"amount": 10}}],
+        )
+    """
+
+    def __init__(self, w3s: dict[Blockchain, Web3] | None = None):
+        """
+        Args:
+            w3s: Web3 instances to use for each blockchain. Defaults to the endpoints of the API.
+        """
+        self.w3s = w3s or {}
+
+    def get_w3(self, blockchain: Blockchain | str) -> Web3:
+        blockchain = _to_blockchain(blockchain)
+        if blockchain in self.w3s:
+            return self.w3s[blockchain]
+        return get_endpoint_for_blockchain(blockchain)
+
+    def build(
+        self,
+        blockchain: Blockchain | str,
+        avatar_safe_address: ChecksumAddress,
+        strategy_calls: list[StrategyCall | dict],
+    ) -> list[ContractMethod]:
+        """Build the transactables of the strategy calls, in order."""
+        w3 = self.get_w3(blockchain)
+        ctx = GenericTxContext(w3=w3, avatar_safe_address=avatar_safe_address)
+        strategy_arguments = []
+        for call in map(_to_strategy_call, strategy_calls):
+            strategy = STRATEGIES[call.id]
+            metadata = get_strategy_metadata(strategy)
+            arguments = metadata.arguments_adapter.validate_python(call.arguments)
+            strategy_arguments.append((strategy, arguments))
+        return self.build_arguments(ctx, strategy_arguments)
+
+    def build_arguments(
+        self,
+        ctx: GenericTxContext,
+        strategy_arguments: list[tuple[Strategy, BaseModel]],
+    ) -> list[ContractMethod]:
+        """
+        Build the strategies with their validated arguments in the context, in order.
+
+        The reads that do not depend on the previous calls are made first and together, so the
+        batching provider sends them in a few JSON-RPC batches: the positions of the calls given
+        as percentages in one multicall, and the cowswap orders concurrently. The calls each
+        strategy makes one after another are still sent one by one.
+
+        The cowswap orders are posted to the order book, so they are only created once the
+        other strategies have built.
+        """
+        built: dict[int, list] = {}
+        with _batching(ctx.w3):
+            # The positions of the calls given as percentages are read in one multicall
+            prefetch_balances(ctx, get_balance_queries(ctx, strategy_arguments))
+            swaps = [
+                i
+                for i, (strategy, _) in enumerate(strategy_arguments)
+                if hasattr(strategy, "get_order_request")
+            ]
+            for i, (strategy, arguments) in enumerate(strategy_arguments):
+                if not hasattr(strategy, "get_order_request"):
+                    built[i] = _get_txns(ctx, strategy, arguments)
+            # Then the cowswap orders are quoted and created concurrently. A call that can
+            # not create its order (e.g. an empty position) fails before any is created.
+            order_requests = []
+            for i in swaps:
+                strategy, arguments = strategy_arguments[i]
+                with metrics.count_strategy_errors(get_strategy_id(strategy)):
+                    request = strategy.get_order_request(ctx, arguments)
+                if request is not None:
+                    order_requests.append(request)
+            cowswap_orders.prefetch_orders(ctx, order_requests)
+            for i in swaps:
+                built[i] = _get_txns(ctx, *strategy_arguments[i])
+        return [txn for i in range(len(strategy_arguments)) for txn in built[i]]
+
+    def multisend(
+        self, blockchain: Blockchain | str, txns: list[ContractMethod]
+    ) -> ContractMethod:
+        """Batch the transactables in one multisend (or return the only one)."""
+        return multi_or_one(txs=txns, blockchain=_to_blockchain(blockchain))
+
+    def estimate_gas(
+        self,
+        blockchain: Blockchain | str,
+        avatar_safe_address: ChecksumAddress,
+        txns: list[ContractMethod],
+        block: int | None = None,
+    ) -> gas.GasEstimate:
+        """Estimate the gas of the multisend of txns and the marginal gas of each one."""
+        blockchain = _to_blockchain(blockchain)
+        w3 = self.get_w3(blockchain)
+        with _batching(w3):
+            return gas.estimate_gas(
+                w3=w3,
+                blockchain=blockchain,
+                avatar=avatar_safe_address,
+                txns=txns,
+                block=block,
+            )
+
+    def exec_with_role(
+        self,
+        blockchain: Blockchain | str,
+        avatar_safe_address: ChecksumAddress,
+        roles_mod_address: ChecksumAddress,
+        role: int | str,
+        strategy_calls: list[StrategyCall | dict],
+        estimate_gas: bool = False,
+    ) -> tuple[TransactableData, DecodeNode]:
+        """
+        Build the strategy calls batched in a multisend executed through the roles modifier.
+
+        Returns:
+            The execTransactionWithRole transaction and its decode tree.
+        """
+        strategy_methods = self.build(blockchain, avatar_safe_address, strategy_calls)
+        return self.wrap_with_role(
+            blockchain,
+            avatar_safe_address,
+            roles_mod_address,
+            role,
+            strategy_methods,
+            estimate_gas=estimate_gas,
+        )
+
+    def wrap_with_role(
+        self,
+        blockchain: Blockchain | str,
+        avatar_safe_address: ChecksumAddress,
+        roles_mod_address: ChecksumAddress,
+        role: int | str,
+        strategy_methods: list[ContractMethod],
+        estimate_gas: bool = False,
+    ) -> tuple[TransactableData, DecodeNode]:
+        """Batch already built transactables in a multisend executed through the roles modifier."""
+        blockchain = _to_blockchain(blockchain)
+
+        # strategy methods layer
+        estimation = None
+        if estimate_gas:
+            estimation = self.estimate_gas(
+                blockchain, avatar_safe_address, strategy_methods
+            )
+        strategy_decode_nodes = [
+            DecodeNode.from_contract_method(
+                method, children=None, gas=estimation and estimation.txns[i]
+            )
+            for i, method in enumerate(strategy_methods)
+        ]
+
+        # multisend layer
+        multisend_method = self.multisend(blockchain, strategy_methods)
+        multisend_txn = TransactableData.from_transactable(multisend_method)
+        multisend_decode_node = DecodeNode.from_contract_method(
+            multisend_method,
+            children=strategy_decode_nodes,
+            gas=estimation and estimation.total,
+        )
+
+        # role layer
+        role_method = get_exec_transaction_with_role_method(
+            roles_mod_address=roles_mod_address,
+            operation=multisend_txn.operation,
+            role=role,
+            to=multisend_txn.contract_address,
+            value=multisend_txn.value,
+            data=multisend_txn.data,
+            should_revert=True,
+        )
+        role_txn = TransactableData.from_transactable(role_method)
+        # build the decode tree
+        role_txn_decode_tree = DecodeNode.from_contract_method(
+            role_method, children=[multisend_decode_node]
+        )
+        return role_txn, role_txn_decode_tree
+
+    async def positions(
+        self,
+        blockchain: Blockchain | str,
+        avatar_safe_address: ChecksumAddress,
+        block: int | str = "latest",
+    ) -> list[Position]:
+        """Positions of the avatar that the disassembly strategies can exit."""
+        blockchain = _to_blockchain(blockchain)
+        w3 = self.get_w3(blockchain)
+        with _batching(w3):
+            return await get_positions(w3, blockchain, avatar_safe_address, block=block)
+
+    async def plan_full_exit(
+        self,
+        blockchain: Blockchain | str,
+        avatar_safe_address: ChecksumAddress,
+        roles_mod_address: ChecksumAddress,
+        role: int | str,
+        target: ChecksumAddress,
+        max_slippage: float,
+        estimate_gas: bool = True,
+    ) -> planner.FullExitPlan:
+        """Role-wrapped multisend exiting all the positions of the avatar into target."""
+        return await planner.plan_full_exit(
+            self,
+            _to_blockchain(blockchain),
+            avatar_safe_address,
+            roles_mod_address,
+            role,
+            target,
+            max_slippage,
+            estimate_gas=estimate_gas,
+        )
+
+    async def options(
+        self,
+        blockchain: Blockchain | str,
+        strategy_id: str,
+        arguments: dict,
+        enrich: bool = False,
+    ):
+        """
+        Options of the strategy arguments that depend on other arguments.
+
+        With enrich the token options have the name and decimals of the tokens.
+        """
+        strategy = STRATEGIES[strategy_id]
+        metadata = get_strategy_metadata(strategy)
+        if not metadata.opt_arguments_adapter:
+            raise ValueError(f"Strategy {strategy_id} has no options")
+        blockchain = _to_blockchain(blockchain)
+        options = await strategy.get_options(
+            blockchain=blockchain,
+            arguments=metadata.opt_arguments_adapter.validate_python(arguments),
+        )
+        if enrich:
+            options = await tokens.enrich_options(blockchain, options)
+        return options
+
+    async def search_options(
+        self,
+        blockchain: Blockchain | str,
+        strategy_id: str,
+        field: str,
+        query: str = "",
+        match: option_search.Match = "prefix",
+        min_liquidity: float | None = None,
+        cursor: str | None = None,
+        limit: int = option_search.DEFAULT_LIMIT,
+    ) -> option_search.OptionPage:
+        """
+        Page of the base options of the field whose label or address starts with (or contains)
+        the query. Pass the next_cursor of a page to get the following one.
+        """
+        index = await option_search.INDEXES.get(
+            STRATEGIES[strategy_id], _to_blockchain(blockchain), field
+        )
+        if index is None:
+            raise ValueError(f"Strategy {strategy_id} has no {field} options")
+        return index.search(
+            query,
+            match=match,
+            min_liquidity=min_liquidity,
+            cursor=cursor,
+            limit=limit,
+        )
+
+    async def strategies(
+        self,
+        blockchain: Blockchain | str,
+        enrich: bool = False,
+        liquidity: bool = False,
+    ):
+        """
+        Definitions of the strategies available in the blockchain. Their options are ranked by
+        liquidity.
+
+        With enrich the token options have the name and decimals of the tokens, and with
+        liquidity the options have their liquidity.
+        """
+        blockchain = _to_blockchain(blockchain)
+        coroutines = [
+            strategy_as_dict(blockchain, s, enrich=enrich, liquidity=liquidity)
+            for s in STRATEGIES.values()
+        ]
+        strategies = await asyncio.gather(*coroutines)
+        return [s for s in strategies if s is not None]
+
+    # Async versions. The strategies do blocking RPC calls so they run in a thread.
+
+    async def abuild(self, *args, **kwargs) -> list[ContractMethod]:
+        return await asyncio.to_thread(self.build, *args, **kwargs)
+
+    async def aestimate_gas(self, *args, **kwargs) -> gas.GasEstimate:
+        return await asyncio.to_thread(self.estimate_gas, *args, **kwargs)
+
+    async def aexec_with_role(
+        self, *args, **kwargs
+    ) -> tuple[TransactableData, DecodeNode]:
+        return await asyncio.to_thread(self.exec_with_role, *args, **kwargs)
+
+
+def _get_txns(ctx: GenericTxContext, strategy: Strategy, arguments: BaseModel):
+    with metrics.count_strategy_errors(get_strategy_id(strategy)):
+        return strategy.get_txns(ctx=ctx, arguments=arguments)
+
+
+def _batching(w3: Web3):
+    # Only the API providers batch requests
+    if hasattr(w3.provider, "batching"):
+        return w3.provider.batching()
+    return contextlib.nullcontext()
@@ -0,0 +1,135 @@
+"""
+Cowswap orders of a batch of strategy calls.
+
+Creating an order quotes it and posts it to the CoW order book API, blocking HTTP requests
+that take most of the time of building a swap. The cowswap strategies describe their order
+with get_order_request, and once the other strategies of a batch have built Repertoire.build
+quotes all its orders concurrently and, if they can all be quoted, starts creating them (see
+prefetch_orders). Their get_txns then take the created order from the context. Orders are
+posted to the order book, so they are only created when the rest of the batch has succeeded.
+
+Whether the node is an anvil fork (the orders of a fork are created differently) is asked
+once per provider.
+"""
+
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from roles_royce.generic_method import Transactable
+from roles_royce.protocols import cowswap
+from web3 import Web3
+
+from defi_repertoire import tracing
+from defi_repertoire.utils import upstream_url
+
+COWSWAP_CONCURRENCY = int(os.getenv("COWSWAP_CONCURRENCY", "8"))
+# Seconds the orders are valid for
+VALID_DURATION = 20 * 60
+API_URLS = {
+    "ethereum": "https://api.cow.fi/mainnet",
+    "gnosis": "https://api.cow.fi/xdai",
+}
+
+_executor = ThreadPoolExecutor(
+    max_workers=COWSWAP_CONCURRENCY, thread_name_prefix="cowswap"
+)
+# Keeps a connection to the API for each of the threads
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_maxsize=COWSWAP_CONCURRENCY))
+_session.mount("http://", HTTPAdapter(pool_maxsize=COWSWAP_CONCURRENCY))
+# Provider -> whether its node is a fork
+_forks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_forks_lock = threading.Lock()
+
+
+class OrderRequest(NamedTuple):
+    sell_token: str
+    buy_token: str
+    amount: int
+    # Fraction of the amount out, not a percentage
+    max_slippage: float
+
+
+def is_fork(w3: Web3) -> bool:
+    """Whether the node of w3 is an anvil fork. The client version is read once per provider."""
+    with _forks_lock:
+        fork = _forks.get(w3.provider)
+    if fork is None:
+        fork = "anvil" in w3.client_version
+        with _forks_lock:
+            _forks[w3.provider] = fork
+    return fork
+
+
+def quote(ctx, request: OrderRequest) -> dict:
+    """
+    Quote of the sell order of the request in the order book. Raises a ValueError with the
+    reason when it can not be quoted (e.g. the amount does not cover the fee).
+    """
+    resp = _session.post(
+        upstream_url(f"{API_URLS[ctx.blockchain]}/api/v1/quote"),
+        json={
+            "sellToken": request.sell_token,
+            "buyToken": request.buy_token,
+            "receiver": ctx.avatar_safe_address,
+            "from": ctx.avatar_safe_address,
+            "kind": "sell",
+            "sellAmountBeforeFee": str(request.amount),
+            "validFor": VALID_DURATION,
+            "signingScheme": "presign",
+        },
+    )
+    if resp.status_code == 400:
+        error = resp.json()
+        raise ValueError(f"Cowswap quote failed: {error.get('description')}")
+    resp.raise_for_status()
+    return resp.json()["quote"]
+
+
+def create_order(ctx, request: OrderRequest) -> list[Transactable]:
+    """Quote and create the sell order of the request, and the transactables to sign it"""
+    return cowswap.create_order_and_swap(
+        w3=ctx.w3,
+        avatar=ctx.avatar_safe_address,
+        sell_token=request.sell_token,
+        buy_token=request.buy_token,
+        amount=request.amount,
+        kind=cowswap.SwapKind.SELL,
+        max_slippage=request.max_slippage,
+        valid_duration=VALID_DURATION,
+        fork=is_fork(ctx.w3),
+    )
+
+
+def prefetch_orders(ctx, order_requests: list[OrderRequest]):
+    """
+    Quote the orders of the requests concurrently and, if they can all be quoted, start
+    creating them concurrently in the context. A request given n times is created n times,
+    once for each strategy call.
+    """
+    quoting = [
+        _executor.submit(tracing.propagate(quote), ctx, r) for r in set(order_requests)
+    ]
+    # Wait for all of them, so no quote is left running when one of them fails
+    errors = [f.exception() for f in quoting]
+    for error in errors:
+        if error:
+            raise error
+
+    orders: dict[OrderRequest, list[Future]] = ctx.ctx["cowswap_orders"]
+    for request in order_requests:
+        future = _executor.submit(tracing.propagate(create_order), ctx, request)
+        orders.setdefault(request, []).append(future)
+
+
+def get_order(ctx, request: OrderRequest) -> list[Transactable]:
+    """Transactables of the order of the request, prefetched or created now."""
+    futures = ctx.ctx["cowswap_orders"].get(request)
+    if futures:
+        return list(futures.pop(0).result())
+    return create_order(ctx, request)
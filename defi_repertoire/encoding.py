@@ -0,0 +1,137 @@
+"""
+Encodings of the API responses.
+
+- Compression: large responses are compressed with brotli (when it is installed) or gzip,
+  as negotiated with Accept-Encoding.
+- MessagePack: the catalog and bulk endpoints answer requests with Accept: application/msgpack
+  in MessagePack, with the same content as the JSON but the calldata (the "data" hex strings)
+  as raw bytes.
+"""
+
+import gzip
+from collections import OrderedDict
+from typing import Any
+
+import msgpack
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+
+# Smaller responses are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+# Compressed bodies of the cached responses, by ETag
+MAX_COMPRESSED_ENTRIES = 256
+
+_compressed: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+
+
+def negotiate_compression(accept_encoding: str | None) -> str | None:
+    """Encoding to compress a response with ("br" or "gzip"), None to not compress it"""
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = params.strip().removeprefix("q=")
+        if coding and quality not in ("0", "0.0", "0.00", "0.000"):
+            accepted.add(coding.strip().lower())
+    if brotli and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return any(media_type in accept for media_type in MSGPACK_TYPES)
+
+
+def _binary_calldata(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            k: _hex_to_bytes(v) if k == "data" else _binary_calldata(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_binary_calldata(v) for v in value]
+    return value
+
+
+def _hex_to_bytes(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith("0x"):
+        try:
+            return bytes.fromhex(value[2:])
+        except ValueError:
+            return value
+    return _binary_calldata(value)
+
+
+def encode(content: Any, media_type: str = JSON) -> bytes:
+    """Body of content in the media type (JSON or MessagePack)"""
+    if media_type == MSGPACK:
+        return msgpack.packb(_binary_calldata(jsonable_encoder(content)))
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def media_type(request: Request) -> str:
+    return MSGPACK if wants_msgpack(request) else JSON
+
+
+def encoded(request: Request, content: Any) -> Any:
+    """content as MessagePack if the request accepts it, else as is (FastAPI encodes it)"""
+    if wants_msgpack(request):
+        return Response(encode(content, MSGPACK), media_type=MSGPACK)
+    return content
+
+
+def _compressed_body(body: bytes, encoding: str, etag: str | None) -> bytes:
+    if not etag:
+        return compress(body, encoding)
+    key = (etag, encoding)
+    if key not in _compressed:
+        _compressed[key] = compress(body, encoding)
+        while len(_compressed) > MAX_COMPRESSED_ENTRIES:
+            _compressed.popitem(last=False)
+    _compressed.move_to_end(key)
+    return _compressed[key]
+
+
+async def compress_response(request: Request, call_next):
+    """HTTP middleware compressing the responses"""
+    response = await call_next(request)
+    encoding = negotiate_compression(request.headers.get("accept-encoding"))
+    if (
+        encoding is None
+        or response.status_code in (204, 304)
+        or "content-encoding" in response.headers
+    ):
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    # Header names are lowercase in the response
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    vary = headers.get("vary")
+    headers["vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+    if len(body) >= MIN_COMPRESS_SIZE:
+        # The cached responses (with ETag) are compressed once
+        etag = headers.get("etag")
+        body = _compressed_body(body, encoding, etag)
+        headers["content-encoding"] = encoding
+        if etag and not etag.startswith("W/"):
+            # Like nginx, the compressed body is only weakly equal to the cached one
+            headers["etag"] = f"W/{etag}"
+    return Response(body, status_code=response.status_code, headers=headers)
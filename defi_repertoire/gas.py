@@ -0,0 +1,181 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from defabipedia.types import Blockchain
+from eth_abi import encode
+from eth_abi.packed import encode_packed
+from eth_utils import function_signature_to_4byte_selector
+from pydantic import BaseModel
+from roles_royce.generic_method import Operation, Transactable
+from roles_royce.utils import multi_or_one
+from web3 import Web3
+
+from defi_repertoire import tracing
+
+logger = logging.getLogger(__name__)
+
+INTRINSIC_GAS = 21_000
+MAX_WORKERS = 8
+CACHE_SIZE = 4096
+
+MULTISEND_SELECTOR = function_signature_to_4byte_selector("multiSend(bytes)")
+
+_estimates: OrderedDict = OrderedDict()
+# Deployed code can not change (SELFDESTRUCT no longer removes it, EIP-6780), so it is cached
+# regardless of the block. An empty code (not deployed yet at the block) is not cached.
+_codes: dict = {}
+_lock = threading.Lock()
+
+
+class GasEstimate(BaseModel):
+    """
+    Gas estimation of a batch of transactables executed from the avatar in one multisend.
+
+    total is the gas of the whole multisend transaction.
+    txns is the marginal gas each transactable adds to the multisend, in the same order. They add
+    up to total minus the gas of an empty multisend (the intrinsic gas and the multisend
+    overhead), or of the intrinsic gas when there is only one transactable (no multisend).
+    """
+
+    block: int
+    total: int | None
+    txns: list[int | None]
+
+
+def _get_code(w3: Web3, blockchain: Blockchain, address: str, block: int) -> str:
+    key = (blockchain, address)
+    with _lock:
+        code = _codes.get(key)
+    if code is None:
+        code = Web3.to_hex(w3.eth.get_code(address, block_identifier=block))
+        if code != "0x":
+            with _lock:
+                _codes[key] = code
+    return code
+
+
+class _MultiSend(NamedTuple):
+    contract_address: str
+    data: str
+    value: int = 0
+    operation: Operation = Operation.DELEGATE_CALL
+
+
+def _multisend(contract_address: str, txns: list[Transactable]) -> _MultiSend:
+    """multiSend call of any number of txns (even zero or one), to estimate their prefixes"""
+    packed = b"".join(
+        encode_packed(
+            ["uint8", "address", "uint256", "uint256", "bytes"],
+            [int(t.operation), t.contract_address, t.value, len(data), data],
+        )
+        for t, data in ((t, Web3.to_bytes(hexstr=t.data)) for t in txns)
+    )
+    data = MULTISEND_SELECTOR + encode(["bytes"], [packed])
+    return _MultiSend(contract_address, Web3.to_hex(data))
+
+
+def _estimate(
+    w3: Web3,
+    blockchain: Blockchain,
+    avatar: str,
+    txn: Transactable,
+    block: int,
+) -> int | None:
+    key = (
+        blockchain,
+        block,
+        avatar,
+        txn.contract_address,
+        txn.data,
+        txn.value,
+        txn.operation,
+    )
+    with _lock:
+        if key in _estimates:
+            _estimates.move_to_end(key)
+            return _estimates[key]
+
+    tx = {
+        "from": avatar,
+        "to": txn.contract_address,
+        "data": txn.data,
+        "value": hex(txn.value),
+    }
+    params = [tx, hex(block)]
+    if txn.operation == Operation.DELEGATE_CALL:
+        # The multisend is delegatecalled by the avatar, which eth_estimateGas can not do.
+        # Overriding the avatar code with the multisend code gives the same execution context.
+        tx["to"] = avatar
+        params.append(
+            {avatar: {"code": _get_code(w3, blockchain, txn.contract_address, block)}}
+        )
+
+    response = w3.provider.make_request("eth_estimateGas", params)
+    if "error" in response:
+        logger.debug(f"Gas estimation failed: {response['error']}")
+        gas = None
+    else:
+        gas = int(response["result"], 16)
+
+    with _lock:
+        _estimates[key] = gas
+        if len(_estimates) > CACHE_SIZE:
+            _estimates.popitem(last=False)
+    return gas
+
+
+def estimate_gas(
+    w3: Web3,
+    blockchain: Blockchain,
+    avatar: str,
+    txns: list[Transactable],
+    block: int | None = None,
+) -> GasEstimate:
+    """
+    Estimate the gas of the multisend of txns and the marginal gas of each one of them.
+
+    Every prefix of txns (from the empty one) is estimated as a multisend (concurrently), so each
+    transactable is measured with the state left by the previous ones (eg: an exit after its
+    approval) and all of them with the same multisend overhead.
+    Estimates are cached per (block, calldata).
+    """
+    if block is None:
+        block = w3.eth.block_number
+    if not txns:
+        return GasEstimate(block=block, total=None, txns=[])
+
+    txn = multi_or_one(txs=txns, blockchain=blockchain)
+    if len(txns) == 1:
+        prefixes = [txn]
+    else:
+        prefixes = [
+            _multisend(txn.contract_address, txns[:i]) for i in range(len(txns))
+        ]
+        prefixes.append(txn)
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(prefixes))) as executor:
+        estimates = list(
+            executor.map(
+                tracing.propagate(
+                    lambda txn: _estimate(w3, blockchain, avatar, txn, block)
+                ),
+                prefixes,
+            )
+        )
+
+    marginals = []
+    if len(txns) == 1:
+        previous = INTRINSIC_GAS
+    else:
+        # The empty multisend
+        previous, *estimates = estimates
+    for gas in estimates:
+        if gas is None or previous is None:
+            marginals.append(None)
+        else:
+            marginals.append(gas - previous)
+        previous = gas
+
+    return GasEstimate(block=block, total=estimates[-1], txns=marginals)
@@ -0,0 +1,189 @@
+"""
+Idempotent builds: requests with an Idempotency-Key header are built once.
+
+The result of a request is kept IDEMPOTENCY_TTL seconds by its key and replayed to the
+retries with the same key and parameters, so a retried build does not repeat its side
+effects (e.g. the cowswap orders it creates). Duplicates that arrive while the first one
+is being built wait for its result. Failed builds are not kept, their retries build again.
+
+With IDEMPOTENCY_DIR set the results are kept there, shared by all the workers (a retry can
+reach any of them), and the builds of a key are serialized with file locks. Otherwise they
+are kept in the memory of the worker.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, NamedTuple, TypeVar
+
+import msgpack
+
+from defi_repertoire.response_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "300"))
+# Directory shared by the workers. Unset to keep the results in memory.
+IDEMPOTENCY_DIR = os.getenv("IDEMPOTENCY_DIR")
+MAX_ENTRIES = 10000
+# Lock files the keys are spread over
+LOCK_STRIPES = 256
+
+T = TypeVar("T")
+
+
+class IdempotencyConflict(Exception):
+    """The idempotency key was used with other parameters"""
+
+
+class _Entry(NamedTuple):
+    fingerprint: str
+    result: Future
+    created_at: float
+
+
+def fingerprint(*parts) -> str:
+    """Hash of the parameters of a request"""
+    return hashlib.sha256(cache_key(*parts).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: int = IDEMPOTENCY_TTL, max_entries: int = MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: dict[str, _Entry] = {}
+        self._lock = Lock()
+
+    def _purge(self, now: float):
+        # Entries are in creation order
+        for key, entry in list(self._entries.items()):
+            if (
+                now - entry.created_at < self.ttl
+                and len(self._entries) <= self.max_entries
+            ):
+                return
+            if entry.result.done():
+                del self._entries[key]
+
+    def run(self, key: str, fingerprint: str, build: Callable[[], T]) -> T:
+        """
+        Result of build, run once for the key.
+
+        Raises:
+            IdempotencyConflict: The key was used with another fingerprint.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._purge(now)
+            entry = self._entries.get(key)
+            if entry and now - entry.created_at >= self.ttl and entry.result.done():
+                del self._entries[key]
+                entry = None
+            if entry:
+                if entry.fingerprint != fingerprint:
+                    raise IdempotencyConflict(
+                        "The Idempotency-Key was already used with other parameters"
+                    )
+                owner = False
+            else:
+                entry = _Entry(fingerprint, Future(), now)
+                self._entries[key] = entry
+                owner = True
+
+        if not owner:
+            # Waits for the request building it
+            return entry.result.result()
+
+        try:
+            result = build()
+        except BaseException as error:
+            with self._lock:
+                self._entries.pop(key, None)
+            entry.result.set_exception(error)
+            raise
+        entry.result.set_result(result)
+        return result
+
+
+class SharedIdempotencyStore:
+    """IdempotencyStore keeping the results in a directory shared by the workers"""
+
+    def __init__(self, directory: str, ttl: int = IDEMPOTENCY_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._purged_at = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _read(self, path: str) -> dict | None:
+        try:
+            with open(path, "rb") as f:
+                return msgpack.unpackb(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            logger.warning(f"Ignoring the idempotency entry {path}: {error}")
+            return None
+
+    def _write(self, path: str, entry: dict):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(msgpack.packb(entry))
+        os.replace(tmp_path, path)
+
+    def _purge(self, now: float):
+        # At most once per ttl, the expired results of any worker
+        if now - self._purged_at < self.ttl:
+            return
+        self._purged_at = now
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".msgpack"):
+                try:
+                    if now - entry.stat().st_mtime >= self.ttl:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def run(self, key: str, fingerprint: str, build: Callable[[], T]) -> T:
+        """
+        Result of build, run once for the key by any of the workers. The result must be
+        serializable with msgpack (e.g. jsonable_encoder'd).
+
+        Raises:
+            IdempotencyConflict: The key was used with another fingerprint.
+        """
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        path = os.path.join(self.directory, f"{digest}.msgpack")
+        lock_path = os.path.join(
+            self.directory, f"stripe-{int(digest, 16) % LOCK_STRIPES}.lock"
+        )
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            # Waits for the request building the key (or a key of its stripe), in any worker
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            entry = self._read(path)
+            if entry and now - entry["created_at"] < self.ttl:
+                if entry["fingerprint"] != fingerprint:
+                    raise IdempotencyConflict(
+                        "The Idempotency-Key was already used with other parameters"
+                    )
+                return entry["result"]
+
+            result = build()
+            self._write(
+                path, {"fingerprint": fingerprint, "created_at": now, "result": result}
+            )
+            self._purge(now)
+            return result
+        finally:
+            # Closing it releases the lock
+            os.close(fd)
+
+
+STORE = (
+    SharedIdempotencyStore(IDEMPOTENCY_DIR) if IDEMPOTENCY_DIR else IdempotencyStore()
+)
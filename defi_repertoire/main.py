@@ -1,113 +1,85 @@
-import asyncio
 import enum
-import json
-import os
-from collections import defaultdict
-
-from defabipedia.types import Blockchain, Chain
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, field_serializer
-from roles_royce.generic_method import Operation
-from roles_royce.protocols import ContractMethod
-from roles_royce.protocols.roles_modifier.contract_methods import (
-    get_exec_transaction_with_role_method,
+import time
+from typing import Annotated
+
+from defabipedia.types import Chain
+from fastapi import FastAPI, Header, HTTPException, Path, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+
+from defi_repertoire import (
+    encoding,
+    idempotency,
+    metrics,
+    option_search,
+    stale_while_revalidate,
+    telemetry,
+    tokens,
+    tracing,
 )
-from roles_royce.utils import multi_or_one
-from web3 import Web3
-
-from defi_repertoire.strategies import disassembling, swapping
+from defi_repertoire.client import Repertoire
+from defi_repertoire.models import StrategyCall, TransactableData, TransactionResponse
+from defi_repertoire.response_cache import ResponseCache, cache_key
 from defi_repertoire.strategies.base import (
     STRATEGIES,
     ChecksumAddress,
     GenericTxContext,
-    get_strategy_arguments_type,
-    get_strategy_opt_arguments_type,
-    get_strategy_opt_types,
-    strategy_as_dict,
+    Percentage,
+    get_strategy_metadata,
 )
+from defi_repertoire.strategies.manifest import MANIFEST
 
 Protocols = enum.StrEnum(
-    "Protocols", {s.protocol: s.protocol for s in STRATEGIES.values()}
+    "Protocols", {s.protocol: s.protocol for s in MANIFEST.values()}
 )
 StrategyKinds = enum.StrEnum(
-    "StrategyKinds", {s.kind: s.kind for s in STRATEGIES.values()}
+    "StrategyKinds", {s.kind: s.kind for s in MANIFEST.values()}
 )
+# Not an enum, so an unknown strategy is a 404. The ids are listed in the schema.
+StrategyId = Annotated[str, Path(json_schema_extra={"enum": list(MANIFEST)})]
 BlockchainOption = enum.StrEnum(
     "BlockchainOption", {name: name for name in Chain._by_name.values()}
 )
 
-ENDPOINTS = {Chain.ETHEREUM: [os.getenv("RPC_MAINNET_URL")]}
-
-ENDPOINTS = {Chain.ETHEREUM: [os.getenv("RPC_MAINNET_URL")]}
-
-
-class StrategyCall(BaseModel):
-    id: str
-    arguments: dict
-
-
-class TransactableData(BaseModel):
-    contract_address: ChecksumAddress
-    data: str
-    operation: Operation
-    value: int
-
-    @classmethod
-    def from_transactable(cls, transactable):
-        """Build a TransactableData from a Transactable-like object"""
-        return cls(
-            operation=transactable.operation,
-            data=transactable.data,
-            value=transactable.value,
-            contract_address=transactable.contract_address,
-        )
-
-
-class DecodeNode(BaseModel):
-    txn: TransactableData
-    decoded: dict
-    children: list["DecodeNode"] | None
-
-    @field_serializer("decoded")
-    def serialize_decoded(self, decoded: dict, _info):
-        # Inefficient way to use the Web3 json normalizers
-        return json.loads(Web3.to_json(decoded))
+app = FastAPI()
+repertoire = Repertoire()
+strategies_responses = ResponseCache("strategies")
+options_responses = ResponseCache("options")
 
-    @classmethod
-    def from_contract_method(
-        cls, method: ContractMethod, children: list["DecodeNode"] | None
-    ) -> "DecodeNode":
-        txn = TransactableData.from_transactable(method)
-        decoded = {"name": method.name, "inputs": method.inputs}
-        return DecodeNode(txn=txn, decoded=decoded, children=children)
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    start = time.perf_counter()
+    with (
+        tracing.trace_request() as trace,
+        telemetry.span(
+            f"{request.method} {request.url.path}",
+            **{"http.method": request.method, "http.target": request.url.path},
+        ) as span,
+    ):
+        response = await call_next(request)
+        response.headers["Server-Timing"] = trace.server_timing()
+        span.set_attribute("http.status_code", response.status_code)
 
-def get_endpoint_for_blockchain(blockchain: Blockchain):
-    if blockchain == Chain.ETHEREUM:
-        url = ENDPOINTS[blockchain][0]
-    else:
-        raise NotImplementedError("Blockchain not supported.")
-    return Web3(Web3.HTTPProvider(url))
+    # The route is in the scope once the request is routed
+    route = request.scope.get("route")
+    strategy_id = request.scope.get("path_params", {}).get("strategy_id", "")
+    metrics.REQUEST_LATENCY.labels(
+        route.path if route else "unmatched",
+        request.method,
+        strategy_id if strategy_id in MANIFEST else "",
+    ).observe(time.perf_counter() - start)
+    return response
 
 
-def strategies_to_contract_methods(
-    blockchain: Blockchain,
-    avatar_safe_address: ChecksumAddress,
-    strategy_calls: list[StrategyCall],
-) -> list[ContractMethod]:
-    w3 = get_endpoint_for_blockchain(blockchain)
-    ctx = GenericTxContext(w3=w3, avatar_safe_address=avatar_safe_address)
-    txns = []
-    for call in strategy_calls:
-        strategy = STRATEGIES[call.id]
-        arguments = get_strategy_arguments_type(strategy)(**call.arguments)
-        strategy_txns = strategy.get_txns(ctx=ctx, arguments=arguments)
-        for txn in strategy_txns:
-            txns.append(txn)
-    return txns
+# Added after trace_requests so it compresses the final responses
+app.middleware("http")(encoding.compress_response)
 
 
-app = FastAPI()
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/")
@@ -121,153 +93,352 @@ async def status():
 
 
 @app.get("/strategies/{blockchain}")
-async def list_strategies(blockchain: BlockchainOption):
-    coroutines = [strategy_as_dict(blockchain, s) for s in STRATEGIES.values()]
-    strategies = await asyncio.gather(*coroutines)
-    return {"strategies": list(filter(lambda v: v is not None, strategies))}
+async def list_strategies(
+    request: Request,
+    blockchain: BlockchainOption,
+    enrich: bool = False,
+    liquidity: bool = False,
+):
+    """
+    The options are ranked by liquidity. With enrich the token options have the name and
+    decimals of the tokens, and with liquidity the options have their liquidity.
+    """
+    media_type = encoding.media_type(request)
+    key = cache_key(blockchain, enrich, liquidity, media_type)
+    cached = strategies_responses.get(key)
+    hit = cached is not None
+    if not hit:
+        generation = stale_while_revalidate.generation()
+        strategies = await repertoire.strategies(
+            blockchain, enrich=enrich, liquidity=liquidity
+        )
+        cached = strategies_responses.put(
+            key, {"strategies": strategies}, generation, media_type
+        )
+    return strategies_responses.respond(request, cached, hit)
+
+
+@app.get(
+    "/strategies/{blockchain}/{strategy_id}/options/{field}",
+    description="Search the base options of a strategy argument, paginated",
+)
+async def search_options(
+    blockchain: BlockchainOption,
+    strategy_id: StrategyId,
+    field: str,
+    q: str = "",
+    match: option_search.Match = "prefix",
+    min_liquidity: float | None = None,
+    cursor: str | None = None,
+    limit: int = Query(option_search.DEFAULT_LIMIT, ge=1, le=option_search.MAX_LIMIT),
+) -> option_search.OptionPage:
+    get_strategy_or_404(strategy_id)
+    try:
+        return await repertoire.search_options(
+            blockchain,
+            strategy_id,
+            field,
+            query=q,
+            match=match,
+            min_liquidity=min_liquidity,
+            cursor=cursor,
+            limit=limit,
+        )
+    except option_search.InvalidCursor as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except ValueError as error:
+        raise HTTPException(status_code=404, detail=str(error))
+
+
+@app.get("/positions/{blockchain}/{avatar_safe_address}")
+async def list_positions(
+    blockchain: BlockchainOption, avatar_safe_address: ChecksumAddress
+):
+    return {"positions": await repertoire.positions(blockchain, avatar_safe_address)}
+
+
+def idempotent(request: Request, idempotency_key: str | None, parameters, build):
+    """Result of build, replayed to the retries with the same Idempotency-Key"""
+    if not idempotency_key:
+        return build()
+    try:
+        # Encoded, the results can be kept in a directory shared by the workers
+        return idempotency.STORE.run(
+            f"{request.url.path}:{idempotency_key}",
+            idempotency.fingerprint(*parameters),
+            lambda: jsonable_encoder(build()),
+        )
+    except idempotency.IdempotencyConflict as error:
+        raise HTTPException(status_code=422, detail=str(error))
 
 
 @app.post(f"/strategies-to-transactions")
 def strategy_transactions(
+    request: Request,
     blockchain: BlockchainOption,
     avatar_safe_address: ChecksumAddress,
     strategy_calls: list[StrategyCall],
     multisend: bool = False,
+    estimate_gas: bool = False,
+    idempotency_key: str | None = Header(None),
 ):
-    blockchain = Chain.get_blockchain_by_name(blockchain)
-    txns = strategies_to_contract_methods(
-        blockchain, avatar_safe_address, strategy_calls
+    def build():
+        chain = Chain.get_blockchain_by_name(blockchain)
+        txns = repertoire.build(chain, avatar_safe_address, strategy_calls)
+        txns_gas = [None] * len(txns)
+        if estimate_gas:
+            estimation = repertoire.estimate_gas(chain, avatar_safe_address, txns)
+            txns_gas = estimation.txns
+        if multisend:
+            txns = [repertoire.multisend(chain, txns)]
+            txns_gas = [estimation.total if estimate_gas else None]
+        return {
+            "txns": [
+                TransactableData.from_transactable(txn, gas=txn_gas)
+                for txn, txn_gas in zip(txns, txns_gas)
+            ]
+        }
+
+    parameters = (
+        blockchain,
+        avatar_safe_address,
+        strategy_calls,
+        multisend,
+        estimate_gas,
+    )
+    return encoding.encoded(
+        request, idempotent(request, idempotency_key, parameters, build)
     )
-    if multisend:
-        txns = [multi_or_one(txs=txns, blockchain=blockchain)]
-
-    return {"txns": [TransactableData.from_transactable(txn) for txn in txns]}
 
 
-@app.post(f"/strategies-to-exec-with-role")
+@app.post(
+    f"/strategies-to-exec-with-role",
+    description="With an Idempotency-Key header the retries get the result of the first request",
+)
 def strategies_to_exec_with_role(
+    request: Request,
     blockchain: BlockchainOption,
     avatar_safe_address: ChecksumAddress,
     roles_mod_address: ChecksumAddress,
     role: int | str,
     strategy_calls: list[StrategyCall],
+    estimate_gas: bool = False,
+    idempotency_key: str | None = Header(None),
 ):
-    blockchain = Chain.get_blockchain_by_name(blockchain)
-
-    # strategy methods layer
-    strategy_methods = strategies_to_contract_methods(
-        blockchain, avatar_safe_address, strategy_calls
+    def build():
+        role_txn, role_txn_decode_tree = repertoire.exec_with_role(
+            blockchain=Chain.get_blockchain_by_name(blockchain),
+            avatar_safe_address=avatar_safe_address,
+            roles_mod_address=roles_mod_address,
+            role=role,
+            strategy_calls=strategy_calls,
+            estimate_gas=estimate_gas,
+        )
+        return {"txn": role_txn, "decoded": role_txn_decode_tree}
+
+    parameters = (
+        blockchain,
+        avatar_safe_address,
+        roles_mod_address,
+        role,
+        strategy_calls,
+        estimate_gas,
     )
-    strategy_decode_nodes = [
-        DecodeNode.from_contract_method(method, children=None)
-        for method in strategy_methods
-    ]
-
-    # multisend layer
-    multisend_method = multi_or_one(txs=strategy_methods, blockchain=blockchain)
-    multisend_txn = TransactableData.from_transactable(multisend_method)
-    multisend_decode_node = DecodeNode.from_contract_method(
-        multisend_method, children=strategy_decode_nodes
+    return encoding.encoded(
+        request, idempotent(request, idempotency_key, parameters, build)
     )
 
-    # role layer
-    role_method = get_exec_transaction_with_role_method(
+
+@app.post(
+    "/plan-full-exit",
+    description="Build one role-wrapped multisend exiting all the positions of the avatar into the target token",
+)
+async def plan_full_exit(
+    request: Request,
+    blockchain: BlockchainOption,
+    avatar_safe_address: ChecksumAddress,
+    roles_mod_address: ChecksumAddress,
+    role: int | str,
+    target_token_address: ChecksumAddress,
+    max_slippage: Percentage = 1,
+    estimate_gas: bool = True,
+):
+    plan = await repertoire.plan_full_exit(
+        blockchain=blockchain,
+        avatar_safe_address=avatar_safe_address,
         roles_mod_address=roles_mod_address,
-        operation=multisend_txn.operation,
         role=role,
-        to=multisend_txn.contract_address,
-        value=multisend_txn.value,
-        data=multisend_txn.data,
-        should_revert=True,
-    )
-    role_txn = TransactableData.from_transactable(role_method)
-    # build the decode tree
-    role_txn_decode_tree = DecodeNode.from_contract_method(
-        role_method, children=[multisend_decode_node]
+        target=target_token_address,
+        max_slippage=max_slippage,
+        estimate_gas=estimate_gas,
     )
-    return {"txn": role_txn, "decoded": role_txn_decode_tree}
+    return encoding.encoded(request, plan)
 
 
 @app.post(
     f"/multisend-transactions",
     description="Build one multisend call from multiple TransactableData",
 )
-def multisend_transactions(blockchain: BlockchainOption, txns: list[TransactableData]):
+def multisend_transactions(
+    request: Request, blockchain: BlockchainOption, txns: list[TransactableData]
+):
     blockchain = Chain.get_blockchain_by_name(blockchain)
-    txn = multi_or_one(txs=txns, blockchain=blockchain)
-    return {"txn": TransactableData.from_transactable(txn)}
+    txn = repertoire.multisend(blockchain, txns)
+    return encoding.encoded(request, {"txn": TransactableData.from_transactable(txn)})
+
 
+def get_strategy_or_404(strategy_id: str):
+    strategy = STRATEGIES.get(strategy_id)
+    if not strategy:
+        raise HTTPException(status_code=404, detail="Strategy not found")
+    return strategy
 
-class TransactionResponse(BaseModel):
-    txns: list[TransactableData]
+
+def validate_body(adapter, arguments: dict):
+    try:
+        return adapter.validate_python(arguments)
+    except ValidationError as error:
+        raise RequestValidationError(
+            [{**e, "loc": ("body", *e["loc"])} for e in error.errors(include_url=False)]
+        )
 
 
 def generate_strategy_endpoints():
     # Endpoints for each strategy
-    for strategy_id, strategy in STRATEGIES.items():
-
-        def make_closure(id, arg_type, opt_arg_type, opt_return_type):
-            # As exit arguments is a custom type (a dict) and FastAPI does not support complex types
-            # in the querystring (https://github.com/tiangolo/fastapi/discussions/7919)
-            # We have mainly two options:
-            #  1) Use a json string in the querystring, but we will not have the schema documentation and validation.
-            #  2) Use a request body. As GET requests body are not supported in all the languages, then we also let POST for the endpoint
-            #     even if the semantic is of a GET.
-            #  3) Just use POST.
-            #
-            # For the time being the option 3) is implemented
-            url = f"/txns/{id}"
-
-            @app.post(url, name=strategy.name, description=strategy.__doc__)
-            def transaction_data(
-                blockchain: BlockchainOption,
-                avatar_safe_address: ChecksumAddress,
-                arguments: arg_type,
-            ) -> TransactionResponse:
+    #
+    # As exit arguments is a custom type (a dict) and FastAPI does not support complex types
+    # in the querystring (https://github.com/tiangolo/fastapi/discussions/7919)
+    # We have mainly two options:
+    #  1) Use a json string in the querystring, but we will not have the schema documentation and validation.
+    #  2) Use a request body. As GET requests body are not supported in all the languages, then we also let POST for the endpoint
+    #     even if the semantic is of a GET.
+    #  3) Just use POST.
+    #
+    # For the time being the option 3) is implemented
+    #
+    # The routes are shared by all the strategies so the strategy modules are only imported when used.
+    # The arguments are validated with the strategy argument types (their schemas are published
+    # in /strategies/{blockchain}, and in the OpenAPI schema by strategy_schemas).
+
+    @app.post(
+        "/txns/{strategy_id}",
+        description="Build the transactions of a strategy",
+    )
+    def transaction_data(
+        strategy_id: StrategyId,
+        blockchain: BlockchainOption,
+        avatar_safe_address: ChecksumAddress,
+        arguments: dict,
+        debug: bool = False,
+    ) -> TransactionResponse:
+        blockchain = Chain.get_blockchain_by_name(blockchain)
+        strategy = get_strategy_or_404(strategy_id)
+        with tracing.timed("validation"):
+            arguments = validate_body(
+                get_strategy_metadata(strategy).arguments_adapter, arguments
+            )
+        w3 = repertoire.get_w3(blockchain)
+        ctx = GenericTxContext(w3=w3, avatar_safe_address=avatar_safe_address)
+        with tracing.timed("build"):
+            txns = repertoire.build_arguments(ctx, [(strategy, arguments)])
+
+        with tracing.timed("encoding"):
+            txns = [TransactableData.from_transactable(txn) for txn in txns]
+        trace = ctx.trace
+        return TransactionResponse(
+            txns=txns, debug=trace.summary() if debug and trace else None
+        )
+
+    @app.post(
+        "/txns/{strategy_id}/options",
+        description="Options of the strategy arguments that depend on other arguments",
+    )
+    async def transaction_options(
+        request: Request,
+        strategy_id: StrategyId,
+        blockchain: BlockchainOption,
+        arguments: dict,
+        enrich: bool = False,
+    ):
+        strategy = get_strategy_or_404(strategy_id)
+        metadata = get_strategy_metadata(strategy)
+        if not metadata.opt_arguments_adapter:
+            raise HTTPException(status_code=404, detail="Strategy has no options")
+        arguments = validate_body(metadata.opt_arguments_adapter, arguments)
+        # The validated arguments, so equivalent ones (e.g. the address case) share the entry
+        key = cache_key(strategy_id, blockchain, arguments, enrich)
+        cached = options_responses.get(key)
+        hit = cached is not None
+        if not hit:
+            generation = stale_while_revalidate.generation()
+            try:
                 blockchain = Chain.get_blockchain_by_name(blockchain)
-                strategy = STRATEGIES.get(id)
-                if not strategy:
-                    raise ValueError("Strategy not found")
-                w3 = get_endpoint_for_blockchain(blockchain)
-                ctx = GenericTxContext(w3=w3, avatar_safe_address=avatar_safe_address)
-                txns = strategy.get_txns(ctx=ctx, arguments=arguments)
-
-                return TransactionResponse(
-                    txns=[TransactableData.from_transactable(txn) for txn in txns]
+                options = await strategy.get_options(
+                    blockchain=blockchain, arguments=arguments
                 )
+                if enrich:
+                    options = await tokens.enrich_options(blockchain, options)
+            except Exception as error:
+                raise HTTPException(status_code=500, detail=str(error))
+            cached = options_responses.put(key, {"options": options}, generation)
+        return options_responses.respond(request, cached, hit)
 
-            if hasattr(strategy, "get_options"):
 
-                @app.post(
-                    url + "/options",
-                    name=strategy.name + " Options",
-                    description=strategy.__doc__,
-                )
-                async def transaction_options(
-                    blockchain: BlockchainOption,
-                    arguments: opt_arg_type,
-                ) -> opt_return_type:
-                    try:
-                        blockchain = Chain.get_blockchain_by_name(blockchain)
-                        strategy = STRATEGIES.get(id)
-                        if not strategy:
-                            raise ValueError("Strategy not found")
-
-                        else:
-                            options = await strategy.get_options(
-                                blockchain=blockchain, arguments=arguments
-                            )
-
-                            return {"options": options}
-                    except Exception as error:
-                        raise HTTPException(status_code=500, detail=error)
-
-        make_closure(
-            strategy_id,
-            get_strategy_arguments_type(strategy),
-            get_strategy_opt_types(strategy).get("arguments"),
-            get_strategy_opt_types(strategy).get("return"),
-        )
+generate_strategy_endpoints()
 
 
-generate_strategy_endpoints()
+def strategy_schemas(schema: dict):
+    """
+    Publish the arguments of every strategy as the request body of the shared /txns routes, and
+    their options as the response of /txns/{strategy_id}/options, in the OpenAPI schema.
+    """
+    inputs = []
+    for id in MANIFEST:
+        metadata = get_strategy_metadata(STRATEGIES[id])
+        inputs.append(((id, "arguments"), "validation", metadata.arguments_adapter))
+        if metadata.opt_arguments_adapter:
+            inputs.append(
+                ((id, "opt_arguments"), "validation", metadata.opt_arguments_adapter)
+            )
+        if metadata.opt_types.get("return"):
+            options = TypeAdapter(metadata.opt_types["return"])
+            inputs.append(((id, "options"), "serialization", options))
+    schemas, definitions = TypeAdapter.json_schemas(
+        inputs, ref_template="#/components/schemas/{model}"
+    )
+    schema.setdefault("components", {}).setdefault("schemas", {}).update(
+        definitions.get("$defs", {})
+    )
+
+    # The strategy is in the path and the arguments of several strategies have the same
+    # fields, so a body can match more than one of them (anyOf rather than oneOf)
+    any_of: dict[str, dict] = {}
+    for ((id, kind), _), json_schema in schemas.items():
+        any_of.setdefault(kind, {"anyOf": []})["anyOf"].append(
+            {**json_schema, "title": id}
+        )
+
+    paths = schema["paths"]
+    for path, kind in [
+        ("/txns/{strategy_id}", "arguments"),
+        ("/txns/{strategy_id}/options", "opt_arguments"),
+    ]:
+        body = paths[path]["post"]["requestBody"]["content"]["application/json"]
+        body["schema"] = any_of[kind]
+    options = paths["/txns/{strategy_id}/options"]["post"]["responses"]["200"]
+    options["content"]["application/json"]["schema"] = {
+        "type": "object",
+        "properties": {"options": any_of["options"]},
+        "required": ["options"],
+    }
+    return schema
+
+
+def openapi():
+    # Built the first time it is requested, as it imports all the strategy modules
+    if not app.openapi_schema:
+        strategy_schemas(FastAPI.openapi(app))
+    return app.openapi_schema
+
+
+app.openapi = openapi
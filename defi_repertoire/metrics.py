@@ -0,0 +1,77 @@
+"""
+Prometheus metrics of the API.
+
+With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by
+them (it must be cleaned before starting) so /metrics aggregates all the workers.
+"""
+
+import os
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    "repertoire_request_duration_seconds",
+    "Latency of the HTTP requests",
+    ["endpoint", "method", "strategy"],
+)
+STRATEGY_ERRORS = Counter(
+    "repertoire_strategy_errors_total",
+    "Errors building the transactions of a strategy",
+    ["strategy"],
+)
+RPC_LATENCY = Histogram(
+    "repertoire_rpc_duration_seconds",
+    "Latency of the JSON-RPC calls",
+    ["method", "endpoint"],
+)
+SUBGRAPH_LATENCY = Histogram(
+    "repertoire_subgraph_duration_seconds",
+    "Latency of the subgraph and token list fetches",
+    ["fetcher"],
+)
+CACHE_LOOKUPS = Counter(
+    "repertoire_cache_lookups_total",
+    "Lookups of the stale while revalidate caches, by outcome (hit, stale or miss)",
+    ["fetcher", "outcome"],
+)
+CACHE_ENTRIES = Gauge(
+    "repertoire_cache_entries",
+    "Entries in the stale while revalidate caches",
+    ["fetcher"],
+    multiprocess_mode="livesum",
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "repertoire_response_cache_lookups_total",
+    "Responses served from the response cache, by outcome (hit, not_modified, precondition_failed or miss)",
+    ["endpoint", "outcome"],
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def count_strategy_errors(strategy_id: str):
+    try:
+        yield
+    except Exception:
+        STRATEGY_ERRORS.labels(strategy_id).inc()
+        raise
+
+
+def render() -> bytes:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
@@ -0,0 +1,75 @@
+import json
+
+from pydantic import BaseModel, field_serializer, model_serializer
+from roles_royce.generic_method import Operation
+from roles_royce.protocols import ContractMethod
+from web3 import Web3
+
+from defi_repertoire.strategies.base import ChecksumAddress
+
+
+class StrategyCall(BaseModel):
+    id: str
+    arguments: dict
+
+
+class TransactableData(BaseModel):
+    contract_address: ChecksumAddress
+    data: str
+    operation: Operation
+    value: int
+    gas: int | None = None
+
+    @model_serializer(mode="wrap")
+    def serialize_model(self, handler):
+        # gas is only present when it was estimated
+        data = handler(self)
+        if self.gas is None:
+            data.pop("gas", None)
+        return data
+
+    @classmethod
+    def from_transactable(cls, transactable, gas: int | None = None):
+        """Build a TransactableData from a Transactable-like object"""
+        return cls(
+            operation=transactable.operation,
+            data=transactable.data,
+            value=transactable.value,
+            contract_address=transactable.contract_address,
+            gas=gas,
+        )
+
+
+class DecodeNode(BaseModel):
+    txn: TransactableData
+    decoded: dict
+    children: list["DecodeNode"] | None
+
+    @field_serializer("decoded")
+    def serialize_decoded(self, decoded: dict, _info):
+        # Inefficient way to use the Web3 json normalizers
+        return json.loads(Web3.to_json(decoded))
+
+    @classmethod
+    def from_contract_method(
+        cls,
+        method: ContractMethod,
+        children: list["DecodeNode"] | None,
+        gas: int | None = None,
+    ) -> "DecodeNode":
+        txn = TransactableData.from_transactable(method, gas=gas)
+        decoded = {"name": method.name, "inputs": method.inputs}
+        return DecodeNode(txn=txn, decoded=decoded, children=children)
+
+
+class TransactionResponse(BaseModel):
+    txns: list[TransactableData]
+    # Trace of the request (RPC calls, cache lookups and timings) when asked for
+    debug: dict | None = None
+
+    @model_serializer(mode="wrap")
+    def serialize_model(self, handler):
+        data = handler(self)
+        if self.debug is None:
+            data.pop("debug", None)
+        return data
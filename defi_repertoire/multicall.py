@@ -0,0 +1,100 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from eth_abi import decode, encode
+from eth_utils import function_signature_to_4byte_selector
+from web3 import Web3
+
+from defi_repertoire import telemetry, tracing
+
+logger = logging.getLogger(__name__)
+
+# Same address in every chain
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+CHUNK_SIZE = 500
+MAX_WORKERS = 8
+
+AGGREGATE3_SELECTOR = function_signature_to_4byte_selector(
+    "aggregate3((address,bool,bytes)[])"
+)
+BALANCE_OF_SELECTOR = function_signature_to_4byte_selector("balanceOf(address)")
+
+
+class Call(NamedTuple):
+    target: str
+    data: bytes
+
+
+def encode_call(signature: str, types: list[str] | None = None, args=()) -> bytes:
+    """Calldata of a function call, e.g. encode_call("balanceOf(address)", ["address"], [owner])"""
+    return function_signature_to_4byte_selector(signature) + encode(types or [], args)
+
+
+def balance_of(token: str, owner: str) -> Call:
+    return Call(token, BALANCE_OF_SELECTOR + encode(["address"], [owner]))
+
+
+def _aggregate(w3: Web3, calls: list[Call], block) -> list[bytes | None]:
+    data = AGGREGATE3_SELECTOR + encode(
+        ["(address,bool,bytes)[]"], [[(c.target, True, c.data) for c in calls]]
+    )
+    with telemetry.span("multicall", **{"multicall.calls": len(calls)}):
+        raw = w3.eth.call({"to": MULTICALL3_ADDRESS, "data": data}, block)
+    [results] = decode(["(bool,bytes)[]"], raw)
+    return [result if success else None for success, result in results]
+
+
+def aggregate(
+    w3: Web3, calls: list[Call], block: int | str = "latest"
+) -> list[bytes | None]:
+    """
+    Return data of each call (None if it reverted) using Multicall3 aggregate3.
+
+    The calls are sent in chunks of CHUNK_SIZE in parallel, so with the batching provider
+    a sweep of thousands of calls is a single JSON-RPC batch of a few eth_calls.
+    """
+    chunks = [calls[i : i + CHUNK_SIZE] for i in range(0, len(calls), CHUNK_SIZE)]
+    logger.debug(f"Multicall of {len(calls)} calls in {len(chunks)} chunks")
+    if len(chunks) <= 1:
+        return _aggregate(w3, calls, block) if calls else []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(
+            tracing.propagate(lambda chunk: _aggregate(w3, chunk, block)), chunks
+        )
+        return [result for chunk in results for result in chunk]
+
+
+def decode_uint(data: bytes | None) -> int | None:
+    if not data or len(data) < 32:
+        return None
+    return int.from_bytes(data[:32], "big")
+
+
+def decode_address(data: bytes | None) -> str | None:
+    if not data or len(data) < 32:
+        return None
+    return Web3.to_checksum_address(data[12:32])
+
+
+def decode_string(data: bytes | None) -> str | None:
+    """ABI string, or bytes32 padded with zeros (e.g. the MKR symbol)"""
+    if not data or len(data) < 32:
+        return None
+    try:
+        [value] = decode(["string"], data)
+        return value
+    except Exception:
+        return data[:32].rstrip(b"\0").decode("utf-8", errors="ignore") or None
+
+
+def balances_of(
+    w3: Web3, tokens: list[str], owner: str, block: int | str = "latest"
+) -> dict[str, int]:
+    """Balances of owner for each token. Tokens whose balanceOf reverts are left out."""
+    results = aggregate(w3, [balance_of(token, owner) for token in tokens], block)
+    return {
+        token: balance
+        for token, balance in zip(tokens, map(decode_uint, results))
+        if balance is not None
+    }
@@ -0,0 +1,157 @@
+"""
+Search and pagination of the base options of the strategies (pools, gauges, tokens...).
+
+Each option list is indexed with its labels and addresses sorted, so a prefix search is a
+binary search instead of a scan of thousands of tokens. The indexes are rebuilt when the
+caches the options come from are updated.
+
+The cursors carry a hash of the option list, so they are valid in any worker serving the same
+list and rejected once it changes.
+"""
+
+import hashlib
+from bisect import bisect_left
+from itertools import islice
+from typing import Iterable, Iterator, Literal
+
+from defabipedia.types import Blockchain
+from pydantic import BaseModel
+
+from defi_repertoire import stale_while_revalidate
+from defi_repertoire.strategies.base import AddressOption, get_strategy_id
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+Match = Literal["prefix", "substring"]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class OptionPage(BaseModel):
+    options: list[AddressOption]
+    # Cursor of the next page, None in the last one
+    next_cursor: str | None = None
+
+
+def _prefixed(entries: list[tuple[str, int]], prefix: str) -> Iterator[int]:
+    """Positions of the sorted (key, position) entries whose key starts with prefix"""
+    for i in range(bisect_left(entries, (prefix,)), len(entries)):
+        key, position = entries[i]
+        if not key.startswith(prefix):
+            return
+        yield position
+
+
+def list_version(options: list[AddressOption]) -> str:
+    """Hash of the (address, label) sequence of the options"""
+    digest = hashlib.blake2b(digest_size=8)
+    for option in options:
+        digest.update(f"{option.address}\n{option.label}\n".encode())
+    return digest.hexdigest()
+
+
+class OptionIndex:
+    def __init__(self, options: list[AddressOption]):
+        """
+        Args:
+            options: The option list, in the order the results are returned.
+        """
+        self.options = options
+        # A cursor of another version of the list is rejected
+        self.version = list_version(options)
+        self._labels = sorted((o.label.lower(), i) for i, o in enumerate(options))
+        self._addresses = sorted((o.address.lower(), i) for i, o in enumerate(options))
+        self._texts = [f"{o.label}\n{o.address}".lower() for o in options]
+
+    def _matches(self, query: str, match: Match, start: int) -> Iterable[int]:
+        """Positions from start of the options matching the query, in order"""
+        if not query:
+            return range(start, len(self.options))
+        if match == "substring":
+            return (
+                i for i in range(start, len(self.options)) if query in self._texts[i]
+            )
+        positions = sorted(
+            {*_prefixed(self._labels, query), *_prefixed(self._addresses, query)}
+        )
+        return positions[bisect_left(positions, start) :]
+
+    def _decode_cursor(self, cursor: str | None) -> int:
+        if not cursor:
+            return 0
+        try:
+            version, position = cursor.split(".")
+            position = int(position)
+        except ValueError:
+            raise InvalidCursor(f"Invalid cursor {cursor}")
+        if version != self.version:
+            raise InvalidCursor("The options changed, search again without cursor")
+        return position
+
+    def search(
+        self,
+        query: str = "",
+        match: Match = "prefix",
+        min_liquidity: float | None = None,
+        cursor: str | None = None,
+        limit: int = DEFAULT_LIMIT,
+    ) -> OptionPage:
+        """
+        Page of the options whose label or address starts with (or contains) the query.
+        With min_liquidity the options without liquidity are left out.
+        """
+        positions = self._matches(query.lower(), match, self._decode_cursor(cursor))
+        if min_liquidity is not None:
+            positions = (
+                i
+                for i in positions
+                if (liquidity := self.options[i].liquidity) is not None
+                and liquidity >= min_liquidity
+            )
+        page = list(islice(positions, limit + 1))
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = f"{self.version}.{page[-1] + 1}"
+        return OptionPage(
+            options=[self.options[i] for i in page], next_cursor=next_cursor
+        )
+
+
+class OptionIndexes:
+    def __init__(self):
+        # (strategy id, blockchain, field) -> (cache generation, index)
+        self._indexes: dict[tuple[str, str, str], tuple[int, OptionIndex]] = {}
+
+    async def get(
+        self, strategy, blockchain: Blockchain, field: str
+    ) -> OptionIndex | None:
+        """Index of the field of the base options of the strategy, None if there is none."""
+        if not hasattr(strategy, "get_base_options"):
+            return None
+        key = (
+            get_strategy_id(strategy),
+            getattr(blockchain, "name", blockchain),
+            field,
+        )
+        # Read before fetching the options, an update while they are fetched rebuilds it again
+        generation = stale_while_revalidate.generation()
+        cached = self._indexes.get(key)
+        if cached and cached[0] == generation:
+            return cached[1]
+
+        options = getattr(await strategy.get_base_options(blockchain), field, None)
+        if not isinstance(options, list):
+            return None
+        if cached and cached[1].options == options:
+            index = cached[1]
+        else:
+            index = OptionIndex(options)
+        self._indexes[key] = (generation, index)
+        return index
+
+
+INDEXES = OptionIndexes()
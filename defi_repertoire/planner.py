@@ -0,0 +1,266 @@
+"""
+Full exit planner: disassembles every position of an avatar into a target asset.
+
+The positions are discovered with `positions.get_positions`. Each one is planned as the exit
+strategy calls (Aura unwrap, gauge unstake, Balancer exit...) plus the swaps to the target
+asset. The exits of all the positions are built concurrently, then the swaps of the positions
+whose exits were built (creating their cowswap orders). All the exits go before all the swaps
+in one role-wrapped multisend, so the swaps sell the tokens the exits return. The positions
+that are not fully exited into the target by the multisend are reported as pending.
+"""
+
+import asyncio
+import logging
+
+from defabipedia.tokens import NATIVE, Addresses
+from defabipedia.types import Blockchain, Chain
+from pydantic import BaseModel
+
+from defi_repertoire.models import DecodeNode, StrategyCall, TransactableData
+from defi_repertoire.positions import Position
+from defi_repertoire.strategies.base import ChecksumAddress
+
+logger = logging.getLogger(__name__)
+
+
+class ExitStep(BaseModel):
+    position: Position
+    strategy_calls: list[StrategyCall]
+
+
+class SkippedPosition(BaseModel):
+    position: Position
+    reason: str
+
+
+class PendingPosition(BaseModel):
+    """
+    Position the plan does not fully exit into the target, e.g. a Lido withdrawal request or
+    a pool that does not have the target, exited into its tokens.
+    """
+
+    position: Position
+    strategy_calls: list[StrategyCall]
+    reason: str
+
+
+class FullExitPlan(BaseModel):
+    txn: TransactableData | None
+    decoded: DecodeNode | None
+    steps: list[ExitStep]
+    skipped: list[SkippedPosition]
+    pending: list[PendingPosition] = []
+
+
+class _PositionPlan(BaseModel):
+    position: Position
+    exits: list[StrategyCall]
+    swaps: list[StrategyCall]
+    # Why the position is not fully exited by the plan, if it is not
+    pending: str | None = None
+
+
+def _same(a: str, b: str) -> bool:
+    return str.lower(a) == str.lower(b)
+
+
+async def _fetch_pool_tokens(blockchain: Blockchain) -> dict[str, list[str]]:
+    """Tokens of the Balancer pool of each BPT, gauge and Aura rewards address (lowercase)."""
+    from defi_repertoire.strategies.disassembling import (
+        disassembling_aura,
+        disassembling_balancer,
+    )
+
+    pools, gauges, aura_pools = await asyncio.gather(
+        disassembling_balancer.fetch_pools(blockchain),
+        disassembling_balancer.fetch_gauges(blockchain),
+        disassembling_aura.fetch_pools(blockchain),
+    )
+    tokens = {
+        str.lower(p["address"]): [str.lower(t["address"]) for t in p["tokens"]]
+        for p in pools
+    }
+    for g in gauges:
+        tokens[str.lower(g["id"])] = tokens.get(str.lower(g["poolAddress"]), [])
+    for p in aura_pools:
+        tokens[str.lower(p["rewardPool"])] = tokens.get(
+            str.lower(p["lpToken"]["id"]), []
+        )
+    return tokens
+
+
+def _swap(token_in: str, target: str, amount: int, max_slippage: float) -> StrategyCall:
+    return StrategyCall(
+        id="cowswap__swap_on_cowswap",
+        arguments={
+            "token_in_address": token_in,
+            "token_out_address": target,
+            "amount": amount,
+            "max_slippage": max_slippage,
+        },
+    )
+
+
+def plan_position(
+    blockchain: Blockchain,
+    position: Position,
+    target: ChecksumAddress,
+    max_slippage: float,
+    pool_tokens: dict[str, list[str]],
+) -> _PositionPlan:
+    """Exit strategy calls and swaps to the target of a position."""
+    balance = position.balance
+    exits = []
+    swaps = []
+    pending = None
+
+    if position.kind in ("bpt", "gauge", "aura"):
+        # strategies: [proportional, single token, ...]
+        proportional, single = position.strategies[:2]
+        arguments = {**position.arguments, "max_slippage": max_slippage}
+        tokens = pool_tokens.get(str.lower(position.address), [])
+        wrapped_target = target
+        if _same(target, NATIVE) and blockchain == Chain.ETHEREUM:
+            wrapped_target = Addresses[blockchain].WETH
+        if str.lower(wrapped_target) in tokens:
+            arguments["token_out_address"] = wrapped_target
+            exits.append(StrategyCall(id=single, arguments=arguments))
+        else:
+            # The amounts of the pool tokens are only known after the exit, so they can not
+            # be swapped in the same multisend
+            exits.append(StrategyCall(id=proportional, arguments=arguments))
+            pending = (
+                "Exited into the pool tokens, which are left in the avatar to be "
+                "swapped into the target"
+            )
+
+    elif position.protocol == "lido":
+        if _same(target, NATIVE):
+            # ETH is claimed from the withdrawal queue once the requests are finalized
+            exits.append(
+                StrategyCall(id=position.strategies[0], arguments=position.arguments)
+            )
+            pending = (
+                "Withdrawal requested, claim the ETH with lido__claim_withdrawals "
+                "once it is finalized"
+            )
+        else:
+            swaps.append(_swap(position.address, target, balance, max_slippage))
+
+    elif position.protocol == "spark":
+        dai = Addresses[blockchain].DAI
+        if _same(target, dai):
+            exits.append(
+                StrategyCall(id=position.strategies[0], arguments=position.arguments)
+            )
+        else:
+            swaps.append(_swap(position.address, target, balance, max_slippage))
+
+    elif position.protocol == "dsr":
+        exits.append(
+            StrategyCall(id=position.strategies[0], arguments=position.arguments)
+        )
+        dai = Addresses[blockchain].DAI
+        if not _same(target, dai):
+            # The exit withdraws exactly its amount of DAI, the swap sells that
+            withdrawn = position.arguments["amount"]
+            swaps.append(_swap(dai, target, withdrawn, max_slippage))
+
+    else:
+        raise ValueError(f"Positions of {position.protocol} are not supported")
+
+    return _PositionPlan(position=position, exits=exits, swaps=swaps, pending=pending)
+
+
+async def plan_full_exit(
+    repertoire,
+    blockchain: Blockchain,
+    avatar_safe_address: ChecksumAddress,
+    roles_mod_address: ChecksumAddress,
+    role: int | str,
+    target: ChecksumAddress,
+    max_slippage: float,
+    estimate_gas: bool = True,
+) -> FullExitPlan:
+    """
+    One role-wrapped multisend exiting all the positions of the avatar into target.
+
+    Positions that can not be planned or built (e.g. a paused pool) are skipped and reported.
+    """
+    positions, pool_tokens = await asyncio.gather(
+        repertoire.positions(blockchain, avatar_safe_address),
+        _fetch_pool_tokens(blockchain),
+    )
+
+    plans = []
+    skipped = []
+    for position in positions:
+        try:
+            plans.append(
+                plan_position(blockchain, position, target, max_slippage, pool_tokens)
+            )
+        except ValueError as error:
+            skipped.append(SkippedPosition(position=position, reason=str(error)))
+
+    async def build_all(calls: list[list[StrategyCall]]):
+        return await asyncio.gather(
+            *[repertoire.abuild(blockchain, avatar_safe_address, c) for c in calls],
+            return_exceptions=True,
+        )
+
+    def skip(plan: _PositionPlan, error: Exception):
+        logger.warning(f"Skipping position {plan.position.address}: {error}")
+        skipped.append(SkippedPosition(position=plan.position, reason=str(error)))
+
+    # The swaps are only built (and their orders created) for the positions whose exits
+    # were built
+    exited = []
+    for plan, result in zip(plans, await build_all([p.exits for p in plans])):
+        if isinstance(result, Exception):
+            skip(plan, result)
+        else:
+            exited.append((plan, result))
+    swapped = await build_all([plan.swaps for plan, _ in exited])
+
+    steps = []
+    pending = []
+    exit_txns = []
+    swap_txns = []
+    for (plan, exits), swaps in zip(exited, swapped):
+        if isinstance(swaps, Exception):
+            skip(plan, swaps)
+            continue
+        exit_txns.extend(exits)
+        swap_txns.extend(swaps)
+        strategy_calls = plan.exits + plan.swaps
+        if plan.pending:
+            pending.append(
+                PendingPosition(
+                    position=plan.position,
+                    strategy_calls=strategy_calls,
+                    reason=plan.pending,
+                )
+            )
+        else:
+            steps.append(
+                ExitStep(position=plan.position, strategy_calls=strategy_calls)
+            )
+
+    txns = exit_txns + swap_txns
+    if not txns:
+        return FullExitPlan(
+            txn=None, decoded=None, steps=steps, skipped=skipped, pending=pending
+        )
+
+    txn, decoded = await asyncio.to_thread(
+        repertoire.wrap_with_role,
+        blockchain,
+        avatar_safe_address,
+        roles_mod_address,
+        role,
+        txns,
+        estimate_gas=estimate_gas,
+    )
+    return FullExitPlan(
+        txn=txn, decoded=decoded, steps=steps, skipped=skipped, pending=pending
+    )
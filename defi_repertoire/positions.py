@@ -0,0 +1,222 @@
+"""
+Discovery of the positions of an avatar that the disassembly strategies can exit.
+
+The candidate tokens come from the cached Balancer pools and gauges and Aura pools, plus
+the Lido, Spark and DSR tokens. Their balances are read with Multicall3 sweeps, so the
+whole discovery takes a few RPC calls.
+"""
+
+import asyncio
+
+from defabipedia.types import Blockchain, Chain
+from pydantic import BaseModel
+from web3 import Web3
+
+from defi_repertoire import multicall
+from defi_repertoire.strategies.base import ChecksumAddress
+
+RAY = 10**27
+
+
+class Position(BaseModel):
+    protocol: str
+    # kind of token held: bpt, gauge, aura, token or dsr
+    kind: str
+    address: ChecksumAddress
+    label: str
+    balance: int
+    # Strategies that exit the position, and the arguments to exit all of it that they share
+    # (the amount and the address of the position). Their own arguments, e.g. max_slippage
+    # and token_out_address, are not included.
+    strategies: list[str]
+    arguments: dict
+
+
+class _Candidate(BaseModel):
+    protocol: str
+    kind: str
+    address: ChecksumAddress
+    label: str
+    strategies: list[str]
+    argument: str | None
+
+
+async def _fetch_candidates(blockchain: Blockchain) -> list[_Candidate]:
+    # The strategy modules are imported here to not load them with the API
+    from defi_repertoire.strategies.disassembling import (
+        disassembling_aura,
+        disassembling_balancer,
+    )
+
+    pools, gauges, aura_pools = await asyncio.gather(
+        disassembling_balancer.fetch_pools(blockchain),
+        disassembling_balancer.fetch_gauges(blockchain),
+        disassembling_aura.fetch_pools(blockchain),
+    )
+    candidates = [
+        _Candidate(
+            protocol="balancer",
+            kind="bpt",
+            address=Web3.to_checksum_address(p["address"]),
+            label=p["symbol"],
+            strategies=[
+                "balancer__withdraw_all_assets_proportional",
+                "balancer__withdraw_single",
+            ],
+            argument="bpt_address",
+        )
+        for p in pools
+    ]
+    candidates += [
+        _Candidate(
+            protocol="balancer",
+            kind="gauge",
+            address=Web3.to_checksum_address(g["id"]),
+            label=g["symbol"],
+            strategies=[
+                "balancer__unstake_withdraw_proportional",
+                "balancer__unstake_withdraw_single",
+            ],
+            argument="gauge_address",
+        )
+        for g in gauges
+    ]
+    candidates += [
+        _Candidate(
+            protocol="aura",
+            kind="aura",
+            address=Web3.to_checksum_address(p["rewardPool"]),
+            label=p["depositToken"]["symbol"],
+            strategies=[
+                "aura__withdraw_proportional",
+                "aura__withdraw_single_token",
+                "aura__withdraw",
+            ],
+            argument="rewards_address",
+        )
+        for p in aura_pools
+    ]
+    if blockchain == Chain.ETHEREUM:
+        candidates += _ethereum_token_candidates(blockchain)
+    return candidates
+
+
+def _ethereum_token_candidates(blockchain: Blockchain) -> list[_Candidate]:
+    from defabipedia.lido import ContractSpecs as LidoSpecs
+    from defabipedia.spark import ContractSpecs as SparkSpecs
+
+    return [
+        _Candidate(
+            protocol="lido",
+            kind="token",
+            address=LidoSpecs[blockchain].stETH.address,
+            label="stETH",
+            strategies=["lido__unstake_stETH"],
+            argument=None,
+        ),
+        _Candidate(
+            protocol="lido",
+            kind="token",
+            address=LidoSpecs[blockchain].wstETH.address,
+            label="wstETH",
+            strategies=["lido__unwrap_and_unstake_wstETH"],
+            argument=None,
+        ),
+        _Candidate(
+            protocol="spark",
+            kind="token",
+            address=SparkSpecs[blockchain].sDAI.address,
+            label="sDAI",
+            strategies=["spark__withdraw_with_proxy"],
+            argument=None,
+        ),
+    ]
+
+
+def _to_position(candidate: _Candidate, balance: int) -> Position:
+    arguments = {"amount": balance}
+    if candidate.argument:
+        arguments[candidate.argument] = candidate.address
+    return Position(
+        protocol=candidate.protocol,
+        kind=candidate.kind,
+        address=candidate.address,
+        label=candidate.label,
+        balance=balance,
+        strategies=candidate.strategies,
+        arguments=arguments,
+    )
+
+
+def _dsr_calls(blockchain: Blockchain, avatar: str) -> tuple[str, list[multicall.Call]]:
+    from defabipedia.maker import ContractSpecs as MakerSpecs
+
+    dsr_manager = MakerSpecs[blockchain].DsrManager.address
+    return dsr_manager, [
+        multicall.Call(
+            dsr_manager, multicall.encode_call("pieOf(address)", ["address"], [avatar])
+        ),
+        multicall.Call(dsr_manager, multicall.encode_call("pot()")),
+    ]
+
+
+def scan_positions(
+    w3: Web3,
+    blockchain: Blockchain,
+    avatar: ChecksumAddress,
+    candidates: list[_Candidate],
+    block: int | str = "latest",
+) -> list[Position]:
+    """Nonzero positions of the avatar among the candidates."""
+    calls = [multicall.balance_of(c.address, avatar) for c in candidates]
+    dsr_manager = None
+    if blockchain == Chain.ETHEREUM:
+        dsr_manager, dsr_calls = _dsr_calls(blockchain, avatar)
+        calls += dsr_calls
+
+    results = multicall.aggregate(w3, calls, block)
+
+    positions = []
+    for candidate, result in zip(candidates, results):
+        balance = multicall.decode_uint(result)
+        if balance:
+            positions.append(_to_position(candidate, balance))
+
+    if dsr_manager:
+        pie = multicall.decode_uint(results[-2])
+        pot = multicall.decode_address(results[-1])
+        if pie and pot:
+            [chi] = multicall.aggregate(
+                w3, [multicall.Call(pot, multicall.encode_call("chi()"))], block
+            )
+            balance = pie * multicall.decode_uint(chi) // RAY
+            positions.append(
+                _to_position(
+                    _Candidate(
+                        protocol="dsr",
+                        kind="dsr",
+                        address=dsr_manager,
+                        label="DSR",
+                        strategies=["dsr__withdraw_without_proxy"],
+                        argument=None,
+                    ),
+                    balance,
+                )
+            )
+    return positions
+
+
+async def get_positions(
+    w3: Web3,
+    blockchain: Blockchain,
+    avatar: ChecksumAddress,
+    block: int | str = "latest",
+) -> list[Position]:
+    """
+    Positions of the avatar that can be disassembled, with the strategies that exit them and
+    the amount and address arguments to exit them completely.
+    """
+    candidates = await _fetch_candidates(blockchain)
+    return await asyncio.to_thread(
+        scan_positions, w3, blockchain, avatar, candidates, block
+    )
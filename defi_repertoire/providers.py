@@ -0,0 +1,199 @@
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+from urllib.parse import urlparse
+
+import requests
+from defabipedia.types import Blockchain, Chain
+from web3 import HTTPProvider, Web3
+from web3._utils.encoding import Web3JsonEncoder
+from web3.types import RPCEndpoint, RPCResponse
+
+from defi_repertoire import metrics, telemetry, tracing
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = {Chain.ETHEREUM: [os.getenv("RPC_MAINNET_URL")]}
+
+_web3s: dict[Blockchain, Web3] = {}
+_web3s_lock = threading.Lock()
+
+
+class _PendingCall:
+    def __init__(self, method: RPCEndpoint, params: Any):
+        self.method = method
+        self.params = params
+        self.response: RPCResponse | None = None
+        self.error: Exception | None = None
+        self.done = False
+
+    def result(self) -> RPCResponse:
+        if self.error:
+            raise self.error
+        return self.response
+
+
+class _Batch:
+    """Calls queued in a `batching()` block, sent by one of its threads at a time"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending: list[_PendingCall] = []
+        self.sending = False
+
+
+class BatchingHTTPProvider(HTTPProvider):
+    """
+    HTTPProvider that sends the calls made concurrently inside a `batching()` block as one
+    JSON-RPC batch request.
+
+    While a batch is in flight the new calls are queued and go out together in the next batch,
+    so sequential callers do not pay any extra latency. `window` (seconds) makes the sender wait
+    for more calls before sending. Outside a `batching()` block calls are sent one by one.
+
+    Only concurrent calls are batched: the reads must be issued together, e.g. the multicall
+    chunks, the Lido request pages or the balance prefetch of `Repertoire.build`. A strategy
+    making its calls one after another still sends them one by one.
+
+    The provider is shared by the whole process. Each `batching()` block has its own queue,
+    used by the context (request) that opened it and the threads it runs in with
+    `tracing.propagate`, so the calls and the errors of other requests are not in its batches.
+    """
+
+    def __init__(
+        self,
+        endpoint_uri: str | None = None,
+        request_kwargs: Any | None = None,
+        window: float = 0,
+        max_batch_size: int = 100,
+        **kwargs,
+    ):
+        super().__init__(endpoint_uri, request_kwargs=request_kwargs, **kwargs)
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._batch_ids = itertools.count()
+        self._session = requests.Session()
+        # Batch of the batching() block of the current context, if any
+        self._batch: contextvars.ContextVar[_Batch | None] = contextvars.ContextVar(
+            f"batch_{id(self)}", default=None
+        )
+        # Only the host, the path can have an API key
+        self._metrics_endpoint = urlparse(str(self.endpoint_uri)).hostname or ""
+
+    @contextmanager
+    def batching(self):
+        if self._batch.get() is not None:
+            # Nested blocks share the batches of the outer one
+            yield self
+            return
+        token = self._batch.set(_Batch())
+        try:
+            yield self
+        finally:
+            self._batch.reset(token)
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        start = time.perf_counter()
+        try:
+            with telemetry.span("rpc", **{"rpc.method": method}):
+                return self._batched_request(method, params)
+        finally:
+            duration = time.perf_counter() - start
+            tracing.record_rpc(method, duration)
+            metrics.RPC_LATENCY.labels(method, self._metrics_endpoint).observe(duration)
+
+    def _batched_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        batch = self._batch.get()
+        if batch is None:
+            return super().make_request(method, params)
+
+        call = _PendingCall(method, params)
+        with batch.condition:
+            batch.pending.append(call)
+            while batch.sending and not call.done:
+                batch.condition.wait()
+            if call.done:
+                return call.result()
+            batch.sending = True
+
+        try:
+            if self.window:
+                time.sleep(self.window)
+            with batch.condition:
+                calls, batch.pending = batch.pending, []
+            for i in range(0, len(calls), self.max_batch_size):
+                self._send_batch(calls[i : i + self.max_batch_size])
+        finally:
+            with batch.condition:
+                batch.sending = False
+                batch.condition.notify_all()
+        return call.result()
+
+    def _send_batch(self, calls: list[_PendingCall]):
+        try:
+            if len(calls) == 1:
+                calls[0].response = super().make_request(
+                    calls[0].method, calls[0].params
+                )
+            else:
+                self._send_json_rpc_batch(calls)
+        except Exception as error:
+            for call in calls:
+                if call.response is None:
+                    call.error = error
+        finally:
+            for call in calls:
+                call.done = True
+
+    def _send_json_rpc_batch(self, calls: list[_PendingCall]):
+        by_id = {next(self._batch_ids): call for call in calls}
+        payload = [
+            {"jsonrpc": "2.0", "method": call.method, "params": call.params, "id": id}
+            for id, call in by_id.items()
+        ]
+        logger.debug(f"Making batch request of {len(calls)} calls to {self}")
+        response = self._session.post(
+            self.endpoint_uri,
+            data=json.dumps(payload, cls=Web3JsonEncoder),
+            **self.get_request_kwargs(),
+        )
+        response.raise_for_status()
+        responses = response.json()
+
+        if not isinstance(responses, list):
+            # The node does not support batches, send the calls one by one
+            for call in calls:
+                call.response = super().make_request(call.method, call.params)
+            return
+
+        for item in responses:
+            call = by_id.pop(item.get("id"), None)
+            if call:
+                call.response = item
+        for id, call in by_id.items():
+            call.response = {
+                "jsonrpc": "2.0",
+                "id": id,
+                "error": {"code": -32603, "message": "Missing response in batch"},
+            }
+
+
+def get_endpoint_for_blockchain(blockchain: Blockchain) -> Web3:
+    """
+    Web3 of the blockchain. It is shared by the whole process (API and in-process clients),
+    so are the provider HTTP sessions and batches.
+    """
+    if blockchain == Chain.ETHEREUM:
+        url = ENDPOINTS[blockchain][0]
+    else:
+        raise NotImplementedError("Blockchain not supported.")
+    with _web3s_lock:
+        if blockchain not in _web3s:
+            _web3s[blockchain] = Web3(BatchingHTTPProvider(url))
+        return _web3s[blockchain]
@@ -0,0 +1,67 @@
+"""
+Liquidity ranking of the options.
+
+The fetchers add the USD liquidity of each pool or token ("liquidity") to the entities and
+sort them by it when they refresh, so the option lists (and their search indexes) come
+already ranked and the top K options are the first K.
+"""
+
+import asyncio
+import logging
+import math
+from typing import Iterable
+
+from defabipedia.types import Blockchain
+
+logger = logging.getLogger(__name__)
+
+
+def to_liquidity(value) -> float | None:
+    """USD liquidity from a subgraph or API value (number or numeric string)"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def ranked(items: Iterable[dict]) -> list[dict]:
+    """Items sorted by liquidity, largest first. The ones without it go last, in their order."""
+    return sorted(
+        items,
+        key=lambda i: -i["liquidity"] if i.get("liquidity") is not None else math.inf,
+    )
+
+
+def with_liquidity(
+    items: Iterable[dict], liquidity: dict[str, float], field: str = "address"
+) -> list[dict]:
+    """Copies of the items with the liquidity of their (lowercase) address field, ranked"""
+    return ranked(
+        {**i, "liquidity": liquidity.get((i.get(field) or "").lower())} for i in items
+    )
+
+
+async def token_liquidity(blockchain: Blockchain) -> dict[str, float]:
+    """
+    Lowercase token address -> USD liquidity of the token in the Curve pools or UniswapV3
+    (the largest). The sources that fail are left out.
+    """
+    # Imported here as these strategy modules use the ranking too
+    from defi_repertoire.strategies.swapping import curve, uniswapV3
+
+    sources = {
+        "curve": curve.fetch_tokens(blockchain),
+        "uniswapv3": uniswapV3.fetch_tokens(blockchain),
+    }
+    results = await asyncio.gather(*sources.values(), return_exceptions=True)
+    liquidity: dict[str, float] = {}
+    for source, result in zip(sources, results):
+        if isinstance(result, Exception):
+            logger.warning(f"No {source} liquidity for {blockchain}: {result}")
+            continue
+        for token in result:
+            value = token.get("liquidity")
+            address = (token.get("address") or token.get("id") or "").lower()
+            if value is not None and value > liquidity.get(address, -1):
+                liquidity[address] = value
+    return liquidity
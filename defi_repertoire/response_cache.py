@@ -0,0 +1,117 @@
+"""
+Cache of serialized API responses, with ETags.
+
+The responses of the options endpoints only change when the caches they are computed from
+are updated, so they are kept serialized by (endpoint, canonical arguments) until any cache
+is updated (see stale_while_revalidate.generation) or max_age passes. GET requests with the
+ETag of the cached response in If-None-Match get a 304, and Cache-Control lets a CDN or
+reverse proxy serve them too. The POST responses (not cached by CDNs) only have the ETag, and
+a matching If-None-Match gets a 412 as the HTTP semantics require for other methods.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from defi_repertoire import encoding, metrics, stale_while_revalidate
+
+MAX_AGE = int(os.getenv("RESPONSE_CACHE_MAX_AGE", "60"))
+MAX_ENTRIES = 2048
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    media_type: str
+    etag: str
+    generation: int
+    created_at: float
+
+
+def cache_key(*parts: Any) -> str:
+    """Canonical key of the parts of a request (dicts are compared regardless of their order)"""
+    return json.dumps(
+        jsonable_encoder(parts), sort_keys=True, separators=(",", ":"), default=str
+    )
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class ResponseCache:
+    def __init__(
+        self, endpoint: str, max_age: int = MAX_AGE, max_entries: int = MAX_ENTRIES
+    ):
+        """
+        Args:
+            endpoint: Name of the endpoint in the metrics.
+            max_age: Seconds a response is reused (and can be cached by clients).
+            max_entries: Responses kept, the least recently used are dropped.
+        """
+        self.endpoint = endpoint
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._responses: OrderedDict[str, CachedResponse] = OrderedDict()
+
+    def get(self, key: str) -> CachedResponse | None:
+        cached = self._responses.get(key)
+        if cached is None:
+            return None
+        if (
+            cached.generation != stale_while_revalidate.generation()
+            or time.monotonic() - cached.created_at >= self.max_age
+        ):
+            del self._responses[key]
+            return None
+        self._responses.move_to_end(key)
+        return cached
+
+    def put(
+        self,
+        key: str,
+        content: Any,
+        generation: int,
+        media_type: str = encoding.JSON,
+    ) -> CachedResponse:
+        """
+        Serialize and cache content. generation is the one read before computing it, so a
+        cache updated meanwhile makes it outdated right away.
+        """
+        body = encoding.encode(content, media_type)
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        cached = CachedResponse(body, media_type, etag, generation, time.monotonic())
+        self._responses[key] = cached
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.max_entries:
+            self._responses.popitem(last=False)
+        return cached
+
+    def respond(self, request: Request, cached: CachedResponse, hit: bool) -> Response:
+        """
+        The cached response, or a 304 if the client already has it (a 412 for the methods
+        other than GET and HEAD).
+        """
+        headers = {"ETag": cached.etag, "Vary": "Accept"}
+        safe = request.method in ("GET", "HEAD")
+        if safe:
+            headers["Cache-Control"] = f"public, max-age={self.max_age}"
+        if _etag_matches(request.headers.get("if-none-match"), cached.etag):
+            outcome = "not_modified" if safe else "precondition_failed"
+            metrics.RESPONSE_CACHE_LOOKUPS.labels(self.endpoint, outcome).inc()
+            return Response(status_code=304 if safe else 412, headers=headers)
+        metrics.RESPONSE_CACHE_LOOKUPS.labels(
+            self.endpoint, "hit" if hit else "miss"
+        ).inc()
+        return Response(cached.body, media_type=cached.media_type, headers=headers)
+
+    def clear(self):
+        self._responses.clear()
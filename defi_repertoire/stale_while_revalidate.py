@@ -1,35 +1,97 @@
 import asyncio
+import fcntl
+import logging
+import os
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
 from typing import Any, Dict, Tuple
 
+import msgpack
 from async_lru import alru_cache
 
+from defi_repertoire import metrics, telemetry, tracing
+
+logger = logging.getLogger(__name__)
+
+# Directory of the snapshots of the cached values. Unset to disable them.
+SNAPSHOT_DIR = os.getenv("CACHE_SNAPSHOT_DIR")
+
+# Number of updates of all the caches, to know when the values derived from them are outdated
+_generation = 0
+
+
+def generation() -> int:
+    return _generation
+
+
+def _changed():
+    global _generation
+    _generation += 1
+
+
+def _snapshot_arg(arg):
+    # Blockchains are stored by name
+    if isinstance(arg, (str, int, float, bool)) or arg is None:
+        return arg
+    return getattr(arg, "name", str(arg))
+
+
+def _snapshot_key(key: tuple) -> bytes:
+    args, kwargs = key
+    return msgpack.packb(
+        [[_snapshot_arg(a) for a in args], [[k, _snapshot_arg(v)] for k, v in kwargs]]
+    )
+
+
+@contextmanager
+def locked_directory(directory: str):
+    """Exclusive lock of the directory between the workers (flock of the directory itself)"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing it releases the lock
+        os.close(fd)
+
 
 class StaleWhileRevalidateCache:
     def __init__(self, func, ttl: int, use_stale_ttl: int):
         self.func = func
+        self.name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
         self.ttl = ttl
         self.use_stale_ttl = use_stale_ttl
         self.cache: Dict[Tuple, Any] = {}
         self.cache_time: Dict[Tuple, datetime] = {}
         self.lock = asyncio.Lock()
         self.pending_updates: Dict[Tuple, asyncio.Task] = {}
+        self.snapshot_dir = SNAPSHOT_DIR
+        # Entries of the snapshot not looked up yet, loaded on the first call
+        self.snapshot: Dict[bytes, Tuple[Any, datetime]] | None = None
 
     def __call__(self, *args, **kwargs):
-        return self._call(*args, **kwargs)
+        return self._traced_call(*args, **kwargs)
+
+    async def _traced_call(self, *args, **kwargs):
+        with telemetry.span("cache", **{"cache.fetcher": self.name}):
+            return await self._call(*args, **kwargs)
 
     async def _call(self, *args, **kwargs):
         key = (args, tuple(sorted(kwargs.items())))
         async with self.lock:
+            if key not in self.cache and self.snapshot_dir:
+                await self._restore(key)
             if key in self.cache:
                 cache_age = datetime.now() - self.cache_time[key]
                 if cache_age < timedelta(seconds=self.ttl):
                     # Return cached value if not stale
+                    self._record_lookup("hit")
                     return self.cache[key]
                 elif cache_age < timedelta(seconds=self.use_stale_ttl):
                     # Return cached value and revalidate in the background if within use_stale_ttl
                     result = self.cache[key]
+                    self._record_lookup("stale")
                     if key not in self.pending_updates:
                         self.pending_updates[key] = asyncio.create_task(
                             self._update_cache(key, *args, **kwargs)
@@ -37,10 +99,103 @@ class StaleWhileRevalidateCache:
                     return result
 
             # Compute and cache the result if not present or stale beyond use_stale_ttl
+            self._record_lookup("miss")
             result = await self.func(*args, **kwargs)
             self.cache[key] = result
             self.cache_time[key] = datetime.now()
-            return result
+            _changed()
+            metrics.CACHE_ENTRIES.labels(self.name).set(len(self.cache))
+        await self._save_snapshot()
+        return result
+
+    def _record_lookup(self, outcome: str):
+        telemetry.set_attribute("cache.outcome", outcome)
+        tracing.record_cache(outcome)
+        metrics.CACHE_LOOKUPS.labels(self.name, outcome).inc()
+
+    def clear(self):
+        """Drop all the cached values, e.g. to measure cold requests."""
+        self.cache.clear()
+        self.cache_time.clear()
+        # As after a restart, the snapshot is read again
+        self.snapshot = None
+        _changed()
+        metrics.CACHE_ENTRIES.labels(self.name).set(0)
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.snapshot_dir, f"{self.name}.msgpack")
+
+    async def _restore(self, key):
+        """
+        Move the entry of key from the snapshot to the cache. It is restored with its age, but
+        at most as stale (never expired) so it is served while it is revalidated.
+        """
+        if self.snapshot is None:
+            self.snapshot = await asyncio.to_thread(self._load_snapshot)
+        entry = self.snapshot.pop(_snapshot_key(key), None)
+        if entry:
+            value, saved_at = entry
+            self.cache[key] = value
+            self.cache_time[key] = max(
+                saved_at, datetime.now() - timedelta(seconds=self.ttl)
+            )
+            _changed()
+
+    def _load_snapshot(self) -> Dict[bytes, Tuple[Any, datetime]]:
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                entries = msgpack.unpackb(f.read())
+        except FileNotFoundError:
+            return {}
+        except Exception as error:
+            logger.warning(f"Ignoring the snapshot of {self.name}: {error}")
+            return {}
+        return {
+            key: (value, datetime.fromtimestamp(saved_at))
+            for key, value, saved_at in entries
+        }
+
+    async def _save_snapshot(self):
+        if not self.snapshot_dir:
+            return
+        async with self.lock:
+            # The entries of the snapshot not looked up yet are kept too
+            entries = {
+                key: (value, saved_at.timestamp())
+                for key, (value, saved_at) in (self.snapshot or {}).items()
+            }
+            entries.update(
+                (_snapshot_key(key), (value, self.cache_time[key].timestamp()))
+                for key, value in self.cache.items()
+            )
+        await asyncio.to_thread(self._write_snapshot, entries)
+
+    def _write_snapshot(self, entries: Dict[bytes, Tuple[Any, float]]):
+        """
+        Merge the entries into the snapshot file, keeping the newest value of each key. The
+        workers share the snapshots and each one caches its own keys, so the file is read
+        again and rewritten under a lock of the directory.
+        """
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            with locked_directory(self.snapshot_dir):
+                for key, (value, saved_at) in self._load_snapshot().items():
+                    if key not in entries or entries[key][1] < saved_at.timestamp():
+                        entries[key] = (value, saved_at.timestamp())
+                data = msgpack.packb(
+                    [
+                        [key, value, saved_at]
+                        for key, (value, saved_at) in entries.items()
+                    ]
+                )
+                # Atomic replace, the workers read the snapshots without the lock
+                tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.snapshot_path)
+        except Exception as error:
+            logger.warning(f"Could not write the snapshot of {self.name}: {error}")
 
     async def _update_cache(self, key, *args, **kwargs):
         try:
@@ -48,6 +203,8 @@ class StaleWhileRevalidateCache:
             async with self.lock:
                 self.cache[key] = result
                 self.cache_time[key] = datetime.now()
+                _changed()
+            await self._save_snapshot()
         finally:
             async with self.lock:
                 if key in self.pending_updates:
@@ -60,6 +217,9 @@ def cache_af(ttl: int = 30 * 60, use_stale_ttl: int = 120 * 60):
 
     ttl is the time cache is considered fresh and not udpdated
     use_stale_ttl is the time to use stale cached data and refresh it in the background. Not blocking the request
+
+    With CACHE_SNAPSHOT_DIR set the values are also saved there (msgpack) and a restarted worker
+    serves them as stale entries while it revalidates them.
     """
 
     def decorator(func):
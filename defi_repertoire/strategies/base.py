@@ -1,8 +1,13 @@
+import importlib
 from collections import defaultdict
+from collections.abc import Mapping
+from decimal import Decimal
 from typing import (
     Annotated,
     Any,
+    Callable,
     Dict,
+    NamedTuple,
     Optional,
     Protocol,
     Type,
@@ -13,14 +18,27 @@ from typing import (
 from defabipedia import Chain
 from defabipedia.types import Blockchain
 from eth_utils.address import is_checksum_formatted_address
-from pydantic import BaseModel, Field, create_model
+from pydantic import (
+    BaseModel,
+    Field,
+    SerializationInfo,
+    TypeAdapter,
+    create_model,
+    model_serializer,
+    model_validator,
+)
 from pydantic.functional_validators import AfterValidator
 from roles_royce import Transactable
 from roles_royce.utils import to_checksum_address
 from web3 import Web3
 
+from defi_repertoire import multicall, telemetry, tracing
+
+from .manifest import MANIFEST
+
 Amount = Annotated[int, Field(gt=0)]
 Percentage = Annotated[float, Field(ge=0, le=100)]
+PositionPercentage = Annotated[float, Field(gt=0, le=100)]
 
 
 def validate_checksum_address(address: str):
@@ -37,11 +55,24 @@ ChecksumAddress = Annotated[str, AfterValidator(validate_checksum_address)]
 
 
 class GenericTxContext:
-    def __init__(self, w3: Web3, avatar_safe_address: ChecksumAddress):
+    def __init__(
+        self,
+        w3: Web3,
+        avatar_safe_address: ChecksumAddress,
+        block: int | None = None,
+    ):
+        """
+        Args:
+            block: Block the strategies read the state at, when known. It lets them share
+                per-block cached values between contexts.
+        """
         self.w3 = w3
         self.avatar_safe_address = to_checksum_address(avatar_safe_address)
         self.blockchain = Chain.get_blockchain_from_web3(self.w3)
+        self.block = block
         self.ctx = defaultdict(dict)
+        # Trace of the request the context is used in (if any)
+        self.trace = tracing.get_trace()
 
 
 class Strategy(Protocol):
@@ -74,12 +105,29 @@ class StrategyDefinitionModel(BaseModel):
     options: dict[str, Any] | None
 
 
-class StrategyAmountArguments(BaseModel):
-    amount: Amount
+class AmountOrPercentageArguments(BaseModel):
+    """
+    Arguments with either an amount or a percentage of the avatar's position.
 
+    Strategies using them define `get_balance_query(ctx, arguments) -> BalanceQuery` and
+    get the amount with `resolve_amount`.
+    """
 
-class StrategyAmountWithSlippageArguments(BaseModel):
-    amount: Amount
+    amount: Amount | None = None
+    percentage: PositionPercentage | None = None
+
+    @model_validator(mode="after")
+    def check_amount_or_percentage(self):
+        if (self.amount is None) == (self.percentage is None):
+            raise ValueError("Either amount or percentage must be given")
+        return self
+
+
+class StrategyAmountArguments(AmountOrPercentageArguments):
+    pass
+
+
+class StrategyAmountWithSlippageArguments(AmountOrPercentageArguments):
     max_slippage: Percentage
 
 
@@ -98,19 +146,159 @@ class OptSwapArguments(BaseModel):
 class AddressOption(BaseModel):
     address: str
     label: str
+    # Token metadata, only present when the options are enriched (see defi_repertoire.tokens)
+    name: str | None = None
+    decimals: int | None = None
+    # USD liquidity of the pool or token the options are ranked by (see defi_repertoire.ranking)
+    liquidity: float | None = None
+
+    @model_serializer(mode="wrap")
+    def serialize_model(self, handler, info: SerializationInfo):
+        data = handler(self)
+        for field in ("name", "decimals", "liquidity"):
+            if getattr(self, field) is None:
+                data.pop(field, None)
+        # The strategies list leaves it out unless it is asked for
+        if info.context and not info.context.get("liquidity", True):
+            data.pop("liquidity", None)
+        return data
 
 
 T = TypeVar("T", bound=BaseModel)
 
 
-STRATEGIES: Dict[str, Strategy] = {}
+def _first(values: list[int]) -> int:
+    return values[0]
+
+
+class BalanceQuery(NamedTuple):
+    """
+    Multicall calls returning the uints that combine gives the avatar's position from.
+    """
+
+    calls: tuple[multicall.Call, ...]
+    combine: Callable[[list[int]], int] = _first
+
+
+def token_balance_query(ctx: GenericTxContext, token: str) -> BalanceQuery:
+    """Balance query of the avatar's balance of the token"""
+    return BalanceQuery(calls=(multicall.balance_of(token, ctx.avatar_safe_address),))
+
+
+def prefetch_balances(ctx: GenericTxContext, queries: list[BalanceQuery]):
+    """
+    Read the balances of the queries in one multicall and cache them in the context.
+
+    The context is pinned to the current block (if it was not) so all the balances of a batch
+    of strategies are read at the same block.
+    """
+    balances = ctx.ctx["balances"]
+    queries = [q for q in queries if q.calls not in balances]
+    if not queries:
+        return
+    if ctx.block is None:
+        ctx.block = ctx.w3.eth.block_number
+    calls = list(dict.fromkeys(call for q in queries for call in q.calls))
+    results = multicall.aggregate(ctx.w3, calls, ctx.block)
+    values = dict(zip(calls, map(multicall.decode_uint, results)))
+    for query in queries:
+        query_values = [values[call] for call in query.calls]
+        if None in query_values:
+            raise ValueError(f"Could not read the balance of {query.calls[0].target}")
+        balances[query.calls] = query.combine(query_values)
+
+
+def get_balance_queries(
+    ctx: GenericTxContext, strategy_arguments: list[tuple["Strategy", BaseModel]]
+) -> list[BalanceQuery]:
+    """Balance queries of the strategy calls given as a percentage of the position."""
+    return [
+        strategy.get_balance_query(ctx, arguments)
+        for strategy, arguments in strategy_arguments
+        if getattr(arguments, "percentage", None) is not None
+        and hasattr(strategy, "get_balance_query")
+    ]
+
+
+def resolve_amount(
+    ctx: GenericTxContext, strategy, arguments: AmountOrPercentageArguments
+) -> int:
+    """Amount of the arguments, computing it from the position if given as a percentage."""
+    if arguments.amount is not None:
+        return arguments.amount
+    query = strategy.get_balance_query(ctx, arguments)
+    prefetch_balances(ctx, [query])
+    balance = ctx.ctx["balances"][query.calls]
+    # In integers, as balances can have more digits than the decimal context
+    numerator, denominator = Decimal(str(arguments.percentage)).as_integer_ratio()
+    amount = balance * numerator // (denominator * 100)
+    if amount <= 0:
+        raise ValueError("Nothing to withdraw, the position is empty")
+    return amount
+
+
+class StrategyMetadata:
+    """
+    Type hints, validators and schemas of a Strategy, resolved once when it is registered.
+    """
+
+    def __init__(self, strategy: Strategy):
+        self.id = get_strategy_id(strategy)
+        self.description = str.strip(strategy.__doc__)
+        self.arguments_type = get_type_hints(strategy.get_txns)["arguments"]
+        self.arguments_adapter = TypeAdapter(self.arguments_type)
+        self.arguments_schema = self.arguments_type.model_json_schema()
+        if hasattr(strategy, "get_options"):
+            self.opt_types = get_type_hints(strategy.get_options)
+            self.opt_arguments_adapter = TypeAdapter(self.opt_types["arguments"])
+        else:
+            self.opt_types = {}
+            self.opt_arguments_adapter = None
+
+
+class StrategyRegistry(Mapping):
+    """
+    Strategies by id. The module of a strategy listed in the MANIFEST is imported the first
+    time the strategy is accessed.
+    """
+
+    def __init__(self):
+        self._strategies: Dict[str, Strategy] = {}
+
+    def __getitem__(self, id: str) -> Strategy:
+        if id not in self._strategies and id in MANIFEST:
+            importlib.import_module(MANIFEST[id].module)
+        return self._strategies[id]
+
+    def __iter__(self):
+        yield from MANIFEST
+        yield from (id for id in self._strategies if id not in MANIFEST)
+
+    def __len__(self):
+        return len(MANIFEST.keys() | self._strategies.keys())
+
+    def is_registered(self, id: str) -> bool:
+        return id in self._strategies
+
+    def add(self, id: str, strategy: Strategy):
+        self._strategies[id] = strategy
+
+    def load_all(self):
+        for module in {m.module for m in MANIFEST.values()}:
+            importlib.import_module(module)
+
+
+STRATEGIES = StrategyRegistry()
+STRATEGIES_METADATA: Dict[str, StrategyMetadata] = {}
 
 
 def _register_strategy(strategy: Strategy):
     id = get_strategy_id(strategy)
-    if STRATEGIES.get(id):
+    if STRATEGIES.is_registered(id):
         raise ValueError(f"Already registered {id}. Duplicated?")
-    STRATEGIES[id] = strategy
+    STRATEGIES_METADATA[id] = StrategyMetadata(strategy)
+    telemetry.instrument_strategy(strategy, id)
+    STRATEGIES.add(id, strategy)
 
 
 def register(cls):
@@ -118,22 +306,24 @@ def register(cls):
     return cls
 
 
+def get_strategy_metadata(strategy) -> StrategyMetadata:
+    metadata = STRATEGIES_METADATA.get(get_strategy_id(strategy))
+    if metadata is None:
+        # Not registered strategy
+        metadata = StrategyMetadata(strategy)
+    return metadata
+
+
 def get_strategy_arguments_type(strategy):
-    return get_type_hints(strategy.get_txns)["arguments"]
+    return get_strategy_metadata(strategy).arguments_type
 
 
 def get_strategy_opt_arguments_type(strategy):
-    if hasattr(strategy, "get_options"):
-        return get_type_hints(strategy.get_options)["arguments"]
-    else:
-        return None
+    return get_strategy_metadata(strategy).opt_types.get("arguments")
 
 
 def get_strategy_opt_types(strategy):
-    if hasattr(strategy, "get_options"):
-        return get_type_hints(strategy.get_options)
-    else:
-        return {}
+    return get_strategy_metadata(strategy).opt_types
 
 
 def get_strategy_id(strategy):
@@ -144,22 +334,30 @@ def get_strategy_by_id(strategy_id: str):
     return STRATEGIES[strategy_id]
 
 
-async def strategy_as_dict(blockchain, strategy):
+async def strategy_as_dict(
+    blockchain, strategy, enrich: bool = False, liquidity: bool = False
+):
     if hasattr(strategy, "chains") and not blockchain in strategy.chains:
         return None
 
+    metadata = get_strategy_metadata(strategy)
     options = (
         hasattr(strategy, "get_base_options")
         and await strategy.get_base_options(blockchain)
         or None
     )
+    if options and enrich:
+        from defi_repertoire import tokens
+
+        options = await tokens.enrich_options(blockchain, options)
     data = StrategyDefinitionModel(
         kind=strategy.kind,
         protocol=strategy.protocol,
         name=strategy.name,
-        id=get_strategy_id(strategy),
-        arguments=get_strategy_arguments_type(strategy).model_json_schema(),
-        options=options and options.model_dump(mode="json"),
-        description=str.strip(strategy.__doc__),
+        id=metadata.id,
+        arguments=metadata.arguments_schema,
+        options=options
+        and options.model_dump(mode="json", context={"liquidity": liquidity}),
+        description=metadata.description,
     )
     return data
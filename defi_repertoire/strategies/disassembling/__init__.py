@@ -1,7 +0,0 @@
-from . import (
-    disassembling_aura,
-    disassembling_balancer,
-    disassembling_dsr,
-    disassembling_lido,
-    disassembling_spark,
-)
@@ -3,6 +3,7 @@ from roles_royce.generic_method import Transactable
 from web3 import Web3
 from web3.types import Address, ChecksumAddress, TxParams, TxReceipt
 
+from defi_repertoire.gas import GasEstimate, estimate_gas
 from defi_repertoire.strategies.base import GenericTxContext
 
 
@@ -100,6 +101,28 @@ class Disassembler:
             web3=w3,
         )
 
+    def estimate_gas(
+        self,
+        ctx: GenericTxContext,
+        txns: list[Transactable],
+        block: int | None = None,
+    ) -> GasEstimate:
+        """Estimates the gas of the multisend batched transaction and the marginal gas of each transactable.
+
+        Args:
+            txns (list[Transactable]): List of transactions to estimate
+            block (int, optional): block number to estimate the transactions at. Defaults to the latest block.
+        Returns:
+            GasEstimate with the total gas of the multisend and the marginal gas of each transactable.
+        """
+        return estimate_gas(
+            w3=ctx.w3,
+            blockchain=ctx.blockchain,
+            avatar=ctx.avatar_safe_address,
+            txns=txns,
+            block=block,
+        )
+
 
 def validate_percentage(percentage: float) -> float:
     if percentage <= 0 or percentage > 100:
@@ -1,18 +1,28 @@
+import asyncio
 import logging
-from decimal import Decimal
 from typing import Dict
 
-import requests
 from defabipedia.aura import Abis
 from defabipedia.types import Blockchain, Chain
 from pydantic import BaseModel
 from roles_royce.generic_method import Transactable
 from roles_royce.protocols.eth import aura
 
+from defi_repertoire import ranking
 from defi_repertoire.stale_while_revalidate import cache_af
 from defi_repertoire.strategies import register
-
-from ..base import AddressOption, Amount, ChecksumAddress, GenericTxContext, Percentage
+from defi_repertoire.subgraph import SubgraphIndex, greater_than
+
+from ..base import (
+    AddressOption,
+    AmountOrPercentageArguments,
+    BalanceQuery,
+    ChecksumAddress,
+    GenericTxContext,
+    Percentage,
+    resolve_amount,
+    token_balance_query,
+)
 from . import disassembling_balancer as balancer
 
 logger = logging.getLogger(__name__)
@@ -26,24 +36,6 @@ GRAPHS[Chain.get_blockchain_by_chain_id(100)] = (
 )
 
 
-def aura_contracts_helper(
-    ctx: GenericTxContext,
-    aura_rewards_address: ChecksumAddress,
-    fraction: float | Decimal,
-) -> (str, int):
-    aura_rewards_contract = ctx.w3.eth.contract(
-        address=aura_rewards_address, abi=Abis[ctx.blockchain].BaseRewardPool.abi
-    )
-    aura_token_amount = aura_rewards_contract.functions.balanceOf(
-        ctx.avatar_safe_address
-    ).call()
-    bpt_address = aura_rewards_contract.functions.asset().call()
-
-    amount_to_redeem = int(Decimal(aura_token_amount) * Decimal(fraction))
-
-    return bpt_address, amount_to_redeem
-
-
 def aura_to_bpt_address(
     ctx: GenericTxContext, aura_rewards_address: ChecksumAddress
 ) -> str:
@@ -53,45 +45,73 @@ def aura_to_bpt_address(
     return aura_rewards_contract.functions.asset().call()
 
 
+POOL_FIELDS = """
+    id
+    totalSupply
+    depositToken {
+      id
+      decimals
+      symbol
+      name
+    }
+    lpToken {
+      id
+      decimals
+      symbol
+      name
+    }
+    gauge {
+      id
+    }
+    isFactoryPool
+    rewardPool
+"""
+MIN_POOL_SUPPLY = 500000
+
+_pool_indexes: Dict[Blockchain, SubgraphIndex] = {}
+
+
 @cache_af()
 async def fetch_pools(blockchain: Blockchain):
     logger.debug(f"\nFETCHING AURA POOLS {blockchain.name}\n")
-    req = """
-    {
-      pools(where: { totalSupply_gt: "500000" }, first: 300) {
-        id
-        totalSupply
-        depositToken {
-          id
-          decimals
-          symbol
-          name
-        }
-        lpToken {
-          id
-          decimals
-          symbol
-          name
-        }
-        gauge {
-          id
-        }
-        isFactoryPool
-        rewardPool
-      }
-    }
-    """
     graph_url = GRAPHS.get(blockchain)
     if not graph_url:
         raise ValueError(f"Blockchain not supported: {blockchain}")
 
-    response = requests.post(url=graph_url, json={"query": req})
-    return response.json()["data"]["pools"]
+    if blockchain not in _pool_indexes:
+        _pool_indexes[blockchain] = SubgraphIndex(
+            graph_url,
+            "pools",
+            POOL_FIELDS,
+            where=f'totalSupply_gt: "{MIN_POOL_SUPPLY}"',
+            keep=greater_than("totalSupply", MIN_POOL_SUPPLY),
+            fetcher="aura_pools",
+        )
+    # The pages are requested with blocking calls, out of the event loop
+    pools = await asyncio.to_thread(_pool_indexes[blockchain].sync)
+    # Ranked by the liquidity of their Balancer pools
+    try:
+        balancer_pools = await balancer.fetch_pools(blockchain)
+    except Exception as error:
+        logger.warning(f"Aura pools of {blockchain} not ranked: {error}")
+        balancer_pools = []
+    liquidity = {p["address"].lower(): p.get("liquidity") for p in balancer_pools}
+    return ranking.ranked(
+        {
+            **p,
+            "liquidity": liquidity.get((p.get("lpToken") or {}).get("id", "").lower()),
+        }
+        for p in pools
+    )
 
 
 def pools_to_options(pools) -> list[AddressOption]:
     return [
-        AddressOption(address=p["rewardPool"], label=p["depositToken"]["symbol"])
+        AddressOption(
+            address=p["rewardPool"],
+            label=p["depositToken"]["symbol"],
+            liquidity=p.get("liquidity"),
+        )
         for p in pools
     ]
 
@@ -105,9 +125,8 @@ class Withdraw:
     id = "withdraw"
     name = "Withdraw"
 
-    class Args(BaseModel):
+    class Args(AmountOrPercentageArguments):
         rewards_address: ChecksumAddress
-        amount: Amount
 
     class OptArgs(BaseModel):
         rewards_address: ChecksumAddress
@@ -120,10 +139,15 @@ class Withdraw:
         pools = await fetch_pools(blockchain)
         return cls.BaseOptions(rewards_address=pools_to_options(pools))
 
+    @classmethod
+    def get_balance_query(cls, ctx: GenericTxContext, arguments: Args) -> BalanceQuery:
+        return token_balance_query(ctx, arguments.rewards_address)
+
     @classmethod
     def get_txns(cls, ctx: GenericTxContext, arguments: Args) -> list[Transactable]:
         withdraw_aura = aura.WithdrawAndUndwrapStakedBPT(
-            reward_address=arguments.rewards_address, amount=arguments.amount
+            reward_address=arguments.rewards_address,
+            amount=resolve_amount(ctx, cls, arguments),
         )
         return [withdraw_aura]
 
@@ -139,10 +163,9 @@ class WithdrawProportional:
     id = "withdraw_proportional"
     name = "Withdraw proportional"
 
-    class Args(BaseModel):
+    class Args(AmountOrPercentageArguments):
         rewards_address: ChecksumAddress
         max_slippage: Percentage
-        amount: Amount
 
     class OptArgs(BaseModel):
         rewards_address: ChecksumAddress
@@ -155,10 +178,14 @@ class WithdrawProportional:
         pools = await fetch_pools(blockchain)
         return cls.BaseOptions(rewards_address=pools_to_options(pools))
 
+    @classmethod
+    def get_balance_query(cls, ctx: GenericTxContext, arguments: Args) -> BalanceQuery:
+        return token_balance_query(ctx, arguments.rewards_address)
+
     @classmethod
     def get_txns(cls, ctx: GenericTxContext, arguments: Args) -> list[Transactable]:
         txns = []
-        amount = arguments.amount
+        amount = resolve_amount(ctx, cls, arguments)
 
         aura_reward_address = arguments.rewards_address
         aura_txns = Withdraw.get_txns(
@@ -193,11 +220,10 @@ class WithdrawSingle:
     id = "withdraw_single_token"
     name = "Withdraw (Single Token)"
 
-    class Args(BaseModel):
+    class Args(AmountOrPercentageArguments):
         rewards_address: ChecksumAddress
         max_slippage: Percentage
         token_out_address: ChecksumAddress
-        amount: Amount
 
     class OptArgs(BaseModel):
         rewards_address: ChecksumAddress
@@ -235,13 +261,17 @@ class WithdrawSingle:
             token_out_address=balancer_options.token_out_address,
         )
 
+    @classmethod
+    def get_balance_query(cls, ctx: GenericTxContext, arguments: Args) -> BalanceQuery:
+        return token_balance_query(ctx, arguments.rewards_address)
+
     @classmethod
     def get_txns(cls, ctx: GenericTxContext, arguments: Args) -> list[Transactable]:
 
         aura_rewards_address = arguments.rewards_address
         max_slippage = arguments.max_slippage
         token_out_address = arguments.token_out_address
-        amount = arguments.amount
+        amount = resolve_amount(ctx, cls, arguments)
 
         bpt_address = aura_to_bpt_address(ctx, aura_rewards_address)
 
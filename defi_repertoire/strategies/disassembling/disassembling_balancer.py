@@ -1,9 +1,8 @@
+import asyncio
 import logging
 import os
-from decimal import Decimal
 from typing import Dict, Tuple
 
-import requests
 from defabipedia.balancer import Abis
 from defabipedia.types import Blockchain, Chain
 from pydantic import BaseModel
@@ -11,15 +10,20 @@ from roles_royce.generic_method import Transactable
 from roles_royce.protocols import balancer
 from web3.exceptions import ContractLogicError
 
+from defi_repertoire import ranking
 from defi_repertoire.stale_while_revalidate import cache_af
+from defi_repertoire.subgraph import SubgraphIndex, greater_than
 
 from ..base import (
     AddressOption,
-    Amount,
+    AmountOrPercentageArguments,
+    BalanceQuery,
     ChecksumAddress,
     GenericTxContext,
     Percentage,
     register,
+    resolve_amount,
+    token_balance_query,
 )
 
 logger = logging.getLogger(__name__)
@@ -43,87 +47,88 @@ GAUGE_GRAPHS[Chain.get_blockchain_by_chain_id(100)] = (
 )
 
 
-def get_bpt_amount_to_redeem_from_gauge(
-    ctx: GenericTxContext, gauge_address: ChecksumAddress, fraction: float | Decimal
-) -> int:
-    gauge_contract = ctx.w3.eth.contract(
-        address=gauge_address, abi=Abis[ctx.blockchain].Gauge.abi
-    )
-    return int(
-        Decimal(gauge_contract.functions.balanceOf(ctx.avatar_safe_address).call())
-        * Decimal(fraction)
-    )
+POOL_FIELDS = """
+    id
+    name
+    address
+    poolType
+    strategyType
+    oracleEnabled
+    symbol
+    swapEnabled
+    isPaused
+    isInRecoveryMode
+    totalLiquidity
+    tokens {
+      symbol
+      name
+      address
+    }
+"""
+MIN_POOL_LIQUIDITY = 500000
 
+GAUGE_FIELDS = """
+    id
+    symbol
+    poolAddress
+    totalSupply
+"""
 
-def get_bpt_amount_to_redeem(
-    ctx: GenericTxContext, bpt_address: ChecksumAddress, fraction: float | Decimal
-) -> int:
-    bpt_contract = ctx.w3.eth.contract(
-        address=bpt_address, abi=Abis[ctx.blockchain].UniversalBPT.abi
-    )
-
-    return int(
-        Decimal(bpt_contract.functions.balanceOf(ctx.avatar_safe_address).call())
-        * Decimal(fraction)
-    )
+_pool_indexes: Dict[Blockchain, SubgraphIndex] = {}
+_gauge_indexes: Dict[Blockchain, SubgraphIndex] = {}
 
 
 @cache_af()
 async def fetch_pools(blockchain: Blockchain):
     logger.debug(f"\nFETCHING BALANCER POOLS {blockchain.name}\n")
 
-    req = """
-    {
-      pools(where: { totalLiquidity_gt: "500000" }, orderBy: totalLiquidity) {
-        name
-        address
-        poolType
-        strategyType
-        oracleEnabled
-        symbol
-        swapEnabled
-        isPaused
-        isInRecoveryMode
-        totalLiquidity
-        tokens {
-          symbol
-          name
-          address
-        }
-      }
-    }
-    """
-
     graph_url = GRAPHS.get(blockchain)
     if not graph_url:
         raise ValueError(f"Blockchain not supported: {blockchain}")
 
-    response = requests.post(url=graph_url, json={"query": req})
-    res = response.json()
-    return res["data"]["pools"]
+    if blockchain not in _pool_indexes:
+        _pool_indexes[blockchain] = SubgraphIndex(
+            graph_url,
+            "pools",
+            POOL_FIELDS,
+            where=f'totalLiquidity_gt: "{MIN_POOL_LIQUIDITY}"',
+            keep=greater_than("totalLiquidity", MIN_POOL_LIQUIDITY),
+            order_by="totalLiquidity",
+            key="address",
+            fetcher="balancer_pools",
+        )
+    # The pages are requested with blocking calls, out of the event loop
+    pools = await asyncio.to_thread(_pool_indexes[blockchain].sync)
+    return ranking.ranked(
+        {**p, "liquidity": ranking.to_liquidity(p["totalLiquidity"])} for p in pools
+    )
 
 
 @cache_af()
 async def fetch_gauges(blockchain: Blockchain):
     logger.debug(f"\nFETCHING BALANCER GAUGES {blockchain.name}\n")
 
-    req = """
-    {
-      liquidityGauges(first: 1000, orderBy: totalSupply) {
-        id
-        symbol
-        poolAddress
-      }
-    }
-    """
     graph_url = GAUGE_GRAPHS.get(blockchain)
     if not graph_url:
         raise ValueError(f"Blockchain not supported: {blockchain}")
 
-    response = requests.post(url=graph_url, json={"query": req})
-
-    res = response.json()
-    return res["data"]["liquidityGauges"]
+    if blockchain not in _gauge_indexes:
+        _gauge_indexes[blockchain] = SubgraphIndex(
+            graph_url,
+            "liquidityGauges",
+            GAUGE_FIELDS,
+            order_by="totalSupply",
+            fetcher="balancer_gauges",
+        )
+    gauges = await asyncio.to_thread(_gauge_indexes[blockchain].sync)
+    # Ranked by the liquidity of their pools, after the gauges are fetched
+    try:
+        pools = await fetch_pools(blockchain)
+    except Exception as error:
+        logger.warning(f"Balancer gauges of {blockchain} not ranked: {error}")
+        pools = []
+    liquidity = {p["address"].lower(): p.get("liquidity") for p in pools}
+    return ranking.with_liquidity(gauges, liquidity, field="poolAddress")
 
 
 def get_contract_mode(
@@ -153,17 +158,20 @@ class WithdrawAllAssetsProportional:
     id = "withdraw_all_assets_proportional"
     name = "Withdraw Proportionally"
 
-    class Args(BaseModel):
+    class Args(AmountOrPercentageArguments):
         bpt_address: ChecksumAddress
         max_slippage: Percentage
-        amount: Amount
+
+    @classmethod
+    def get_balance_query(cls, ctx: GenericTxContext, arguments: Args) -> BalanceQuery:
+        return token_balance_query(ctx, arguments.bpt_address)
 
     @classmethod
     def get_txns(cls, ctx: GenericTxContext, arguments: Args) -> list[Transactable]:
 
         bpt_address = arguments.bpt_address
         max_slippage = arguments.max_slippage / 100
-        amount = arguments.amount
+        amount = resolve_amount(ctx, cls, arguments)
 
         bpt_contract = ctx.w3.eth.contract(
             address=bpt_address, abi=Abis[ctx.blockchain].UniversalBPT.abi
@@ -207,9 +215,8 @@ class WithdrawSingle:
     id = "withdraw_single"
     name = "Withdraw (Single Token)"
 
-    class Args(BaseModel):
+    class Args(AmountOrPercentageArguments):
         bpt_address: ChecksumAddress
-        amount: Amount
         max_slippage: Percentage
         token_out_address: ChecksumAddress
 
@@ -230,7 +237,12 @@ class WithdrawSingle:
         pools = await fetch_pools(blockchain)
         return cls.BaseOptions(
             bpt_address=[
-                AddressOption(address=p["address"], label=p["symbol"]) for p in pools
+                AddressOption(
+                    address=p["address"],
+                    label=p["symbol"],
+                    liquidity=p.get("liquidity"),
+                )
+                for p in pools
             ]
         )
 
@@ -255,6 +267,10 @@ class WithdrawSingle:
             ]
         )
 
+    @classmethod
+    def get_balance_query(cls, ctx: GenericTxContext, arguments: Args) -> BalanceQuery:
+        return token_balance_query(ctx, arguments.bpt_address)
+
     @classmethod
     def get_txns(
         cls,
@@ -265,7 +281,7 @@ class WithdrawSingle:
         bpt_address = arguments.bpt_address
         max_slippage = arguments.max_slippage / 100
         token_out_address = arguments.token_out_address
-        amount = arguments.amount
+        amount = resolve_amount(ctx, cls, arguments)
 
         bpt_contract = ctx.w3.eth.contract(
             address=bpt_address, abi=Abis[ctx.blockchain].UniversalBPT.abi
@@ -302,9 +318,8 @@ class WithdrawProportional:
     id = "withdraw_proportional"
     name = "Withdraw Proportionally"
 
-    class Args(BaseModel):
+    class Args(AmountOrPercentageArguments):
         bpt_address: ChecksumAddress
-        amount: Amount
 
     class BaseOptions(BaseModel):
         bpt_address: list[AddressOption]
@@ -317,10 +332,19 @@ class WithdrawProportional:
         pools = await fetch_pools(blockchain)
         return cls.BaseOptions(
             bpt_address=[
-                AddressOption(address=p["address"], label=p["symbol"]) for p in pools
+                AddressOption(
+                    address=p["address"],
+                    label=p["symbol"],
+                    liquidity=p.get("liquidity"),
+                )
+                for p in pools
             ]
         )
 
+    @classmethod
+    def get_balance_query(cls, ctx: GenericTxContext, arguments: Args) -> BalanceQuery:
+        return token_balance_query(ctx, arguments.bpt_address)
+
     @classmethod
     def get_txns(
         cls,
@@ -329,7 +353,7 @@ class WithdrawProportional:
     ) -> list[Transactable]:
 
         bpt_address = arguments.bpt_address
-        amount = arguments.amount
+        amount = resolve_amount(ctx, cls, arguments)
 
         bpt_contract = ctx.w3.eth.contract(
             address=bpt_address, abi=Abis[ctx.blockchain].UniversalBPT.abi
@@ -366,9 +390,8 @@ class UnstakeAndWithdrawProportional:
     id = "unstake_withdraw_proportional"
     name = "Unstake + Withdraw (proportional)"
 
-    class Args(BaseModel):
+    class Args(AmountOrPercentageArguments):
         gauge_address: ChecksumAddress
-        amount: Amount
         max_slippage: Percentage
 
     class BaseOptions(BaseModel):
@@ -385,18 +408,23 @@ class UnstakeAndWithdrawProportional:
                 AddressOption(
                     label=p["symbol"],
                     address=p["id"],
+                    liquidity=p.get("liquidity"),
                 )
                 for p in gauges
             ]
         )
 
+    @classmethod
+    def get_balance_query(cls, ctx: GenericTxContext, arguments: Args) -> BalanceQuery:
+        return token_balance_query(ctx, arguments.gauge_address)
+
     @classmethod
     def get_txns(cls, ctx: GenericTxContext, arguments: Args) -> list[Transactable]:
 
         txns = []
         gauge_address = arguments.gauge_address
         max_slippage = arguments.max_slippage / 100
-        amount = arguments.amount
+        amount = resolve_amount(ctx, cls, arguments)
 
         unstake_gauge = balancer.UnstakeFromGauge(
             blockchain=ctx.blockchain,
@@ -436,9 +464,8 @@ class UnstakeAndWithdrawSingleToken:
     id = "unstake_withdraw_single"
     name = "Unstake + Windraw (Single Token)"
 
-    class Args(BaseModel):
+    class Args(AmountOrPercentageArguments):
         gauge_address: ChecksumAddress
-        amount: Amount
         max_slippage: Percentage
         token_out_address: ChecksumAddress
 
@@ -459,13 +486,16 @@ class UnstakeAndWithdrawSingleToken:
                 AddressOption(
                     label=p["symbol"],
                     address=p["id"],
+                    liquidity=p.get("liquidity"),
                 )
                 for p in gauges
             ]
         )
 
     @classmethod
-    async def get_options(cls, blockchain: Blockchain, arguments: OptArgs):
+    async def get_options(
+        cls, blockchain: Blockchain, arguments: OptArgs
+    ) -> WithdrawSingle.Options:
         gauges = await fetch_gauges(blockchain)
         gauge = next(
             (
@@ -482,11 +512,15 @@ class UnstakeAndWithdrawSingleToken:
             blockchain, WithdrawSingle.OptArgs(bpt_address=gauge["poolAddress"])
         )
 
+    @classmethod
+    def get_balance_query(cls, ctx: GenericTxContext, arguments: Args) -> BalanceQuery:
+        return token_balance_query(ctx, arguments.gauge_address)
+
     @classmethod
     def get_txns(cls, ctx: GenericTxContext, arguments: Args) -> list[Transactable]:
         gauge_address = arguments.gauge_address
         token_out_address = arguments.token_out_address
-        amount = arguments.amount
+        amount = resolve_amount(ctx, cls, arguments)
 
         max_slippage = arguments.max_slippage / 100
 
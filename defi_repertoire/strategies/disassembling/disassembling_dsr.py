@@ -5,7 +5,32 @@ from roles_royce.generic_method import Transactable
 from roles_royce.protocols.base import Address
 from roles_royce.protocols.eth import maker
 
-from ..base import GenericTxContext, StrategyAmountArguments, register
+from defi_repertoire import multicall
+
+from ..base import (
+    BalanceQuery,
+    GenericTxContext,
+    StrategyAmountArguments,
+    register,
+    resolve_amount,
+)
+
+RAY = 10**27
+
+
+def _pie_to_dai(values: list[int]) -> int:
+    pie, chi = values
+    return pie * chi // RAY
+
+
+def get_proxy_address(ctx: GenericTxContext) -> str:
+    dsr_ctx = ctx.ctx["dsr"]
+    if "proxy_address" not in dsr_ctx:
+        proxy_registry = ContractSpecs[ctx.blockchain].ProxyRegistry.contract(ctx.w3)
+        dsr_ctx["proxy_address"] = proxy_registry.functions.proxies(
+            ctx.avatar_safe_address
+        ).call()
+    return dsr_ctx["proxy_address"]
 
 
 @register
@@ -17,15 +42,32 @@ class WithdrawWithProxy:
     id = "withdraw_with_proxy"
     name = "Withdraw with Proxy"
 
+    @classmethod
+    def get_balance_query(
+        cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
+    ) -> BalanceQuery:
+        # DAI in the DSR of the proxy: pie * chi
+        pot = ContractSpecs[ctx.blockchain].Pot.address
+        pie = multicall.encode_call(
+            "pie(address)", ["address"], [get_proxy_address(ctx)]
+        )
+        return BalanceQuery(
+            calls=(
+                multicall.Call(pot, pie),
+                multicall.Call(pot, multicall.encode_call("chi()")),
+            ),
+            combine=_pie_to_dai,
+        )
+
     @classmethod
     def get_txns(
         cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
     ) -> list[Transactable]:
-        proxy_registry = ContractSpecs[ctx.blockchain].ProxyRegistry.contract(ctx.w3)
-        proxy_address = proxy_registry.functions.proxies(ctx.avatar_safe_address).call()
+        proxy_address = get_proxy_address(ctx)
+        amount = resolve_amount(ctx, cls, arguments)
 
-        approve_dai = maker.ApproveDAI(spender=proxy_address, amount=arguments.amount)
-        exit_dai = maker.ProxyActionExitDsr(proxy=proxy_address, wad=arguments.amount)
+        approve_dai = maker.ApproveDAI(spender=proxy_address, amount=amount)
+        exit_dai = maker.ProxyActionExitDsr(proxy=proxy_address, wad=amount)
 
         return [approve_dai, exit_dai]
 
@@ -39,16 +81,34 @@ class WithdrawWithoutProxy:
     id = "withdraw_without_proxy"
     name = "Withdraw without Proxy"
 
+    @classmethod
+    def get_balance_query(
+        cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
+    ) -> BalanceQuery:
+        # DAI in the DSR of the avatar: pie * chi
+        pie = multicall.encode_call(
+            "pieOf(address)", ["address"], [ctx.avatar_safe_address]
+        )
+        return BalanceQuery(
+            calls=(
+                multicall.Call(ContractSpecs[ctx.blockchain].DsrManager.address, pie),
+                multicall.Call(
+                    ContractSpecs[ctx.blockchain].Pot.address,
+                    multicall.encode_call("chi()"),
+                ),
+            ),
+            combine=_pie_to_dai,
+        )
+
     @classmethod
     def get_txns(
         cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
     ) -> list[Transactable]:
+        amount = resolve_amount(ctx, cls, arguments)
         dsr_manager_address = (
             ContractSpecs[ctx.blockchain].DsrManager.contract(ctx.w3).address
         )
-        approve_dai = maker.ApproveDAI(
-            spender=dsr_manager_address, amount=arguments.amount
-        )
-        exit_dai = maker.ExitDsr(avatar=ctx.avatar_safe_address, wad=arguments.amount)
+        approve_dai = maker.ApproveDAI(spender=dsr_manager_address, amount=amount)
+        exit_dai = maker.ExitDsr(avatar=ctx.avatar_safe_address, wad=amount)
 
         return [approve_dai, exit_dai]
@@ -1,9 +1,107 @@
+import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
 from defabipedia import Chain
 from defabipedia.lido import ContractSpecs
+from defabipedia.types import Blockchain
+from pydantic import BaseModel
 from roles_royce.generic_method import Transactable
 from roles_royce.protocols.eth import lido
+from roles_royce.utils import to_checksum_address
+from web3 import Web3
+
+from defi_repertoire import multicall, tracing
+
+from ..base import (
+    BalanceQuery,
+    ChecksumAddress,
+    GenericTxContext,
+    StrategyAmountArguments,
+    register,
+    resolve_amount,
+)
+
+# Limits of the amount of stETH of each withdrawal request
+MIN_STETH_WITHDRAWAL_AMOUNT = 100
+MAX_STETH_WITHDRAWAL_AMOUNT = 1000_000_000_000_000_000_000
+
+# Request ids per getWithdrawalStatus / findCheckpointHints call
+REQUESTS_PAGE_SIZE = 500
+MAX_WORKERS = 8
+
+# wstETH chunk limits of the last blocks, by node endpoint, blockchain and block
+LIMITS_CACHE_SIZE = 256
+_limits_by_block: OrderedDict[tuple, tuple[int, int]] = OrderedDict()
+_limits_lock = Lock()
+
+
+def plan_chunks(amount: int, max_chunk: int, min_chunk: int = 1) -> list[int]:
+    """
+    Split amount into the fewest withdrawal requests of at most max_chunk and at least min_chunk.
+    """
+    if amount < min_chunk:
+        raise ValueError(f"Amount {amount} is less than the minimum of {min_chunk}")
+    full_chunks, rest = divmod(amount, max_chunk)
+    chunks = [max_chunk] * full_chunks
+    if rest:
+        chunks.append(rest)
+        if rest < min_chunk:
+            # Move part of the previous chunk to the last one
+            chunks[-2] -= min_chunk - rest
+            chunks[-1] = min_chunk
+    return chunks
+
+
+def _read_wsteth_chunk_limits(w3: Web3, blockchain: Blockchain, block: int | str):
+    contract = ContractSpecs[blockchain].wstETH.contract(w3)
+    max_chunk = contract.functions.getWstETHByStETH(MAX_STETH_WITHDRAWAL_AMOUNT).call(
+        block_identifier=block
+    )
+    # Round up (plus one wei of margin) so the chunk is worth at least the minimum of stETH
+    min_chunk = -(
+        -MIN_STETH_WITHDRAWAL_AMOUNT * max_chunk // MAX_STETH_WITHDRAWAL_AMOUNT
+    )
+    return min_chunk + 1, max_chunk
+
+
+def _wsteth_chunk_limits_by_block(w3: Web3, blockchain: Blockchain, block: int):
+    """
+    The limits at a block, cached by the endpoint of the node and not by w3, so the cache
+    does not keep the Web3 instances alive.
+    """
+    endpoint = getattr(w3.provider, "endpoint_uri", None)
+    if endpoint is None:
+        return _read_wsteth_chunk_limits(w3, blockchain, block)
+    key = (str(endpoint), blockchain, block)
+    with _limits_lock:
+        if key in _limits_by_block:
+            _limits_by_block.move_to_end(key)
+            return _limits_by_block[key]
+    limits = _read_wsteth_chunk_limits(w3, blockchain, block)
+    with _limits_lock:
+        _limits_by_block[key] = limits
+        if len(_limits_by_block) > LIMITS_CACHE_SIZE:
+            _limits_by_block.popitem(last=False)
+    return limits
+
 
-from ..base import GenericTxContext, StrategyAmountArguments, register
+def get_wsteth_chunk_limits(ctx: GenericTxContext) -> tuple[int, int]:
+    """
+    Min and max amounts of wstETH of a withdrawal request.
+
+    The limits depend on the wstETH rate, which is cached for the context and, when the
+    context is pinned to a block, for every context at the same block.
+    """
+    lido_ctx = ctx.ctx["lido"]
+    if "wsteth_chunk_limits" not in lido_ctx:
+        if ctx.block is None:
+            limits = _read_wsteth_chunk_limits(ctx.w3, ctx.blockchain, "latest")
+        else:
+            limits = _wsteth_chunk_limits_by_block(ctx.w3, ctx.blockchain, ctx.block)
+        lido_ctx["wsteth_chunk_limits"] = limits
+    return lido_ctx["wsteth_chunk_limits"]
 
 
 @register
@@ -18,35 +116,29 @@ class LidoUnstakeStETH:
     name = "Unstake stETH"
     chains = [Chain.ETHEREUM]
 
+    @classmethod
+    def get_balance_query(
+        cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
+    ) -> BalanceQuery:
+        steth = ContractSpecs[ctx.blockchain].stETH.address
+        return BalanceQuery(
+            calls=(multicall.balance_of(steth, ctx.avatar_safe_address),)
+        )
+
     @classmethod
     def get_txns(
         cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
     ) -> list[Transactable]:
-        amount_to_redeem = arguments.amount
-        chunk_amount = amount_to_redeem
-        if chunk_amount > 1000_000_000_000_000_000_000:
-            chunks = []
-            while chunk_amount >= 1000_000_000_000_000_000_000:
-                chunks.append(1000_000_000_000_000_000_000)
-                chunk_amount -= 1000_000_000_000_000_000_000
-            if chunk_amount > 0:
-                chunks.append(chunk_amount)
-
-            set_allowance = lido.ApproveWithdrawalStETHWithUnstETH(
-                amount=amount_to_redeem
-            )
-            request_withdrawal = lido.RequestWithdrawalsStETH(
-                amounts=chunks, avatar=ctx.avatar_safe_address
-            )
-
-        else:
-            set_allowance = lido.ApproveWithdrawalStETHWithUnstETH(
-                amount=amount_to_redeem
-            )
-            request_withdrawal = lido.RequestWithdrawalsStETH(
-                amounts=[amount_to_redeem], avatar=ctx.avatar_safe_address
-            )
-
+        amount_to_redeem = resolve_amount(ctx, cls, arguments)
+        chunks = plan_chunks(
+            amount_to_redeem,
+            max_chunk=MAX_STETH_WITHDRAWAL_AMOUNT,
+            min_chunk=MIN_STETH_WITHDRAWAL_AMOUNT,
+        )
+        set_allowance = lido.ApproveWithdrawalStETHWithUnstETH(amount=amount_to_redeem)
+        request_withdrawal = lido.RequestWithdrawalsStETH(
+            amounts=chunks, avatar=ctx.avatar_safe_address
+        )
         return [set_allowance, request_withdrawal]
 
 
@@ -62,34 +154,149 @@ class LidoUnwrapAndUnstakeWstETH:
     name = "Unwrap + Unstake wstETH"
     chains = [Chain.ETHEREUM]
 
+    @classmethod
+    def get_balance_query(
+        cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
+    ) -> BalanceQuery:
+        wsteth = ContractSpecs[ctx.blockchain].wstETH.address
+        return BalanceQuery(
+            calls=(multicall.balance_of(wsteth, ctx.avatar_safe_address),)
+        )
+
     @classmethod
     def get_txns(
         cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
     ) -> list[Transactable]:
+        amount_to_redeem = resolve_amount(ctx, cls, arguments)
+        min_chunk, max_chunk = get_wsteth_chunk_limits(ctx)
+        chunks = plan_chunks(amount_to_redeem, max_chunk=max_chunk, min_chunk=min_chunk)
+        set_allowance = lido.ApproveWithdrawalWstETH(amount=amount_to_redeem)
+        request_withdrawal = lido.RequestWithdrawalsWstETH(
+            amounts=chunks, avatar=ctx.avatar_safe_address
+        )
+        return [set_allowance, request_withdrawal]
+
+
+def _pages(items: list, size: int) -> list[list]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
 
-        contract = ContractSpecs[ctx.blockchain].wstETH.contract(ctx.w3)
-        amount_for_list = contract.functions.getWstETHByStETH(
-            1_000_000_000_000_000_000_000
-        ).call()  # just to be safe that the chunk size is too big
-        amount_to_redeem = arguments.amount
-        chunk_amount = amount_to_redeem
-        if chunk_amount > amount_for_list:
-            chunks = []
-            while chunk_amount >= amount_for_list:
-                chunks.append(amount_for_list)
-                chunk_amount -= amount_for_list
-            if chunk_amount > 0:
-                chunks.append(chunk_amount)
-
-            set_allowance = lido.ApproveWithdrawalWstETH(amount=amount_to_redeem)
-            request_withdrawal = lido.RequestWithdrawalsWstETH(
-                amounts=chunks, avatar=ctx.avatar_safe_address
+
+def get_claimable_requests(
+    ctx: GenericTxContext, request_ids: list[int] | None = None
+) -> tuple[list[int], list[int]]:
+    """
+    Finalized and not yet claimed withdrawal requests of the avatar and their checkpoint hints.
+
+    The statuses and the hints are read in pages of ids, concurrently, so with the batching
+    provider they go out in a few JSON-RPC batches instead of one call per request.
+
+    Args:
+        request_ids: Requests to check. Defaults to all the pending requests of the avatar.
+
+    Returns:
+        The sorted request ids and their hints.
+    """
+    block = ctx.block if ctx.block is not None else "latest"
+    contract = ContractSpecs[ctx.blockchain].unstETH.contract(ctx.w3)
+    if request_ids is None:
+        request_ids = contract.functions.getWithdrawalRequests(
+            ctx.avatar_safe_address
+        ).call(block_identifier=block)
+    # findCheckpointHints needs the ids sorted
+    request_ids = sorted(request_ids)
+    if not request_ids:
+        return [], []
+
+    def get_statuses(ids):
+        return contract.functions.getWithdrawalStatus(ids).call(block_identifier=block)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        statuses = [
+            status
+            for page in executor.map(
+                tracing.propagate(get_statuses), _pages(request_ids, REQUESTS_PAGE_SIZE)
             )
+            for status in page
+        ]
+        # status: (amountOfStETH, amountOfShares, owner, timestamp, isFinalized, isClaimed)
+        claimable = [
+            id
+            for id, status in zip(request_ids, statuses)
+            if status[4] and not status[5]
+        ]
+        if not claimable:
+            return [], []
 
-        else:
-            set_allowance = lido.ApproveWithdrawalWstETH(amount=amount_to_redeem)
-            request_withdrawal = lido.RequestWithdrawalsWstETH(
-                amounts=[amount_to_redeem], avatar=ctx.avatar_safe_address
+        last_index = contract.functions.getLastCheckpointIndex().call(
+            block_identifier=block
+        )
+
+        def get_hints(ids):
+            return contract.functions.findCheckpointHints(ids, 1, last_index).call(
+                block_identifier=block
             )
 
-        return [set_allowance, request_withdrawal]
+        hints = [
+            hint
+            for page in executor.map(
+                tracing.propagate(get_hints), _pages(claimable, REQUESTS_PAGE_SIZE)
+            )
+            for hint in page
+        ]
+    return claimable, hints
+
+
+@register
+class ClaimWithdrawals:
+    """
+    Claims the ETH of the finalized Lido withdrawal requests
+    """
+
+    kind = "disassembly"
+    protocol = "lido"
+    id = "claim_withdrawals"
+    name = "Claim withdrawals"
+    chains = [Chain.ETHEREUM]
+
+    class Args(BaseModel):
+        # Defaults to all the pending requests of the avatar
+        request_ids: list[int] | None = None
+
+    @classmethod
+    def get_txns(cls, ctx: GenericTxContext, arguments: Args) -> list[Transactable]:
+        request_ids, hints = get_claimable_requests(ctx, arguments.request_ids)
+        if not request_ids:
+            raise ValueError("No finalized withdrawal requests to claim")
+        return [lido.ClaimWithdrawals(request_ids=request_ids, hints=hints)]
+
+
+def plan_withdrawals(
+    w3: Web3,
+    amounts: dict[ChecksumAddress, int],
+    wrapped: bool = False,
+    block: int | None = None,
+) -> dict[ChecksumAddress, list[Transactable]]:
+    """
+    Withdrawal request transactions of many avatars.
+
+    Args:
+        amounts: Amount of stETH (or wstETH if wrapped) to withdraw of each avatar.
+        wrapped: Withdraw wstETH instead of stETH.
+        block: Block of the wstETH rate. The rate is read only once for all the avatars.
+    """
+    strategy = LidoUnwrapAndUnstakeWstETH if wrapped else LidoUnstakeStETH
+    txns = {}
+    base_ctx = None
+    for avatar, amount in amounts.items():
+        if base_ctx is None:
+            ctx = base_ctx = GenericTxContext(
+                w3=w3, avatar_safe_address=avatar, block=block
+            )
+        else:
+            # Share the blockchain and the cached values (same block) between the avatars
+            ctx = copy.copy(base_ctx)
+            ctx.avatar_safe_address = to_checksum_address(avatar)
+        txns[ctx.avatar_safe_address] = strategy.get_txns(
+            ctx=ctx, arguments=StrategyAmountArguments(amount=amount)
+        )
+    return txns
@@ -3,17 +3,26 @@ from decimal import Decimal
 from defabipedia.spark import ContractSpecs
 from defabipedia.tokens import Addresses
 from roles_royce.generic_method import Transactable
-from roles_royce.protocols import cowswap
 from roles_royce.protocols.eth import spark
 
+from defi_repertoire import cowswap_orders
+from defi_repertoire.cowswap_orders import OrderRequest
+
 from ..base import (
+    BalanceQuery,
     GenericTxContext,
     StrategyAmountArguments,
     StrategyAmountWithSlippageArguments,
     register,
+    resolve_amount,
+    token_balance_query,
 )
 
 
+def sdai_balance_query(ctx: GenericTxContext) -> BalanceQuery:
+    return token_balance_query(ctx, ContractSpecs[ctx.blockchain].sDAI.address)
+
+
 @register
 class WithdrawWithProxy:
     """Withdraw funds from Spark with proxy."""
@@ -23,13 +32,19 @@ class WithdrawWithProxy:
     id = "withdraw_with_proxy"
     name = "Withdraw with Proxy"
 
+    @classmethod
+    def get_balance_query(
+        cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
+    ) -> BalanceQuery:
+        return sdai_balance_query(ctx)
+
     @classmethod
     def get_txns(
         cls, ctx: GenericTxContext, arguments: StrategyAmountArguments
     ) -> list[Transactable]:
         exit_sdai = spark.RedeemSDAIforDAI(
             blockchain=ctx.blockchain,
-            amount=arguments.amount,
+            amount=resolve_amount(ctx, cls, arguments),
             avatar=ctx.avatar_safe_address,
         )
         return [exit_sdai]
@@ -48,25 +63,24 @@ class CowSwapSDAIToUSDC:
     name = "Cowswap sDAI for USDC"
 
     @classmethod
-    def get_txns(
+    def get_balance_query(
         cls, ctx: GenericTxContext, arguments: StrategyAmountWithSlippageArguments
-    ) -> list[Transactable]:
-        max_slippage = arguments.max_slippage / 100
-        amount = arguments.amount
-
-        if "anvil" in ctx.w3.client_version:
-            fork = True
-        else:
-            fork = False
+    ) -> BalanceQuery:
+        return sdai_balance_query(ctx)
 
-        return cowswap.create_order_and_swap(
-            w3=ctx.w3,
-            avatar=ctx.avatar_safe_address,
+    @classmethod
+    def get_order_request(
+        cls, ctx: GenericTxContext, arguments: StrategyAmountWithSlippageArguments
+    ) -> OrderRequest:
+        return OrderRequest(
             sell_token=ContractSpecs[ctx.blockchain].sDAI.address,
             buy_token=Addresses[ctx.blockchain].USDC,
-            amount=amount,
-            kind=cowswap.SwapKind.SELL,
-            max_slippage=max_slippage,
-            valid_duration=20 * 60,
-            fork=fork,
+            amount=resolve_amount(ctx, cls, arguments),
+            max_slippage=arguments.max_slippage / 100,
         )
+
+    @classmethod
+    def get_txns(
+        cls, ctx: GenericTxContext, arguments: StrategyAmountWithSlippageArguments
+    ) -> list[Transactable]:
+        return cowswap_orders.get_order(ctx, cls.get_order_request(ctx, arguments))
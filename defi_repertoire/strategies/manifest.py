@@ -0,0 +1,129 @@
+"""
+Lightweight description of the available strategies.
+
+It lets the API list and route strategies without importing the protocol modules (and their
+dependencies). A strategy module is imported the first time one of its strategies is used.
+"""
+
+from typing import Dict, NamedTuple
+
+DISASSEMBLING = "defi_repertoire.strategies.disassembling"
+SWAPPING = "defi_repertoire.strategies.swapping"
+
+
+class StrategyManifest(NamedTuple):
+    id: str
+    kind: str
+    protocol: str
+    module: str
+
+
+MANIFEST: Dict[str, StrategyManifest] = {
+    m.id: m
+    for m in [
+        # disassembling
+        StrategyManifest(
+            "aura__withdraw",
+            "disassembly",
+            "aura",
+            f"{DISASSEMBLING}.disassembling_aura",
+        ),
+        StrategyManifest(
+            "aura__withdraw_proportional",
+            "disassembly",
+            "aura",
+            f"{DISASSEMBLING}.disassembling_aura",
+        ),
+        StrategyManifest(
+            "aura__withdraw_single_token",
+            "disassembly",
+            "aura",
+            f"{DISASSEMBLING}.disassembling_aura",
+        ),
+        StrategyManifest(
+            "balancer__withdraw_all_assets_proportional",
+            "disassembly",
+            "balancer",
+            f"{DISASSEMBLING}.disassembling_balancer",
+        ),
+        StrategyManifest(
+            "balancer__withdraw_single",
+            "disassembly",
+            "balancer",
+            f"{DISASSEMBLING}.disassembling_balancer",
+        ),
+        StrategyManifest(
+            "balancer__withdraw_proportional",
+            "disassembly",
+            "balancer",
+            f"{DISASSEMBLING}.disassembling_balancer",
+        ),
+        StrategyManifest(
+            "balancer__unstake_withdraw_proportional",
+            "disassembly",
+            "balancer",
+            f"{DISASSEMBLING}.disassembling_balancer",
+        ),
+        StrategyManifest(
+            "balancer__unstake_withdraw_single",
+            "disassembly",
+            "balancer",
+            f"{DISASSEMBLING}.disassembling_balancer",
+        ),
+        StrategyManifest(
+            "dsr__withdraw_with_proxy",
+            "disassembly",
+            "dsr",
+            f"{DISASSEMBLING}.disassembling_dsr",
+        ),
+        StrategyManifest(
+            "dsr__withdraw_without_proxy",
+            "disassembly",
+            "dsr",
+            f"{DISASSEMBLING}.disassembling_dsr",
+        ),
+        StrategyManifest(
+            "lido__unstake_stETH",
+            "disassembly",
+            "lido",
+            f"{DISASSEMBLING}.disassembling_lido",
+        ),
+        StrategyManifest(
+            "lido__unwrap_and_unstake_wstETH",
+            "disassembly",
+            "lido",
+            f"{DISASSEMBLING}.disassembling_lido",
+        ),
+        StrategyManifest(
+            "lido__claim_withdrawals",
+            "disassembly",
+            "lido",
+            f"{DISASSEMBLING}.disassembling_lido",
+        ),
+        StrategyManifest(
+            "spark__withdraw_with_proxy",
+            "disassembly",
+            "spark",
+            f"{DISASSEMBLING}.disassembling_spark",
+        ),
+        StrategyManifest(
+            "spark__cowswap_sdai_to_usdc",
+            "disassembly",
+            "spark",
+            f"{DISASSEMBLING}.disassembling_spark",
+        ),
+        # swapping
+        StrategyManifest(
+            "balancer__swap_on_balancer", "swap", "balancer", f"{SWAPPING}.balancer"
+        ),
+        StrategyManifest(
+            "cowswap__swap_on_cowswap", "swap", "cowswap", f"{SWAPPING}.cowswap"
+        ),
+        StrategyManifest(
+            "balancer__swap_on_curve", "swap", "balancer", f"{SWAPPING}.curve"
+        ),
+        StrategyManifest(
+            "uniswapv3__swap_on_uniswapv3", "swap", "uniswapv3", f"{SWAPPING}.uniswapV3"
+        ),
+    ]
+}
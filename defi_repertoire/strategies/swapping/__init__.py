@@ -1 +0,0 @@
-from . import balancer, cowswap, curve, uniswapV3
@@ -1,14 +1,17 @@
 import asyncio
+import logging
+from typing import Iterable
 
+import requests
 from defabipedia.balancer import Chain
 from defabipedia.tokens import NATIVE
 from defabipedia.types import Blockchain
 from pydantic import BaseModel
 from roles_royce.generic_method import Transactable
-from roles_royce.protocols import cowswap
-from roles_royce.protocols.cowswap.utils import requests
 from roles_royce.protocols.swap_pools.swap_methods import WrapNativeToken
 
+from defi_repertoire import cowswap_orders, metrics, ranking
+from defi_repertoire.cowswap_orders import OrderRequest
 from defi_repertoire.stale_while_revalidate import cache_af
 from defi_repertoire.strategies.base import (
     AddressOption,
@@ -17,10 +20,12 @@ from defi_repertoire.strategies.base import (
     SwapArguments,
     register,
 )
-from defi_repertoire.utils import flatten, uniqBy
+from defi_repertoire.utils import upstream_url
 
 from .swapper import get_wrapped_token
 
+logger = logging.getLogger(__name__)
+
 GNOSIS_LISTS = [
     "https://raw.githubusercontent.com/cowprotocol/token-lists/main/src/public/GnosisUniswapTokensList.json",
     "https://raw.githubusercontent.com/cowprotocol/token-lists/main/src/public/GnosisCoingeckoTokensList.json",
@@ -38,23 +43,92 @@ ETHEREUM_LISTS = [
 ]
 
 
+# (list url, chain id) -> (ETag, Last-Modified, tokens) of the last download of each list
+_downloaded: dict[tuple[str, int], tuple[str | None, str | None, list[dict]]] = {}
+_session = requests.Session()
+
+
+def _address_key(address) -> bytes | None:
+    """20 bytes of an address in any case, None if it is not an address"""
+    try:
+        key = bytes.fromhex(address.removeprefix("0x"))
+    except (AttributeError, ValueError):
+        return None
+    return key if len(key) == 20 else None
+
+
+def download_list(url: str, chain_id: int) -> list[dict]:
+    """
+    Tokens of chain_id in the token list. The list is requested with the ETag and
+    Last-Modified of the previous download, so an unchanged list is not downloaded again.
+    """
+    previous = _downloaded.get((url, chain_id))
+    headers = {}
+    if previous:
+        etag, last_modified, _ = previous
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    with metrics.SUBGRAPH_LATENCY.labels("token_lists").time():
+        resp = _session.get(upstream_url(url), headers=headers)
+    if resp.status_code == 304 and previous:
+        return previous[2]
+    resp.raise_for_status()
+    tokens = [t for t in resp.json()["tokens"] if t.get("chainId") == chain_id]
+    _downloaded[(url, chain_id)] = (
+        resp.headers.get("ETag"),
+        resp.headers.get("Last-Modified"),
+        tokens,
+    )
+    return tokens
+
+
+def merge_lists(lists: Iterable[list[dict]]) -> list[dict]:
+    """
+    Tokens of the lists without repeated addresses (in any case). The token of the first
+    list with an address takes precedence.
+    """
+    seen = set()
+    merged = []
+    for tokens in lists:
+        for token in tokens:
+            key = _address_key(token.get("address"))
+            if key is None or key in seen:
+                continue
+            seen.add(key)
+            merged.append(token)
+    return merged
+
+
 @cache_af()
 async def fetch_tokens(blockchain: Blockchain):
     lists = {"ethereum": ETHEREUM_LISTS, "gnosis": GNOSIS_LISTS}[blockchain]
     chainId = {"ethereum": 1, "gnosis": 100}[blockchain]
 
-    async def fetch_list(url):
-        resp = requests.get(url)
-        tokens = resp.json()["tokens"]
-        return [t for t in tokens if t["chainId"] == chainId]
+    results = await asyncio.gather(
+        *[asyncio.to_thread(download_list, url, chainId) for url in lists],
+        return_exceptions=True,
+    )
+    for url, result in zip(lists, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Token list {url} failed: {result}")
+    downloaded = [r for r in results if not isinstance(r, Exception)]
+    if not downloaded:
+        raise results[0]
 
-    tokens = await asyncio.gather(*[fetch_list(url) for url in lists])
-
-    return uniqBy(flatten(tokens), "address")
+    # Token lists have no liquidity, the tokens are ranked by the one in the other swappers
+    liquidity = await ranking.token_liquidity(blockchain)
+    return ranking.with_liquidity(merge_lists(downloaded), liquidity)
 
 
 def tokens_to_options(tokens) -> list[AddressOption]:
-    return [AddressOption(address=t["address"], label=t["symbol"]) for t in tokens]
+    return [
+        AddressOption(
+            address=t["address"], label=t["symbol"], liquidity=t.get("liquidity")
+        )
+        for t in tokens
+    ]
 
 
 @register
@@ -75,42 +149,35 @@ class SwapCowswap:
         return cls.BaseOptions(token_in_address=tokens_to_options(tokens))
 
     @classmethod
-    def get_txns(
+    def get_order_request(
         cls, ctx: GenericTxContext, arguments: SwapArguments
-    ) -> list[Transactable]:
-        max_slippage = arguments.max_slippage / 100
+    ) -> OrderRequest | None:
+        if arguments.amount == 0:
+            return None
         token_in = arguments.token_in_address
-        token_out = arguments.token_out_address
-        amount = arguments.amount
-
-        txns = []
-
-        if amount == 0:
-            return []
-
-        if "anvil" in ctx.w3.client_version:
-            fork = True
-        else:
-            fork = False
-
         if token_in == NATIVE:
-            wraptoken = WrapNativeToken(blockchain=ctx.blockchain, eth_amount=amount)
-            txns.append(wraptoken)
             token_in = get_wrapped_token(ctx.blockchain)
-
-        cow_txns = cowswap.create_order_and_swap(
-            w3=ctx.w3,
-            avatar=ctx.avatar_safe_address,
+        return OrderRequest(
             sell_token=token_in,
-            buy_token=token_out,
-            amount=amount,
-            kind=cowswap.SwapKind.SELL,
-            max_slippage=max_slippage,
-            valid_duration=20 * 60,
-            fork=fork,
+            buy_token=arguments.token_out_address,
+            amount=arguments.amount,
+            max_slippage=arguments.max_slippage / 100,
         )
 
-        for cow_txn in cow_txns:
-            txns.append(cow_txn)
+    @classmethod
+    def get_txns(
+        cls, ctx: GenericTxContext, arguments: SwapArguments
+    ) -> list[Transactable]:
+        request = cls.get_order_request(ctx, arguments)
+        if request is None:
+            return []
+
+        txns = []
+        if arguments.token_in_address == NATIVE:
+            wraptoken = WrapNativeToken(
+                blockchain=ctx.blockchain, eth_amount=arguments.amount
+            )
+            txns.append(wraptoken)
 
+        txns.extend(cowswap_orders.get_order(ctx, request))
         return txns
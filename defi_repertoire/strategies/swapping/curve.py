@@ -7,6 +7,7 @@ from pydantic import BaseModel
 from roles_royce.generic_method import Transactable
 from roles_royce.protocols.swap_pools.swap_methods import ApproveCurve, SwapCurve
 
+from defi_repertoire import ranking
 from defi_repertoire.stale_while_revalidate import cache_af
 from defi_repertoire.strategies.base import (
     AddressOption,
@@ -16,7 +17,7 @@ from defi_repertoire.strategies.base import (
     SwapArguments,
     register,
 )
-from defi_repertoire.utils import flatten, uniqBy
+from defi_repertoire.utils import flatten, upstream_url
 
 from .swapper import find_reachable_tokens, get_quote, get_swap_pools
 
@@ -25,12 +26,39 @@ from .swapper import find_reachable_tokens, get_quote, get_swap_pools
 async def fetch_pools(blockchain: Blockchain):
     chain = {"ethereum": "ethereum", "gnosis": "xdai"}[blockchain]
     url = f"https://api.curve.fi/v1/getPools/big/{chain}"
-    response = requests.get(url=url)
+    response = requests.get(url=upstream_url(url))
     return response.json()["data"]["poolData"]
 
 
+def coin_liquidity(coin: dict) -> float | None:
+    """USD value of the balance of the coin in its pool"""
+    try:
+        return int(coin["poolBalance"]) / 10 ** int(coin["decimals"]) * coin["usdPrice"]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@cache_af()
+async def fetch_tokens(blockchain: Blockchain):
+    """Coins of the pools ranked by their liquidity in all of them"""
+    pools = await fetch_pools(blockchain)
+    tokens: dict[str, dict] = {}
+    for coin in flatten([p["coins"] for p in pools]):
+        key = coin["address"].lower()
+        liquidity = coin_liquidity(coin)
+        token = tokens.setdefault(key, {**coin, "liquidity": None})
+        if liquidity is not None:
+            token["liquidity"] = (token["liquidity"] or 0) + liquidity
+    return ranking.ranked(tokens.values())
+
+
 def tokens_to_options(tokens) -> list[AddressOption]:
-    return [AddressOption(address=t["address"], label=t["symbol"]) for t in tokens]
+    return [
+        AddressOption(
+            address=t["address"], label=t["symbol"], liquidity=t.get("liquidity")
+        )
+        for t in tokens
+    ]
 
 
 @register
@@ -53,8 +81,7 @@ class SwapOnCurve:
 
     @classmethod
     async def get_base_options(cls, blockchain: Blockchain) -> BaseOptions:
-        pools = await fetch_pools(blockchain)
-        tokens = uniqBy(flatten([p["coins"] for p in pools]), "address")
+        tokens = await fetch_tokens(blockchain)
         return cls.BaseOptions(token_in_address=tokens_to_options(tokens))
 
     @classmethod
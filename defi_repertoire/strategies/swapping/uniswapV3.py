@@ -9,6 +9,7 @@ from pydantic import BaseModel
 from roles_royce.generic_method import Transactable
 from roles_royce.protocols.swap_pools import swap_methods
 
+from defi_repertoire import ranking
 from defi_repertoire.stale_while_revalidate import cache_af
 from defi_repertoire.strategies.base import (
     AddressOption,
@@ -21,6 +22,7 @@ from defi_repertoire.strategies.swapping.swapper import (
     get_swap_pools,
     get_wrapped_token,
 )
+from defi_repertoire.utils import upstream_url
 
 API_KEY = os.getenv("THEGRAPH_API_KEY", "MOCK_KEY")
 GRAPHS = {
@@ -40,6 +42,7 @@ async def fetch_tokens(blockchain: Blockchain):
         id
         symbol
         name
+        totalValueLockedUSD
       }
     }
     """
@@ -48,8 +51,12 @@ async def fetch_tokens(blockchain: Blockchain):
     if not graph_url:
         return []
 
-    response = requests.post(url=graph_url, json={"query": req})
-    return response.json()["data"]["tokens"]
+    response = requests.post(url=upstream_url(graph_url), json={"query": req})
+    tokens = response.json()["data"]["tokens"]
+    return ranking.ranked(
+        {**t, "liquidity": ranking.to_liquidity(t.get("totalValueLockedUSD"))}
+        for t in tokens
+    )
 
 
 @register
@@ -68,7 +75,10 @@ class SwapUniswapV3:
     async def get_base_options(cls, blockchain: Blockchain) -> BaseOptions:
         tokens = await fetch_tokens(blockchain)
         token_options = [
-            AddressOption(label=p["symbol"], address=p["id"]) for p in tokens
+            AddressOption(
+                label=p["symbol"], address=p["id"], liquidity=p.get("liquidity")
+            )
+            for p in tokens
         ]
         return cls.BaseOptions(token_in_address=token_options)
 
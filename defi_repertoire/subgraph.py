@@ -0,0 +1,152 @@
+"""
+Entity lists of subgraphs, paginated and synced incrementally.
+
+The first sync loads every entity paging by id (`id_gt`), with all the pages read at the same
+block. Following syncs only request the entities changed since the last synced block
+(`_change_block`) and merge them into the index, so refreshes download just the changes.
+"""
+
+import logging
+from decimal import Decimal
+from threading import Lock
+from typing import Callable
+
+import requests
+
+from defi_repertoire import metrics, tracing
+from defi_repertoire.utils import upstream_url
+
+logger = logging.getLogger(__name__)
+
+# Maximum `first` of The Graph
+PAGE_SIZE = 1000
+
+
+def greater_than(field: str, value: int | str) -> Callable[[dict], bool]:
+    """Filter of the entities whose (BigInt or BigDecimal) field is greater than value"""
+    return lambda entity: Decimal(entity.get(field) or 0) > Decimal(value)
+
+
+class SubgraphError(Exception):
+    pass
+
+
+class SubgraphIndex:
+    def __init__(
+        self,
+        url: str,
+        entity: str,
+        fields: str,
+        where: str = "",
+        keep: Callable[[dict], bool] | None = None,
+        order_by: str | None = None,
+        key: str = "id",
+        fetcher: str = "subgraph",
+        page_size: int = PAGE_SIZE,
+    ):
+        """
+        Args:
+            url: URL of the subgraph.
+            entity: Collection to query, e.g. "pools".
+            fields: GraphQL selection of each entity. It must include the id.
+            where: GraphQL filter of the full load, e.g. 'totalLiquidity_gt: "500000"'.
+            keep: The same filter in Python. The changed entities are requested without filter
+                (so the ones that stop matching are seen) and filtered with it.
+            order_by: Numeric field to sort the entities by (ascending). By default they are
+                sorted by id, like the subgraph does.
+            key: Field identifying the entities in the index.
+            fetcher: Name of the fetcher in the metrics.
+        """
+        self.url = url
+        self.entity = entity
+        self.fields = fields
+        self.where = where
+        self.keep = keep or (lambda entity: True)
+        self.order_by = order_by
+        self.key = key
+        self.fetcher = fetcher
+        self.page_size = page_size
+        self.entities: dict[str, dict] = {}
+        self.block: int | None = None
+        self._lock = Lock()
+
+    def sync(self) -> list[dict]:
+        """
+        Sync the index with the subgraph and return its entities. It makes blocking requests,
+        the async fetchers run it with asyncio.to_thread.
+        """
+        with self._lock:
+            if self.block is None:
+                self._full_sync()
+            else:
+                try:
+                    self._delta_sync()
+                except SubgraphError as error:
+                    logger.warning(f"Delta sync of {self.fetcher} failed: {error}")
+                    self._full_sync()
+            return self._sorted()
+
+    def _full_sync(self):
+        entities, block = self._fetch_all(self.where)
+        self.entities = {e[self.key]: e for e in entities if self.keep(e)}
+        self.block = block
+
+    def _delta_sync(self):
+        changed, block = self._fetch_all(f"_change_block: {{number_gte: {self.block}}}")
+        for entity in changed:
+            if self.keep(entity):
+                self.entities[entity[self.key]] = entity
+            else:
+                self.entities.pop(entity[self.key], None)
+        logger.debug(f"{self.fetcher}: {len(changed)} entities changed")
+        self.block = block
+
+    def _fetch_all(self, where: str) -> tuple[list[dict], int | None]:
+        """All the entities matching where, and the block they were read at."""
+        entities = []
+        cursor = ""
+        block = None
+        while True:
+            page, page_block = self._fetch_page(where, cursor, block)
+            block = block or page_block
+            entities.extend(page)
+            if len(page) < self.page_size:
+                return entities, block
+            cursor = page[-1]["id"]
+
+    def _fetch_page(
+        self, where: str, cursor: str, block: int | None
+    ) -> tuple[list[dict], int | None]:
+        filters = ", ".join(f for f in [f'id_gt: "{cursor}"', where] if f)
+        arguments = (
+            f"first: {self.page_size}, orderBy: id, orderDirection: asc, "
+            f"where: {{{filters}}}"
+        )
+        if block:
+            arguments += f", block: {{number: {block}}}"
+        query = f"""
+        {{
+          {self.entity}({arguments}) {{
+            {self.fields}
+          }}
+          _meta {{ block {{ number }} }}
+        }}
+        """
+        with tracing.timed("subgraph"), metrics.SUBGRAPH_LATENCY.labels(
+            self.fetcher
+        ).time():
+            response = requests.post(url=upstream_url(self.url), json={"query": query})
+        res = response.json()
+        if "errors" in res or "data" not in res:
+            raise SubgraphError(res.get("errors"))
+        # Without _meta (e.g. in the recorded responses) the index is fully reloaded each time
+        meta = res["data"].get("_meta")
+        return res["data"][self.entity], meta and meta["block"]["number"]
+
+    def _sorted(self) -> list[dict]:
+        entities = list(self.entities.values())
+        if self.order_by:
+            entities.sort(key=lambda e: Decimal(e.get(self.order_by) or 0))
+        else:
+            entities.sort(key=lambda e: e["id"])
+        return entities
@@ -0,0 +1,61 @@
+"""
+Optional OpenTelemetry tracing.
+
+When opentelemetry is installed, spans are produced for the HTTP requests, the strategies
+get_txns (nested strategy calls are child spans), the RPC and multicall calls and the
+cache lookups. They go to the globally configured tracer provider, so nothing is exported
+until the application (or a test) configures one. Without opentelemetry the helpers are no-ops.
+"""
+
+import functools
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace
+except ImportError:  # pragma: no cover
+    trace = None
+
+ENABLED = trace is not None
+
+_tracer = trace.get_tracer("defi_repertoire") if ENABLED else None
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Span of the block, child of the current one. Yields it to add attributes."""
+    if not ENABLED:
+        yield _NOOP_SPAN
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def set_attribute(key: str, value):
+    """Set an attribute of the current span."""
+    if ENABLED:
+        trace.get_current_span().set_attribute(key, value)
+
+
+def instrument_strategy(strategy, strategy_id: str):
+    """Wrap the get_txns of the strategy class in a span."""
+    if not ENABLED:
+        return
+    get_txns = strategy.get_txns.__func__
+
+    @functools.wraps(get_txns)
+    def traced_get_txns(cls, ctx, arguments):
+        with span(
+            "strategy.get_txns",
+            **{"strategy.id": strategy_id, "chain": str(ctx.blockchain)},
+        ):
+            return get_txns(cls, ctx, arguments)
+
+    strategy.get_txns = classmethod(traced_get_txns)
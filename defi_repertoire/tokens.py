@@ -0,0 +1,311 @@
+"""
+Token metadata registry: symbol, name and decimals of the tokens of each blockchain.
+
+The tokens are merged from the already fetched sources (cowswap token lists, Curve pools,
+Balancer pools and UniswapV3 tokens, in that order of precedence). The metadata missing from
+them is read on-chain with one multicall for all the tokens and, being immutable, persisted
+in CACHE_SNAPSHOT_DIR so it is read only once. The workers share the persisted tokens, each
+one merges the tokens it resolved into the file.
+"""
+
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from threading import Lock
+from typing import Iterable
+
+import msgpack
+from defabipedia.types import Blockchain
+from pydantic import BaseModel
+from web3 import Web3
+
+from defi_repertoire import multicall
+from defi_repertoire.stale_while_revalidate import SNAPSHOT_DIR, locked_directory
+from defi_repertoire.strategies.base import AddressOption
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("symbol", "name", "decimals")
+
+
+class Token(BaseModel):
+    address: str
+    symbol: str | None = None
+    name: str | None = None
+    decimals: int | None = None
+
+    @property
+    def complete(self) -> bool:
+        return all(getattr(self, field) is not None for field in FIELDS)
+
+
+def _chain(blockchain: Blockchain) -> str:
+    return getattr(blockchain, "name", str(blockchain))
+
+
+def _source_tokens(source: str, result) -> list[Token]:
+    if source == "cowswap":
+        return [
+            Token(
+                address=t["address"],
+                symbol=t.get("symbol"),
+                name=t.get("name"),
+                decimals=t.get("decimals"),
+            )
+            for t in result
+        ]
+    if source == "curve":
+        return [
+            Token(
+                address=c["address"],
+                symbol=c.get("symbol"),
+                decimals=c.get("decimals") and int(c["decimals"]),
+            )
+            for pool in result
+            for c in pool["coins"]
+        ]
+    if source == "balancer":
+        return [
+            Token(address=t["address"], symbol=t.get("symbol"), name=t.get("name"))
+            for pool in result
+            for t in pool["tokens"]
+        ]
+    if source == "uniswapv3":
+        return [
+            Token(address=t["id"], symbol=t.get("symbol"), name=t.get("name"))
+            for t in result
+        ]
+    raise ValueError(f"Unknown token source {source}")
+
+
+async def _fetch_sources(blockchain: Blockchain) -> dict:
+    # The strategy modules are imported here to not load them with the API
+    from defi_repertoire.strategies.disassembling import disassembling_balancer
+    from defi_repertoire.strategies.swapping import cowswap, curve, uniswapV3
+
+    sources = {
+        "cowswap": cowswap.fetch_tokens(blockchain),
+        "curve": curve.fetch_pools(blockchain),
+        "balancer": disassembling_balancer.fetch_pools(blockchain),
+        "uniswapv3": uniswapV3.fetch_tokens(blockchain),
+    }
+    results = await asyncio.gather(*sources.values(), return_exceptions=True)
+    return dict(zip(sources, results))
+
+
+class TokenRegistry:
+    def __init__(self, persist_dir: str | None = SNAPSHOT_DIR):
+        self.persist_dir = persist_dir
+        # blockchain name -> lowercase address -> token
+        self._tokens: dict[str, dict[str, Token]] = {}
+        # tokens read on-chain, they are persisted
+        self._resolved: dict[str, dict[str, Token]] = {}
+        # the last merged result of each source, to merge them again only when they change
+        self._sources: dict[tuple[str, str], object] = {}
+        # addresses whose metadata can not be read (e.g. the native token placeholder)
+        self._unresolvable: set[tuple[str, str]] = set()
+        self._lock = Lock()
+        # held while the tokens of a chain are resolved, so concurrent resolutions of the
+        # same tokens wait for the first one instead of reading them again
+        self._resolving: dict[str, Lock] = defaultdict(Lock)
+
+    def get(self, blockchain: Blockchain, address: str) -> Token | None:
+        chain = _chain(blockchain)
+        with self._lock:
+            self._load(chain)
+            return self._tokens[chain].get(address.lower())
+
+    def add(self, blockchain: Blockchain, tokens: Iterable[Token]):
+        """Merge tokens in the registry. The fields already known take precedence."""
+        chain = _chain(blockchain)
+        with self._lock:
+            self._load(chain)
+            self._merge(chain, tokens)
+
+    def _merge(self, chain: str, tokens: Iterable[Token]):
+        known = self._tokens[chain]
+        for token in tokens:
+            key = token.address.lower()
+            current = known.get(key)
+            if current is None:
+                known[key] = token
+            elif not current.complete:
+                known[key] = current.model_copy(
+                    update={
+                        field: getattr(token, field)
+                        for field in FIELDS
+                        if getattr(current, field) is None
+                        and getattr(token, field) is not None
+                    }
+                )
+
+    async def load_sources(self, blockchain: Blockchain):
+        """Merge the tokens of the sources (fetched through their caches)."""
+        chain = _chain(blockchain)
+        for source, result in (await _fetch_sources(blockchain)).items():
+            if isinstance(result, Exception):
+                logger.warning(f"Token source {source} of {chain} failed: {result}")
+                continue
+            if self._sources.get((chain, source)) is result:
+                continue
+            self.add(blockchain, _source_tokens(source, result))
+            self._sources[(chain, source)] = result
+
+    def resolve(self, w3: Web3, blockchain: Blockchain, addresses: Iterable[str]):
+        """Read on-chain, in one multicall, the metadata missing for the addresses."""
+        chain = _chain(blockchain)
+        with self._lock:
+            resolving = self._resolving[chain]
+        with resolving:
+            self._resolve(w3, chain, addresses)
+
+    def _resolve(self, w3: Web3, chain: str, addresses: Iterable[str]):
+        with self._lock:
+            self._load(chain)
+            missing = list(
+                {
+                    address.lower(): address
+                    for address in addresses
+                    if (chain, address.lower()) not in self._unresolvable
+                    and not (
+                        (token := self._tokens[chain].get(address.lower()))
+                        and token.complete
+                    )
+                }.values()
+            )
+        if not missing:
+            return
+
+        calls = [
+            multicall.Call(
+                Web3.to_checksum_address(address), multicall.encode_call(f"{field}()")
+            )
+            for address in missing
+            for field in FIELDS
+        ]
+        results = multicall.aggregate(w3, calls)
+        resolved = []
+        for i, address in enumerate(missing):
+            symbol, name, decimals = results[3 * i : 3 * i + 3]
+            token = Token(
+                address=address,
+                symbol=multicall.decode_string(symbol),
+                name=multicall.decode_string(name),
+                decimals=multicall.decode_uint(decimals),
+            )
+            if token.decimals is None:
+                self._unresolvable.add((chain, address.lower()))
+            else:
+                resolved.append(token)
+
+        with self._lock:
+            self._merge(chain, resolved)
+            self._resolved[chain].update({t.address.lower(): t for t in resolved})
+        self._persist(chain, resolved)
+
+    def option(self, blockchain: Blockchain, option: AddressOption) -> AddressOption:
+        token = self.get(blockchain, option.address)
+        if not token:
+            return option
+        return option.model_copy(
+            update={"name": token.name, "decimals": token.decimals}
+        )
+
+    def _path(self, chain: str) -> str:
+        return os.path.join(self.persist_dir, f"tokens-{chain}.msgpack")
+
+    def _read(self, chain: str) -> list[Token]:
+        """The persisted tokens of the chain"""
+        try:
+            with open(self._path(chain), "rb") as f:
+                entries = msgpack.unpackb(f.read())
+        except FileNotFoundError:
+            return []
+        except Exception as error:
+            logger.warning(f"Ignoring the persisted tokens of {chain}: {error}")
+            return []
+        return [
+            Token(address=address, symbol=symbol, name=name, decimals=decimals)
+            for address, symbol, name, decimals in entries
+        ]
+
+    def _load(self, chain: str):
+        """Load the persisted tokens of the chain the first time it is used."""
+        if chain in self._tokens:
+            return
+        self._tokens[chain] = {}
+        self._resolved[chain] = {}
+        if not self.persist_dir:
+            return
+        tokens = self._read(chain)
+        self._resolved[chain] = {t.address.lower(): t for t in tokens}
+        self._merge(chain, tokens)
+
+    def _persist(self, chain: str, resolved: list[Token]):
+        """
+        Merge the resolved tokens into the persisted ones. The other workers persist the
+        tokens they resolve too, so the file is read again and rewritten under a lock of the
+        directory.
+        """
+        if not self.persist_dir or not resolved:
+            return
+        try:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            with locked_directory(self.persist_dir):
+                tokens = {t.address.lower(): t for t in self._read(chain)}
+                tokens.update({t.address.lower(): t for t in resolved})
+                entries = [
+                    [t.address, t.symbol, t.name, t.decimals] for t in tokens.values()
+                ]
+                # Atomic replace, the workers read the file without the lock
+                tmp_path = f"{self._path(chain)}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(msgpack.packb(entries))
+                os.replace(tmp_path, self._path(chain))
+        except Exception as error:
+            logger.warning(f"Could not persist the tokens of {chain}: {error}")
+
+
+REGISTRY = TokenRegistry()
+
+
+def _get_w3(blockchain: Blockchain) -> Web3 | None:
+    from defi_repertoire.providers import get_endpoint_for_blockchain
+
+    try:
+        return get_endpoint_for_blockchain(blockchain)
+    except NotImplementedError:
+        return None
+
+
+async def enrich_options(
+    blockchain: Blockchain, options: BaseModel, registry: TokenRegistry = REGISTRY
+) -> BaseModel:
+    """Copy of the options with the name and decimals of the tokens of its address lists."""
+    lists = {
+        field: value
+        for field, value in options
+        if isinstance(value, list)
+        and value
+        and all(isinstance(o, AddressOption) for o in value)
+    }
+    if not lists:
+        return options
+
+    await registry.load_sources(blockchain)
+    w3 = _get_w3(blockchain)
+    if w3:
+        addresses = [o.address for value in lists.values() for o in value]
+        try:
+            await asyncio.to_thread(registry.resolve, w3, blockchain, addresses)
+        except Exception as error:
+            # The options are still served, with the metadata of the sources
+            logger.warning(f"Could not resolve the tokens of {blockchain}: {error}")
+
+    return options.model_copy(
+        update={
+            field: [registry.option(blockchain, o) for o in value]
+            for field, value in lists.items()
+        }
+    )
@@ -0,0 +1,126 @@
+"""
+Request scoped tracing: RPC calls, cache lookups and timings of the current request.
+
+A RequestTrace is started per HTTP request and kept in a context variable, so the
+providers, caches and strategies record into it without it being passed around.
+Worker threads only see it if their function is wrapped with `propagate`.
+"""
+
+import contextvars
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+
+
+class RequestTrace:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.rpc_calls: list[tuple[str, float]] = []
+        self.cache: Counter = Counter()
+        self.timings: dict[str, float] = {}
+        self._lock = Lock()
+
+    def record_rpc(self, method: str, duration: float):
+        with self._lock:
+            self.rpc_calls.append((method, duration))
+
+    def record_cache(self, outcome: str):
+        with self._lock:
+            self.cache[outcome] += 1
+
+    def record_timing(self, name: str, duration: float):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0) + duration
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self.start
+
+    def summary(self) -> dict:
+        """Debug information of the request. Durations are in milliseconds."""
+        with self._lock:
+            rpc_by_method = Counter(method for method, _ in self.rpc_calls)
+            return {
+                "duration_ms": round(self.duration * 1000, 2),
+                "rpc": {
+                    "count": len(self.rpc_calls),
+                    "duration_ms": round(sum(d for _, d in self.rpc_calls) * 1000, 2),
+                    "by_method": dict(rpc_by_method),
+                    "calls": [
+                        {"method": method, "duration_ms": round(d * 1000, 2)}
+                        for method, d in self.rpc_calls
+                    ],
+                },
+                "cache": {o: self.cache[o] for o in ("hit", "miss", "stale")},
+                "timings_ms": {k: round(v * 1000, 2) for k, v in self.timings.items()},
+            }
+
+    def server_timing(self) -> str:
+        """Value of the Server-Timing header."""
+        with self._lock:
+            rpc_duration = sum(d for _, d in self.rpc_calls) * 1000
+            metrics = [
+                f'rpc;dur={rpc_duration:.1f};desc="{len(self.rpc_calls)} calls"',
+                f'cache;desc="hit={self.cache["hit"]} miss={self.cache["miss"]} stale={self.cache["stale"]}"',
+            ]
+            metrics += [f"{k};dur={v * 1000:.1f}" for k, v in self.timings.items()]
+        metrics.append(f"total;dur={self.duration * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+_trace: contextvars.ContextVar[RequestTrace | None] = contextvars.ContextVar(
+    "request_trace", default=None
+)
+
+
+def get_trace() -> RequestTrace | None:
+    return _trace.get()
+
+
+@contextmanager
+def trace_request():
+    trace = RequestTrace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def record_rpc(method: str, duration: float):
+    trace = _trace.get()
+    if trace:
+        trace.record_rpc(method, duration)
+
+
+def record_cache(outcome: str):
+    trace = _trace.get()
+    if trace:
+        trace.record_cache(outcome)
+
+
+@contextmanager
+def timed(name: str):
+    """Add the time spent in the block to the `name` timing of the request."""
+    trace = _trace.get()
+    if not trace:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record_timing(name, time.perf_counter() - start)
+
+
+def propagate(func):
+    """Wrap func to run it in (a copy of) the current context, e.g. in an executor thread."""
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
@@ -1,3 +1,7 @@
+import os
+from urllib.parse import urlparse
+
+
 def flatten(matrix):
     flat_list = []
     for row in matrix:
@@ -11,3 +15,18 @@ def uniqBy(l, attr):
         if obj[attr] not in seen:
             seen[obj[attr]] = obj
     return list(seen.values())
+
+
+def upstream_url(url: str) -> str:
+    """
+    URL of an external API (subgraphs, token lists, Curve API).
+
+    With UPSTREAM_BASE_URL set (e.g. to the load testing simulator) the request goes to
+    {UPSTREAM_BASE_URL}/{host}{path} instead.
+    """
+    base = os.getenv("UPSTREAM_BASE_URL")
+    if not base:
+        return url
+    parsed = urlparse(url)
+    query = f"?{parsed.query}" if parsed.query else ""
+    return f"{base.rstrip('/')}/{parsed.netloc}{parsed.path}{query}"
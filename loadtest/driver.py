@@ -0,0 +1,171 @@
+"""
+Load driver of the API. Runs scenario files against a running API and reports the throughput
+and the latency percentiles of each request of the scenarios.
+
+Usage:
+    python -m loadtest.driver loadtest/scenarios/catalog.json --concurrency 20 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import httpx
+
+
+@dataclass
+class ScenarioRequest:
+    name: str
+    method: str
+    path: str
+    params: dict = field(default_factory=dict)
+    json: dict | list | None = None
+    weight: float = 1
+
+
+def load_scenario(path: str) -> list[ScenarioRequest]:
+    """
+    A scenario is a JSON file with the requests to make, picked at random by weight:
+        {"name": "...", "requests": [{"name": "...", "method": "GET", "path": "/...", "weight": 1}]}
+    """
+    with open(path) as f:
+        scenario = json.load(f)
+    return [ScenarioRequest(**request) for request in scenario["requests"]]
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest rank percentile of values (p in 0..100)"""
+    if not values:
+        return 0
+    values = sorted(values)
+    rank = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[rank]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def record(self, name: str, latency: float, ok: bool):
+        self.latencies[name].append(latency)
+        if not ok:
+            self.errors[name] += 1
+
+    def report(self, duration: float) -> dict:
+        """Throughput (requests/s) and latencies (ms) by request and in total"""
+
+        def summary(latencies: list[float], errors: int) -> dict:
+            return {
+                "requests": len(latencies),
+                "errors": errors,
+                "throughput": round(len(latencies) / duration, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "max_ms": round(max(latencies, default=0) * 1000, 2),
+            }
+
+        requests = {
+            name: summary(latencies, self.errors[name])
+            for name, latencies in sorted(self.latencies.items())
+        }
+        all_latencies = [l for latencies in self.latencies.values() for l in latencies]
+        return {
+            "duration_s": round(duration, 2),
+            "total": summary(all_latencies, sum(self.errors.values())),
+            "requests": requests,
+        }
+
+
+async def run(
+    base_url: str,
+    requests: list[ScenarioRequest],
+    concurrency: int,
+    duration: float,
+    rate: float | None = None,
+    timeout: float = 60,
+) -> dict:
+    """
+    Make the requests with `concurrency` workers during `duration` seconds.
+
+    Without rate the workers send requests back to back (closed loop). With rate (requests/s)
+    the requests are started at that rate as long as a worker is free.
+    """
+    stats = Stats()
+    weights = [r.weight for r in requests]
+    start = time.perf_counter()
+    deadline = start + duration
+    sent = 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal sent
+        while True:
+            if rate:
+                scheduled = start + sent / rate
+                sent += 1
+                await asyncio.sleep(max(0, scheduled - time.perf_counter()))
+            if time.perf_counter() >= deadline:
+                return
+            [request] = random.choices(requests, weights)
+            request_start = time.perf_counter()
+            try:
+                response = await client.request(
+                    request.method,
+                    request.path,
+                    params=request.params,
+                    json=request.json,
+                )
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            stats.record(request.name, time.perf_counter() - request_start, ok)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, timeout=timeout, limits=limits
+    ) as client:
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+    return stats.report(time.perf_counter() - start)
+
+
+def format_report(report: dict) -> str:
+    columns = ["requests", "errors", "throughput", "p50_ms", "p90_ms", "p99_ms"]
+    rows = [*report["requests"].items(), ("TOTAL", report["total"])]
+    width = max(len(name) for name, _ in rows)
+    lines = [f"{'':{width}}  " + "  ".join(f"{c:>10}" for c in columns)]
+    for name, summary in rows:
+        lines.append(
+            f"{name:{width}}  " + "  ".join(f"{summary[c]:>10}" for c in columns)
+        )
+    lines.append(f"Duration: {report['duration_s']}s")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("scenarios", nargs="+", help="Scenario JSON files")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--rate", type=float, help="Target requests/s")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    requests = [r for path in args.scenarios for r in load_scenario(path)]
+    report = asyncio.run(
+        run(args.base_url, requests, args.concurrency, args.duration, args.rate)
+    )
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
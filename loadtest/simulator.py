@@ -0,0 +1,204 @@
+"""
+Local simulator of the upstreams of the API, to load test it without touching real nodes.
+
+It serves:
+  - JSON-RPC (single and batch requests) in /rpc, with configurable latency and error rate.
+    eth_call answers every call (and every call of a Multicall3 aggregate3) with the same uint.
+  - The subgraphs, token lists and Curve API in /{host}/{path}, replaying the responses of the
+    recorded cassettes. The API reaches them with UPSTREAM_BASE_URL set to the simulator.
+
+Usage:
+    python -m loadtest.simulator --port 8545 --rpc-latency-ms 30 --rpc-error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import uvicorn
+import yaml
+from eth_abi import decode, encode
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+from defi_repertoire.multicall import AGGREGATE3_SELECTOR, MULTICALL3_ADDRESS
+
+CASSETTES_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "fixtures", "cassettes"
+)
+
+
+@dataclass
+class SimulatorConfig:
+    chain_id: int = 1
+    block_number: int = 20_000_000
+    # Value returned by every eth_call (balances, rates...)
+    call_value: int = 10**21
+    rpc_latency_ms: float = 20
+    rpc_jitter_ms: float = 10
+    # Probability of each JSON-RPC call failing with a rate limit error
+    rpc_error_rate: float = 0
+    http_latency_ms: float = 150
+    http_jitter_ms: float = 50
+    cassettes_dir: str = CASSETTES_DIR
+
+
+def _normalize_url(url: str) -> str:
+    """host/path of a URL, without the subgraph API key"""
+    parsed = urlparse(url if "://" in url else f"http://{url}")
+    path = re.sub(r"^/api/[^/]+/", "/api/MOCK_KEY/", parsed.path)
+    return f"{parsed.netloc}{path}"
+
+
+def _body_key(method: str, body: str | bytes | None) -> str | None:
+    """
+    Hash of the body of a POST request (e.g. a subgraph query), as canonical JSON when it is
+    JSON. The requests of other methods are keyed by their URL only.
+    """
+    if method != "POST" or not body:
+        return None
+    if isinstance(body, str):
+        body = body.encode()
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True).encode()
+    except ValueError:
+        pass
+    return hashlib.sha256(body).hexdigest()
+
+
+def load_cassettes(
+    cassettes_dir: str,
+) -> dict[tuple[str, str, str | None], tuple[str, str]]:
+    """(method, host/path, body hash) -> (content type, body) of the recorded HTTP responses"""
+    responses = {}
+    paths = glob.glob(os.path.join(cassettes_dir, "**", "*.yaml"), recursive=True)
+    for path in sorted(paths):
+        with open(path) as f:
+            cassette = yaml.load(
+                f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+            )
+        for interaction in cassette["interactions"]:
+            request, response = interaction["request"], interaction["response"]
+            if response["status"]["code"] != 200:
+                continue
+            key = (
+                request["method"],
+                _normalize_url(request["uri"]),
+                _body_key(request["method"], request.get("body")),
+            )
+            content_type = response["headers"].get("Content-Type", ["application/json"])
+            responses.setdefault(key, (content_type[0], response["body"]["string"]))
+    return responses
+
+
+class RPCSimulator:
+    def __init__(self, config: SimulatorConfig):
+        self.config = config
+
+    def handle(self, call: dict) -> dict:
+        response = {"jsonrpc": "2.0", "id": call.get("id")}
+        if random.random() < self.config.rpc_error_rate:
+            response["error"] = {"code": -32005, "message": "rate limit exceeded"}
+            return response
+        try:
+            response["result"] = self.result(call["method"], call.get("params") or [])
+        except NotImplementedError:
+            response["error"] = {"code": -32601, "message": "method not found"}
+        return response
+
+    def result(self, method: str, params: list):
+        if method == "eth_chainId":
+            return hex(self.config.chain_id)
+        if method == "net_version":
+            return str(self.config.chain_id)
+        if method == "eth_blockNumber":
+            return hex(self.config.block_number)
+        if method == "web3_clientVersion":
+            return "defi-repertoire-simulator"
+        if method == "eth_gasPrice":
+            return hex(10**9)
+        if method == "eth_estimateGas":
+            return hex(150_000)
+        if method == "eth_call":
+            return "0x" + self.eth_call(params[0]).hex()
+        raise NotImplementedError(method)
+
+    def eth_call(self, transaction: dict) -> bytes:
+        data = bytes.fromhex(transaction.get("data", "0x")[2:])
+        value = encode(["uint256"], [self.config.call_value])
+        to = str(transaction.get("to", "")).lower()
+        if to == MULTICALL3_ADDRESS.lower() and data[:4] == AGGREGATE3_SELECTOR:
+            [calls] = decode(["(address,bool,bytes)[]"], data[4:])
+            return encode(["(bool,bytes)[]"], [[(True, value)] * len(calls)])
+        return value
+
+
+async def _sleep(latency_ms: float, jitter_ms: float):
+    delay = max(0, latency_ms + random.uniform(-jitter_ms, jitter_ms))
+    await asyncio.sleep(delay / 1000)
+
+
+def create_app(config: SimulatorConfig | None = None) -> FastAPI:
+    config = config or SimulatorConfig()
+    rpc = RPCSimulator(config)
+    responses = load_cassettes(config.cassettes_dir)
+    app = FastAPI()
+
+    @app.post("/rpc")
+    async def json_rpc(request: Request):
+        payload = await request.json()
+        await _sleep(config.rpc_latency_ms, config.rpc_jitter_ms)
+        if isinstance(payload, list):
+            return JSONResponse([rpc.handle(call) for call in payload])
+        return JSONResponse(rpc.handle(payload))
+
+    @app.api_route("/{url:path}", methods=["GET", "POST"])
+    async def upstream(url: str, request: Request):
+        await _sleep(config.http_latency_ms, config.http_jitter_ms)
+        body_key = _body_key(request.method, await request.body())
+        recorded = responses.get((request.method, _normalize_url(url), body_key))
+        if not recorded:
+            return JSONResponse({"error": f"No recorded response for {url}"}, 404)
+        content_type, body = recorded
+        return Response(body, media_type=content_type)
+
+    return app
+
+
+def main():
+    defaults = SimulatorConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--chain-id", type=int, default=defaults.chain_id)
+    parser.add_argument("--rpc-latency-ms", type=float, default=defaults.rpc_latency_ms)
+    parser.add_argument("--rpc-jitter-ms", type=float, default=defaults.rpc_jitter_ms)
+    parser.add_argument("--rpc-error-rate", type=float, default=defaults.rpc_error_rate)
+    parser.add_argument(
+        "--http-latency-ms", type=float, default=defaults.http_latency_ms
+    )
+    parser.add_argument("--http-jitter-ms", type=float, default=defaults.http_jitter_ms)
+    parser.add_argument("--cassettes-dir", default=defaults.cassettes_dir)
+    args = parser.parse_args()
+
+    config = SimulatorConfig(
+        chain_id=args.chain_id,
+        rpc_latency_ms=args.rpc_latency_ms,
+        rpc_jitter_ms=args.rpc_jitter_ms,
+        rpc_error_rate=args.rpc_error_rate,
+        http_latency_ms=args.http_latency_ms,
+        http_jitter_ms=args.http_jitter_ms,
+        cassettes_dir=args.cassettes_dir,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
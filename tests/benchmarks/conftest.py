@@ -0,0 +1,65 @@
+import asyncio
+import sys
+
+import pytest
+from eth_abi import decode, encode
+from web3 import Web3
+from web3.providers import BaseProvider
+
+from defi_repertoire.stale_while_revalidate import StaleWhileRevalidateCache
+
+# Balance of every token and every uint read by the strategies through the stub
+STUB_BALANCE = 10**21
+STUB_BLOCK = 20_000_000
+
+
+class StubProvider(BaseProvider):
+    """
+    Local RPC answering the calls of the strategies without a node: the chain id, the block
+    number and Multicall3 aggregate3 calls, where every call returns STUB_BALANCE.
+    """
+
+    def __init__(self, chain_id: int = 1):
+        super().__init__()
+        self.chain_id = chain_id
+
+    def make_request(self, method, params):
+        if method == "eth_chainId":
+            result = hex(self.chain_id)
+        elif method == "eth_blockNumber":
+            result = hex(STUB_BLOCK)
+        elif method == "eth_call":
+            data = bytes.fromhex(params[0]["data"][2:])
+            [calls] = decode(["(address,bool,bytes)[]"], data[4:])
+            value = encode(["uint256"], [STUB_BALANCE])
+            results = encode(["(bool,bytes)[]"], [[(True, value)] * len(calls)])
+            result = "0x" + results.hex()
+        else:
+            raise NotImplementedError(f"{method} is not stubbed")
+        return {"jsonrpc": "2.0", "id": 1, "result": result}
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+
+@pytest.fixture(scope="module")
+def stub_w3():
+    return Web3(StubProvider())
+
+
+@pytest.fixture(scope="module")
+def event_loop_runner():
+    """Run coroutines in the same loop, the caches locks are bound to it."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+def clear_caches():
+    """Empty every cache_af cache of the loaded modules."""
+    for name, module in list(sys.modules.items()):
+        if not name.startswith("defi_repertoire"):
+            continue
+        for value in vars(module).values():
+            if isinstance(value, StaleWhileRevalidateCache):
+                value.clear()
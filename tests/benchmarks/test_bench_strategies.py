@@ -0,0 +1,122 @@
+"""
+Benchmarks of the hot paths. Run them with
+
+    pytest tests/benchmarks --benchmark-only --benchmark-json=benchmark.json
+
+HTTP calls are replayed from the recorded cassettes and RPC calls are answered by a local stub.
+"""
+
+import pytest
+from defabipedia.tokens import Addresses
+from defabipedia.types import Chain
+
+from defi_repertoire.client import Repertoire
+from defi_repertoire.strategies.base import STRATEGIES
+from defi_repertoire.strategies.swapping import curve
+from defi_repertoire.strategies.swapping.swapper import (
+    find_reachable_tokens,
+    get_swap_pools,
+)
+from tests.benchmarks.conftest import clear_caches
+from tests.vcr import replay_cassette, replay_cassettes
+
+AVATAR = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+ROLES_MOD = "0x8C33ee6E439C874713a9912f3D3debfF1Efb90Da"
+WXDAI = "0xe91D153E0b41518A2Ce8Dd3D7944Fa863463a97d"
+
+# A mix of fixed amounts and percentages of the position (read with a multicall)
+CALLS = [
+    {"id": "dsr__withdraw_without_proxy", "arguments": {"amount": 10**18}},
+    {"id": "dsr__withdraw_without_proxy", "arguments": {"percentage": 50}},
+    {"id": "spark__withdraw_with_proxy", "arguments": {"amount": 10**18}},
+    {"id": "spark__withdraw_with_proxy", "arguments": {"percentage": 25}},
+    {"id": "lido__unstake_stETH", "arguments": {"amount": 2500 * 10**18}},
+    {"id": "lido__unstake_stETH", "arguments": {"percentage": 100}},
+]
+
+
+# Every fetcher of the Ethereum options: the token lists, Curve, Uniswap, the Balancer gauges,
+# and the Balancer and Aura pools
+LIST_CASSETTES = [
+    "test_list_ethereum_strategies",
+    "disassembling/test_balancer_withdraw_single_options_eth",
+    "disassembling/test_aura_options_ethereum",
+]
+
+
+def calls_batch(size: int) -> list[dict]:
+    return [CALLS[i % len(CALLS)] for i in range(size)]
+
+
+def assert_all_options(strategies):
+    """Every strategy with base options lists some for each of its arguments"""
+    with_options = [
+        s for s in strategies if hasattr(STRATEGIES[s.id], "get_base_options")
+    ]
+    assert with_options
+    for strategy in with_options:
+        assert strategy.options, f"{strategy.id} has no options"
+        for field, options in strategy.options.items():
+            assert options, f"{strategy.id} has no options for {field}"
+
+
+@pytest.fixture(scope="module")
+def repertoire(stub_w3):
+    return Repertoire(w3s={Chain.ETHEREUM: stub_w3})
+
+
+@pytest.mark.parametrize("size", [1, 10, 50])
+def test_build(benchmark, repertoire, size):
+    calls = calls_batch(size)
+    txns = benchmark(repertoire.build, Chain.ETHEREUM, AVATAR, calls)
+    assert len(txns) == 2 * size
+
+
+def test_multisend(benchmark, repertoire):
+    txns = repertoire.build(Chain.ETHEREUM, AVATAR, calls_batch(50))
+    multisend = benchmark(repertoire.multisend, Chain.ETHEREUM, txns)
+    assert multisend.contract_address == "0xA238CBeb142c10Ef7Ad8442C6D1f9E89e07e7761"
+
+
+def test_decode_tree_serialization(benchmark, repertoire):
+    txns = repertoire.build(Chain.ETHEREUM, AVATAR, calls_batch(50))
+    _, decoded = repertoire.wrap_with_role(Chain.ETHEREUM, AVATAR, ROLES_MOD, 1, txns)
+    data = benchmark(decoded.model_dump, mode="json")
+    assert len(data["children"][0]["children"]) == 100
+
+
+def test_list_strategies_cold(benchmark, event_loop_runner):
+    repertoire = Repertoire()
+    with replay_cassettes(*LIST_CASSETTES):
+        strategies = benchmark.pedantic(
+            lambda: event_loop_runner(repertoire.strategies(Chain.ETHEREUM)),
+            setup=clear_caches,
+            rounds=5,
+        )
+    assert_all_options(strategies)
+
+
+def test_list_strategies_warm(benchmark, event_loop_runner):
+    repertoire = Repertoire()
+    with replay_cassettes(*LIST_CASSETTES):
+        event_loop_runner(repertoire.strategies(Chain.ETHEREUM))
+        strategies = benchmark(
+            lambda: event_loop_runner(repertoire.strategies(Chain.ETHEREUM))
+        )
+    assert_all_options(strategies)
+
+
+def test_find_reachable_tokens(benchmark, event_loop_runner):
+    with replay_cassette("swapping/test_curve_options_gnosis"):
+        pools = event_loop_runner(curve.fetch_pools(Chain.GNOSIS))
+    pairs = [p["coins"] for p in pools]
+    tokens = benchmark(find_reachable_tokens, pairs, WXDAI, 3)
+    assert len(tokens) > 1
+
+
+def test_get_swap_pools(benchmark):
+    addresses = Addresses[Chain.ETHEREUM]
+    pools = benchmark(
+        get_swap_pools, Chain.ETHEREUM, "Curve", addresses.DAI, addresses.USDC
+    )
+    assert pools
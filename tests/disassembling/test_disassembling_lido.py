@@ -1,5 +1,7 @@
 from decimal import Decimal
+from unittest.mock import MagicMock, call, patch
 
+import pytest
 from defabipedia.lido import ContractSpecs
 from defabipedia.types import Chain
 from karpatkit.test_utils.fork import (
@@ -14,6 +16,7 @@ from roles_royce.toolshed.test_utils.roles_fork_utils import (
     deploy_roles,
     setup_common_roles,
 )
+from web3 import Web3
 
 from defi_repertoire.strategies.base import (
     GenericTxContext,
@@ -22,6 +25,8 @@ from defi_repertoire.strategies.base import (
 from defi_repertoire.strategies.disassembling import disassembling_lido as lido
 from defi_repertoire.strategies.disassembling.disassembler import Disassembler
 
+AVATAR = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+
 presets = """{
   "version": "1.0",
   "chainId": "1",
@@ -198,3 +203,159 @@ def test_integration_exit_2(local_node_eth, accounts):
 
     wsteth_balance = wsteth_contract.functions.balanceOf(avatar_safe_address).call()
     assert wsteth_balance == 4499999999999500001
+
+
+def test_plan_chunks():
+    max_chunk = lido.MAX_STETH_WITHDRAWAL_AMOUNT
+    min_chunk = lido.MIN_STETH_WITHDRAWAL_AMOUNT
+
+    assert lido.plan_chunks(max_chunk, max_chunk, min_chunk) == [max_chunk]
+    assert lido.plan_chunks(2 * max_chunk + 500, max_chunk, min_chunk) == [
+        max_chunk,
+        max_chunk,
+        500,
+    ]
+    # the last chunk can not be less than the minimum
+    assert lido.plan_chunks(max_chunk + 1, max_chunk, min_chunk) == [
+        max_chunk - 99,
+        100,
+    ]
+    # large positions are planned without looping over the chunks
+    chunks = lido.plan_chunks(10**6 * max_chunk + 1, max_chunk, min_chunk)
+    assert len(chunks) == 10**6 + 1
+    assert sum(chunks) == 10**6 * max_chunk + 1
+
+    with pytest.raises(ValueError):
+        lido.plan_chunks(99, max_chunk, min_chunk)
+
+
+def test_claim_withdrawals():
+    w3 = MagicMock()
+    functions = w3.eth.contract.return_value.functions
+    functions.getWithdrawalRequests.return_value.call.return_value = [12, 10, 11, 13]
+
+    def get_withdrawal_status(ids):
+        # 10 is claimed, 13 is not finalized
+        finalized = {10: True, 11: True, 12: True, 13: False}
+        claimed = {10: True, 11: False, 12: False, 13: False}
+        status_call = MagicMock()
+        status_call.call.return_value = [
+            (1, 1, AVATAR, 0, finalized[id], claimed[id]) for id in ids
+        ]
+        return status_call
+
+    functions.getWithdrawalStatus.side_effect = get_withdrawal_status
+    functions.getLastCheckpointIndex.return_value.call.return_value = 50
+    functions.findCheckpointHints.side_effect = lambda ids, first, last: MagicMock(
+        call=MagicMock(return_value=[id + 100 for id in ids])
+    )
+
+    with patch.object(Chain, "get_blockchain_from_web3", lambda x: Chain.ETHEREUM):
+        ctx = GenericTxContext(w3=w3, avatar_safe_address=AVATAR)
+
+    with patch.object(lido, "REQUESTS_PAGE_SIZE", 1):
+        assert lido.get_claimable_requests(ctx) == ([11, 12], [111, 112])
+    # one call per page, the pages are read concurrently in any order
+    functions.getWithdrawalStatus.assert_has_calls(
+        [call([10]), call([11]), call([12]), call([13])], any_order=True
+    )
+    assert functions.getWithdrawalStatus.call_count == 4
+    functions.findCheckpointHints.assert_has_calls(
+        [call([11], 1, 50), call([12], 1, 50)], any_order=True
+    )
+    assert functions.findCheckpointHints.call_count == 2
+
+    [claim] = lido.ClaimWithdrawals.get_txns(
+        ctx=ctx, arguments=lido.ClaimWithdrawals.Args(request_ids=[13, 11])
+    )
+    assert claim.name == "claimWithdrawals"
+
+
+def test_claim_without_finalized_requests():
+    w3 = MagicMock()
+    functions = w3.eth.contract.return_value.functions
+    # 10 is claimed, 11 is not finalized
+    functions.getWithdrawalStatus.return_value.call.return_value = [
+        (1, 1, AVATAR, 0, True, True),
+        (1, 1, AVATAR, 0, False, False),
+    ]
+    with patch.object(Chain, "get_blockchain_from_web3", lambda x: Chain.ETHEREUM):
+        ctx = GenericTxContext(w3=w3, avatar_safe_address=AVATAR)
+
+    with pytest.raises(ValueError, match="No finalized withdrawal requests to claim"):
+        lido.ClaimWithdrawals.get_txns(
+            ctx=ctx, arguments=lido.ClaimWithdrawals.Args(request_ids=[10, 11])
+        )
+    functions.findCheckpointHints.assert_not_called()
+
+
+def wsteth_node(endpoint="http://node:8545"):
+    """w3 of a node where 1 wstETH is worth 1.25 stETH"""
+    w3 = MagicMock()
+    w3.provider.endpoint_uri = endpoint
+    functions = w3.eth.contract.return_value.functions
+    functions.getWstETHByStETH.side_effect = lambda amount: MagicMock(
+        call=MagicMock(return_value=amount * 4 // 5)
+    )
+    return w3, functions
+
+
+def test_plan_withdrawals():
+    w3, functions = wsteth_node("http://plan:8545")
+    max_chunk = lido.MAX_STETH_WITHDRAWAL_AMOUNT * 4 // 5
+    avatars = [f"0x{i:040x}" for i in range(1, 4)]
+    get_blockchain = MagicMock(return_value=Chain.ETHEREUM)
+
+    with (
+        patch.object(Chain, "get_blockchain_from_web3", get_blockchain),
+        patch.object(rr_lido, "ApproveWithdrawalWstETH", lambda amount: amount),
+        patch.object(
+            rr_lido,
+            "RequestWithdrawalsWstETH",
+            lambda amounts, avatar: (avatar, amounts),
+        ),
+    ):
+        txns = lido.plan_withdrawals(
+            w3,
+            {avatars[0]: 1000, avatars[1]: max_chunk + 100, avatars[2]: 2 * max_chunk},
+            wrapped=True,
+            block=100,
+        )
+
+    checksummed = [Web3.to_checksum_address(a) for a in avatars]
+    assert txns == {
+        checksummed[0]: [1000, (checksummed[0], [1000])],
+        checksummed[1]: [max_chunk + 100, (checksummed[1], [max_chunk, 100])],
+        checksummed[2]: [2 * max_chunk, (checksummed[2], [max_chunk, max_chunk])],
+    }
+    # the blockchain and the rate are read once for all the avatars
+    assert get_blockchain.call_count == 1
+    assert functions.getWstETHByStETH.call_count == 1
+
+    with pytest.raises(ValueError):
+        # less than the minimum, 80 wei of wstETH plus the margin
+        lido.plan_withdrawals(w3, {avatars[0]: 80}, wrapped=True, block=100)
+
+
+def test_wsteth_chunk_limits_are_read_once_per_block():
+    def limits(w3, block):
+        with patch.object(Chain, "get_blockchain_from_web3", lambda x: Chain.ETHEREUM):
+            ctx = GenericTxContext(w3=w3, avatar_safe_address=AVATAR, block=block)
+        return lido.get_wsteth_chunk_limits(ctx)
+
+    max_chunk = lido.MAX_STETH_WITHDRAWAL_AMOUNT * 4 // 5
+    w3, functions = wsteth_node("http://limits:8545")
+    # other Web3 instances of the same node share the limits
+    other_w3, other_functions = wsteth_node("http://limits:8545")
+    assert limits(w3, 100) == (81, max_chunk)
+    assert limits(other_w3, 100) == (81, max_chunk)
+    assert functions.getWstETHByStETH.call_count == 1
+    assert other_functions.getWstETHByStETH.call_count == 0
+
+    # read again at other blocks, other nodes and the latest block
+    limits(other_w3, 101)
+    assert other_functions.getWstETHByStETH.call_count == 1
+    limits(wsteth_node("http://other:8545")[0], 100)
+    limits(w3, None)
+    limits(w3, None)
+    assert functions.getWstETHByStETH.call_count == 3
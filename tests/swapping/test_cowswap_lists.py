@@ -0,0 +1,67 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from defi_repertoire.strategies.swapping import cowswap
+
+USDC = "0xA0b86991c6218b36c1D19D4a2e9Eb0cE3606eB48"
+
+
+def token(address: str, symbol: str, chain_id: int = 1) -> dict:
+    return {"address": address, "symbol": symbol, "chainId": chain_id}
+
+
+def test_merge_lists_dedupes_addresses_in_any_case():
+    first = [token(USDC.lower(), "USDC"), token("0x" + "11" * 20, "AAA")]
+    second = [token(USDC, "USDC.e"), token("0x" + "22" * 20, "BBB"), token("0x12", "X")]
+
+    merged = cowswap.merge_lists([first, second])
+
+    assert [t["symbol"] for t in merged] == ["USDC", "AAA", "BBB"]
+    assert merged[0]["address"] == USDC.lower()
+
+
+class FakeList:
+    """Serves a token list with an ETag, answering 304 when it is not modified"""
+
+    def __init__(self, tokens: list[dict]):
+        self.tokens = tokens
+        self.requests = []
+
+    def get(self, url, headers):
+        self.requests.append(headers)
+        if headers.get("If-None-Match") == "v1":
+            return MagicMock(status_code=304)
+        return MagicMock(
+            status_code=200,
+            json=lambda: {"tokens": self.tokens},
+            headers={"ETag": "v1", "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+        )
+
+
+@pytest.fixture
+def fake_list():
+    fake = FakeList([token(USDC, "USDC"), token(USDC, "USDC", chain_id=100)])
+    with patch.object(cowswap, "_session", fake), patch.dict(cowswap._downloaded):
+        yield fake
+
+
+def test_download_list_filters_by_chain(fake_list):
+    assert cowswap.download_list("https://list", 1) == [token(USDC, "USDC")]
+    assert cowswap.download_list("https://list", 100) == [
+        token(USDC, "USDC", chain_id=100)
+    ]
+
+
+def test_download_list_is_not_repeated_when_unchanged(fake_list):
+    first = cowswap.download_list("https://list", 1)
+    second = cowswap.download_list("https://list", 1)
+
+    assert second == first
+    assert fake_list.requests == [
+        {},
+        {
+            "If-None-Match": "v1",
+            "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+        },
+    ]
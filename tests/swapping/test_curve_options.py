@@ -11,11 +11,15 @@ from tests.vcr import my_vcr
 async def test_curve_options_gnosis():
     blockchain = Chain.get_blockchain_by_chain_id(100)
     wxdai = "0xe91D153E0b41518A2Ce8Dd3D7944Fa863463a97d"
+    sgno = "0xA4eF9Da5BA71Cc0D2e5E877a910A37eC43420445"
 
     opts = await SwapOnCurve.get_base_options(blockchain)
     assert len(opts.token_in_address) > 10
 
-    assert opts.token_in_address[0].address == wxdai
+    # Ranked by the liquidity of the tokens in all the pools
+    assert opts.token_in_address[0].address == sgno
+    liquidities = [o.liquidity for o in opts.token_in_address]
+    assert liquidities == sorted(liquidities, reverse=True)
 
     opts2 = await SwapOnCurve.get_options(
         blockchain, SwapOnCurve.OptArgs(token_in_address=wxdai)
@@ -0,0 +1,55 @@
+import asyncio
+from unittest.mock import patch
+
+from defabipedia.types import Chain
+
+from defi_repertoire.client import Repertoire
+from defi_repertoire.models import TransactableData
+
+AVATAR = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+CALLS = [{"id": "dsr__withdraw_without_proxy", "arguments": {"amount": 10}}]
+
+
+def test_build():
+    repertoire = Repertoire()
+    with patch.object(Chain, "get_blockchain_from_web3", lambda x: Chain.ETHEREUM):
+        txns = repertoire.build("ethereum", AVATAR, CALLS)
+        assert [TransactableData.from_transactable(t).model_dump() for t in txns] == [
+            {
+                "operation": 0,
+                "data": "0x095ea7b3000000000000000000000000373238337bfe1146fb49989fc222523f83081ddb000000000000000000000000000000000000000000000000000000000000000a",
+                "value": 0,
+                "contract_address": "0x6B175474E89094C44Da98b954EedeAC495271d0F",
+            },
+            {
+                "operation": 0,
+                "data": "0xef693bed0000000000000000000000008353157092ed8be69a9df8f95af097bbf33cb2af000000000000000000000000000000000000000000000000000000000000000a",
+                "value": 0,
+                "contract_address": "0x373238337Bfe1146fb49989fc222523f83081dDb",
+            },
+        ]
+
+        multisend = repertoire.multisend(Chain.ETHEREUM, txns)
+        assert (
+            multisend.contract_address == "0xA238CBeb142c10Ef7Ad8442C6D1f9E89e07e7761"
+        )
+
+        # the async version gives the same result
+        async_txns = asyncio.run(repertoire.abuild(Chain.ETHEREUM, AVATAR, CALLS))
+        assert [t.data for t in async_txns] == [t.data for t in txns]
+
+
+def test_exec_with_role():
+    repertoire = Repertoire()
+    with patch.object(Chain, "get_blockchain_from_web3", lambda x: Chain.ETHEREUM):
+        txn, decoded = repertoire.exec_with_role(
+            blockchain="ethereum",
+            avatar_safe_address=AVATAR,
+            roles_mod_address="0x8C33ee6E439C874713a9912f3D3debfF1Efb90Da",
+            role=1,
+            strategy_calls=CALLS,
+        )
+    assert txn.contract_address == "0x8C33ee6E439C874713a9912f3D3debfF1Efb90Da"
+    assert decoded.decoded["name"] == "execTransactionWithRole"
+    [multisend] = decoded.children
+    assert len(multisend.children) == 2
@@ -0,0 +1,279 @@
+import json
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from defi_repertoire import cowswap_orders
+from defi_repertoire.client import Repertoire
+from defi_repertoire.cowswap_orders import OrderRequest
+from defi_repertoire.utils import upstream_url
+
+AVATAR = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+SDAI = "0x83F20F44975D03b1b09e64809B757c47f942BEeA"
+USDC = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+DAI = "0x6B175474E89094C44Da98b954EedeAC495271d0F"
+# Not quoted by the mock order book
+SCAM = "0x0000000000000000000000000000000000000bad"
+
+
+class FakeProvider:
+    pass
+
+
+class FakeW3:
+    def __init__(self, client_version="anvil/v0.2.0"):
+        self.provider = FakeProvider()
+        self._client_version = client_version
+        self.client_version_reads = 0
+
+    @property
+    def client_version(self):
+        self.client_version_reads += 1
+        return self._client_version
+
+
+def make_ctx(w3=None):
+    return SimpleNamespace(
+        w3=w3 or FakeW3(),
+        avatar_safe_address=AVATAR,
+        blockchain="ethereum",
+        ctx=defaultdict(dict),
+    )
+
+
+class OrderBookHandler(BaseHTTPRequestHandler):
+    """The quote and order endpoints of the CoW order book API"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.received.append((self.path, body))
+        if self.path == "/api.cow.fi/mainnet/api/v1/quote":
+            if body["sellToken"] == SCAM:
+                self.answer(
+                    400,
+                    {"errorType": "NoLiquidity", "description": "No route was found"},
+                )
+            else:
+                sell_amount = int(body["sellAmountBeforeFee"])
+                quote = {
+                    **body,
+                    "sellAmount": str(sell_amount - 10),
+                    "buyAmount": str(sell_amount // 2),
+                    "feeAmount": "10",
+                }
+                self.answer(200, {"quote": quote, "from": AVATAR, "id": 1})
+        elif self.path == "/api.cow.fi/mainnet/api/v1/orders":
+            self.answer(201, f"0x{len(self.server.received):0112x}")
+        else:
+            self.answer(404, {"errorType": "NotFound"})
+
+    def answer(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def order_book(monkeypatch):
+    """Local mock of the order book API, receiving the requests to api.cow.fi"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OrderBookHandler)
+    server.received = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("UPSTREAM_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+
+    def create_order_and_swap(w3, avatar, sell_token, amount, fork, **kwargs):
+        # Posts the order like roles_royce does
+        resp = requests.post(
+            upstream_url("https://api.cow.fi/mainnet/api/v1/orders"),
+            json={"sellToken": sell_token, "sellAmount": str(amount), "from": avatar},
+        )
+        resp.raise_for_status()
+        return [f"approve {sell_token}", f"sign {resp.json()}"]
+
+    monkeypatch.setattr(
+        cowswap_orders.cowswap, "create_order_and_swap", create_order_and_swap
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def requests_to(order_book, endpoint):
+    return [
+        body
+        for path, body in order_book.received
+        if path == f"/api.cow.fi/mainnet/api/v1/{endpoint}"
+    ]
+
+
+class FakeOrderBook:
+    """create_order_and_swap answering once n orders are being created at the same time"""
+
+    def __init__(self, concurrent: int):
+        self.barrier = threading.Barrier(concurrent, timeout=5)
+        self.created = []
+
+    def create_order_and_swap(self, w3, sell_token, amount, fork, **kwargs):
+        self.barrier.wait()
+        self.created.append((sell_token, amount, fork))
+        return [f"approve {sell_token}", f"sign {amount}"]
+
+
+def test_the_fork_flag_is_read_once_per_provider():
+    w3 = FakeW3()
+    assert cowswap_orders.is_fork(w3)
+    assert cowswap_orders.is_fork(w3)
+    assert w3.client_version_reads == 1
+
+    assert not cowswap_orders.is_fork(FakeW3("Geth/v1.13.0"))
+
+
+def test_the_orders_of_a_batch_are_created_concurrently(order_book, monkeypatch):
+    fake = FakeOrderBook(concurrent=3)
+    monkeypatch.setattr(
+        cowswap_orders.cowswap, "create_order_and_swap", fake.create_order_and_swap
+    )
+    ctx = make_ctx()
+    order_requests = [
+        OrderRequest(SDAI, USDC, 100, 0.01),
+        OrderRequest(DAI, USDC, 200, 0.01),
+        OrderRequest(SDAI, USDC, 100, 0.01),
+    ]
+
+    # The fake order book only answers when the three orders are in flight
+    cowswap_orders.prefetch_orders(ctx, order_requests)
+    assert [cowswap_orders.get_order(ctx, r) for r in order_requests] == [
+        ["approve " + SDAI, "sign 100"],
+        ["approve " + DAI, "sign 200"],
+        ["approve " + SDAI, "sign 100"],
+    ]
+    assert sorted(fake.created) == sorted(
+        [(SDAI, 100, True), (DAI, 200, True), (SDAI, 100, True)]
+    )
+    assert ctx.w3.client_version_reads == 1
+    # The same order is quoted once
+    assert len(requests_to(order_book, "quote")) == 2
+
+
+def test_the_orders_are_quoted_in_the_order_book(order_book):
+    ctx = make_ctx()
+    request = OrderRequest(DAI, USDC, 5000, 0.005)
+    assert cowswap_orders.quote(ctx, request)["buyAmount"] == "2500"
+    assert requests_to(order_book, "quote") == [
+        {
+            "sellToken": DAI,
+            "buyToken": USDC,
+            "receiver": AVATAR,
+            "from": AVATAR,
+            "kind": "sell",
+            "sellAmountBeforeFee": "5000",
+            "validFor": cowswap_orders.VALID_DURATION,
+            "signingScheme": "presign",
+        }
+    ]
+
+    cowswap_orders.prefetch_orders(ctx, [request])
+    assert cowswap_orders.get_order(ctx, request) == [
+        "approve " + DAI,
+        f"sign 0x{3:0112x}",
+    ]
+    assert requests_to(order_book, "orders") == [
+        {"sellToken": DAI, "sellAmount": "5000", "from": AVATAR}
+    ]
+
+
+def test_no_order_is_created_when_an_order_can_not_be_quoted(order_book):
+    ctx = make_ctx()
+    order_requests = [
+        OrderRequest(DAI, USDC, 5, 0.005),
+        OrderRequest(SCAM, USDC, 5, 0.005),
+    ]
+    with pytest.raises(ValueError, match="No route was found"):
+        cowswap_orders.prefetch_orders(ctx, order_requests)
+    assert len(requests_to(order_book, "quote")) == 2
+    assert requests_to(order_book, "orders") == []
+
+
+def test_orders_not_prefetched_are_created_when_built(order_book):
+    request = OrderRequest(DAI, USDC, 5, 0.005)
+    assert cowswap_orders.get_order(make_ctx(), request) == [
+        "approve " + DAI,
+        f"sign 0x{1:0112x}",
+    ]
+    assert requests_to(order_book, "quote") == []
+
+
+def test_order_errors_are_raised_by_the_strategy(order_book, monkeypatch):
+    def create_order_and_swap(**kwargs):
+        raise ValueError("Order rejected")
+
+    monkeypatch.setattr(
+        cowswap_orders.cowswap, "create_order_and_swap", create_order_and_swap
+    )
+    ctx = make_ctx()
+    request = OrderRequest(DAI, USDC, 5, 0.005)
+    cowswap_orders.prefetch_orders(ctx, [request])
+    with pytest.raises(ValueError, match="Order rejected"):
+        cowswap_orders.get_order(ctx, request)
+
+
+class Swap:
+    protocol = "cowswap"
+    id = "swap"
+
+    @classmethod
+    def get_order_request(cls, ctx, arguments):
+        if arguments == "empty":
+            raise ValueError("Nothing to withdraw, the position is empty")
+        return OrderRequest(DAI, USDC, arguments, 0.01) if arguments else None
+
+    @classmethod
+    def get_txns(cls, ctx, arguments):
+        request = cls.get_order_request(ctx, arguments)
+        return cowswap_orders.get_order(ctx, request) if request else []
+
+
+class Withdraw:
+    protocol = "spark"
+    id = "withdraw"
+
+    @classmethod
+    def get_txns(cls, ctx, arguments):
+        if arguments == "fail":
+            raise ValueError("Not enough liquidity")
+        return [f"withdraw {arguments}"]
+
+
+def test_the_orders_are_created_after_the_other_strategies(order_book):
+    txns = Repertoire().build_arguments(
+        make_ctx(), [(Withdraw, 1), (Swap, 5), (Swap, 0), (Withdraw, 2)]
+    )
+    assert txns == ["withdraw 1", "approve " + DAI, f"sign 0x{2:0112x}", "withdraw 2"]
+    assert [path.rsplit("/", 1)[1] for path, _ in order_book.received] == [
+        "quote",
+        "orders",
+    ]
+
+
+@pytest.mark.parametrize(
+    "strategy_arguments",
+    [
+        [(Swap, 5), (Withdraw, "fail")],
+        [(Swap, 5), (Swap, "empty")],
+    ],
+)
+def test_no_order_is_created_when_a_strategy_fails(order_book, strategy_arguments):
+    with pytest.raises(ValueError):
+        Repertoire().build_arguments(make_ctx(), strategy_arguments)
+    assert order_book.received == []
@@ -0,0 +1,71 @@
+import gzip
+
+import msgpack
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from defi_repertoire import encoding
+
+TXN = {
+    "contract_address": "0x83F20F44975D03b1b09e64809B757c47f942BEeA",
+    "data": "0x095ea7b30000000000000000000000000000000000000000000000000000000000000001",
+    "operation": 0,
+    "value": 0,
+}
+
+
+def make_client():
+    app = FastAPI()
+    app.middleware("http")(encoding.compress_response)
+
+    @app.get("/txns")
+    def txns(request: Request, count: int = 1):
+        return encoding.encoded(request, {"txns": [TXN] * count})
+
+    return TestClient(app)
+
+
+def test_negotiate_compression():
+    assert encoding.negotiate_compression("gzip, deflate") == "gzip"
+    assert encoding.negotiate_compression("gzip;q=0, deflate") is None
+    assert encoding.negotiate_compression(None) is None
+    if encoding.brotli:
+        assert encoding.negotiate_compression("gzip, br") == "br"
+    else:
+        assert encoding.negotiate_compression("gzip, br") == "gzip"
+
+
+def test_large_responses_are_compressed():
+    client = make_client()
+
+    response = client.get(
+        "/txns", params={"count": 50}, headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.json() == {"txns": [TXN] * 50}
+    assert int(response.headers["Content-Length"]) < len(response.content) / 5
+
+    small = client.get("/txns", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+    assert small.json() == {"txns": [TXN]}
+
+
+def test_compressed_bodies_of_cached_responses_are_reused():
+    body = b"x" * 2000
+    first = encoding._compressed_body(body, "gzip", '"etag"')
+    assert encoding._compressed_body(body, "gzip", '"etag"') is first
+    assert gzip.decompress(first) == body
+
+
+def test_msgpack_with_binary_calldata():
+    client = make_client()
+
+    response = client.get("/txns", headers={"Accept": "application/msgpack"})
+    assert response.headers["Content-Type"] == "application/msgpack"
+    content = msgpack.unpackb(response.content)
+    assert content == {
+        "txns": [{**TXN, "data": bytes.fromhex(TXN["data"][2:])}],
+    }
+
+    assert client.get("/txns").json() == {"txns": [TXN]}
@@ -0,0 +1,83 @@
+from unittest.mock import MagicMock
+
+from defabipedia.types import Chain
+from roles_royce.protocols.eth import maker
+from roles_royce.utils import multi_or_one
+
+from defi_repertoire import gas
+from defi_repertoire.gas import GasEstimate, estimate_gas
+
+AVATAR = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+
+
+def test_estimate_gas():
+    txns = [
+        maker.ApproveDAI(spender=AVATAR, amount=10),
+        maker.ExitDsr(avatar=AVATAR, wad=10),
+    ]
+    multisend = multi_or_one(txs=txns, blockchain=Chain.ETHEREUM)
+    # every prefix is a multisend, from the empty one
+    assert gas._multisend(multisend.contract_address, txns).data.lower() == (
+        multisend.data.lower()
+    )
+    gas_by_data = {
+        gas._multisend(multisend.contract_address, []).data.lower(): 40_000,
+        gas._multisend(multisend.contract_address, txns[:1]).data.lower(): 70_000,
+        multisend.data.lower(): 120_000,
+    }
+    requests = []
+
+    def make_request(method, params):
+        assert method == "eth_estimateGas"
+        requests.append(params)
+        # the multisend is delegatecalled by the avatar
+        assert params[0]["to"] == AVATAR
+        assert params[2][AVATAR]["code"] == "0x6080"
+        return {"result": hex(gas_by_data[params[0]["data"].lower()])}
+
+    w3 = MagicMock()
+    w3.provider.make_request.side_effect = make_request
+    w3.eth.get_code.return_value = b"\x60\x80"
+
+    estimation = estimate_gas(
+        w3=w3, blockchain=Chain.ETHEREUM, avatar=AVATAR, txns=txns, block=1
+    )
+    assert estimation == GasEstimate(block=1, total=120_000, txns=[30_000, 50_000])
+    assert len(requests) == 3
+
+    # estimates are cached per block and calldata
+    estimate_gas(w3=w3, blockchain=Chain.ETHEREUM, avatar=AVATAR, txns=txns, block=1)
+    assert len(requests) == 3
+
+    estimate_gas(w3=w3, blockchain=Chain.ETHEREUM, avatar=AVATAR, txns=txns, block=2)
+    assert len(requests) == 6
+
+
+def test_estimate_gas_of_one_txn():
+    # a single transactable is sent as a plain call, not in a multisend
+    txns = [maker.ApproveDAI(spender=AVATAR, amount=12)]
+
+    w3 = MagicMock()
+    w3.provider.make_request.return_value = {"result": hex(50_000)}
+
+    estimation = estimate_gas(
+        w3=w3, blockchain=Chain.ETHEREUM, avatar=AVATAR, txns=txns, block=1
+    )
+    assert estimation == GasEstimate(block=1, total=50_000, txns=[29_000])
+    [(method, params)] = [c.args for c in w3.provider.make_request.call_args_list]
+    assert params[0]["to"] == txns[0].contract_address
+    assert len(params) == 2
+
+
+def test_estimate_gas_failure():
+    txns = [maker.ApproveDAI(spender=AVATAR, amount=11)]
+
+    w3 = MagicMock()
+    w3.provider.make_request.return_value = {
+        "error": {"code": -32000, "message": "execution reverted"}
+    }
+
+    estimation = estimate_gas(
+        w3=w3, blockchain=Chain.ETHEREUM, avatar=AVATAR, txns=txns, block=1
+    )
+    assert estimation == GasEstimate(block=1, total=None, txns=[None])
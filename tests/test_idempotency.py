@@ -0,0 +1,125 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from defi_repertoire.idempotency import (
+    IdempotencyConflict,
+    IdempotencyStore,
+    SharedIdempotencyStore,
+    fingerprint,
+)
+
+
+def test_fingerprint_of_the_parameters():
+    assert fingerprint("ethereum", [{"id": "a", "arguments": {"x": 1, "y": 2}}]) == (
+        fingerprint("ethereum", [{"id": "a", "arguments": {"y": 2, "x": 1}}])
+    )
+    assert fingerprint("ethereum", 1) != fingerprint("gnosis", 1)
+
+
+def test_retries_replay_the_result():
+    store = IdempotencyStore()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"txn": len(builds)}
+
+    assert store.run("key", "params", build) == {"txn": 1}
+    assert store.run("key", "params", build) == {"txn": 1}
+    assert store.run("other-key", "params", build) == {"txn": 2}
+
+    with pytest.raises(IdempotencyConflict):
+        store.run("key", "other-params", build)
+
+
+def test_concurrent_duplicates_wait_for_the_first_build():
+    store = IdempotencyStore()
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return "order"
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        first = executor.submit(store.run, "key", "params", build)
+        started.wait(5)
+        duplicates = [executor.submit(store.run, "key", "params", build) for _ in "ab"]
+        release.set()
+        results = [first.result(5)] + [d.result(5) for d in duplicates]
+
+    assert results == ["order"] * 3
+    assert len(builds) == 1
+
+
+def test_failed_builds_and_expired_results_are_built_again():
+    store = IdempotencyStore()
+
+    def fail():
+        raise ConnectionError("RPC down")
+
+    with pytest.raises(ConnectionError):
+        store.run("key", "params", fail)
+    assert store.run("key", "params", lambda: "built") == "built"
+
+    expired = IdempotencyStore(ttl=0)
+    assert expired.run("key", "params", lambda: 1) == 1
+    assert expired.run("key", "params", lambda: 2) == 2
+
+
+def test_the_workers_share_the_results(tmp_path):
+    # Two workers with the same directory
+    worker = SharedIdempotencyStore(tmp_path)
+    other_worker = SharedIdempotencyStore(tmp_path)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"txn": len(builds)}
+
+    assert worker.run("key", "params", build) == {"txn": 1}
+    assert other_worker.run("key", "params", build) == {"txn": 1}
+    assert other_worker.run("other-key", "params", build) == {"txn": 2}
+    with pytest.raises(IdempotencyConflict):
+        other_worker.run("key", "other-params", build)
+
+    def fail():
+        raise ConnectionError("RPC down")
+
+    with pytest.raises(ConnectionError):
+        worker.run("failed", "params", fail)
+    assert other_worker.run("failed", "params", lambda: "built") == "built"
+
+    expired = SharedIdempotencyStore(tmp_path, ttl=0)
+    assert expired.run("key", "params", lambda: 3) == 3
+
+
+def test_concurrent_duplicates_in_other_workers_wait(tmp_path):
+    workers = [SharedIdempotencyStore(tmp_path) for _ in range(3)]
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return "order"
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        first = executor.submit(workers[0].run, "key", "params", build)
+        started.wait(5)
+        duplicates = [
+            executor.submit(worker.run, "key", "params", build)
+            for worker in workers[1:]
+        ]
+        release.set()
+        results = [first.result(5)] + [d.result(5) for d in duplicates]
+
+    assert results == ["order"] * 3
+    assert len(builds) == 1
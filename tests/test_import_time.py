@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+
+# Seconds. Generous to avoid flakiness in CI, the point is to catch eager imports of the
+# strategy modules coming back.
+MAX_IMPORT_TIME = float(os.getenv("MAX_IMPORT_TIME", 5))
+
+IMPORT_MAIN = """
+import json, sys, time
+start = time.perf_counter()
+import defi_repertoire.main
+duration = time.perf_counter() - start
+modules = [m for m in sys.modules if m.startswith("defi_repertoire.strategies.")]
+print(json.dumps({"duration": duration, "modules": modules}))
+"""
+
+
+def test_main_import_time():
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_MAIN],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    result = json.loads(output.splitlines()[-1])
+    print(f"defi_repertoire.main import time: {result['duration']:.3f}s")
+
+    strategy_modules = [
+        m
+        for m in result["modules"]
+        if m.startswith("defi_repertoire.strategies.disassembling.")
+        or m.startswith("defi_repertoire.strategies.swapping.")
+    ]
+    assert strategy_modules == []
+    assert result["duration"] < MAX_IMPORT_TIME
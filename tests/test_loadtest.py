@@ -0,0 +1,89 @@
+import json
+
+import yaml
+from eth_abi import decode, encode
+from fastapi.testclient import TestClient
+
+from defi_repertoire.multicall import AGGREGATE3_SELECTOR, MULTICALL3_ADDRESS
+from defi_repertoire.utils import upstream_url
+from loadtest.driver import percentile
+from loadtest.simulator import SimulatorConfig, create_app
+
+client = TestClient(create_app(SimulatorConfig(rpc_latency_ms=0, http_latency_ms=0)))
+
+
+def test_simulator_rpc():
+    calls = [("0x6B175474E89094C44Da98b954EedeAC495271d0F", True, b"\x70\xa0\x82\x31")]
+    data = AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [calls * 3])
+    response = client.post(
+        "/rpc",
+        json=[
+            {"jsonrpc": "2.0", "id": 1, "method": "eth_chainId"},
+            {
+                "jsonrpc": "2.0",
+                "id": 2,
+                "method": "eth_call",
+                "params": [{"to": MULTICALL3_ADDRESS, "data": "0x" + data.hex()}],
+            },
+        ],
+    )
+    chain_id, call = response.json()
+    assert chain_id["result"] == "0x1"
+    [results] = decode(["(bool,bytes)[]"], bytes.fromhex(call["result"][2:]))
+    assert list(results) == [(True, encode(["uint256"], [10**21]))] * 3
+
+
+def test_simulator_replays_cassettes(monkeypatch):
+    monkeypatch.setenv("UPSTREAM_BASE_URL", "http://testserver")
+    url = upstream_url("https://api.curve.fi/v1/getPools/big/xdai")
+    assert url == "http://testserver/api.curve.fi/v1/getPools/big/xdai"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json()["data"]["poolData"]
+
+
+def test_simulator_replays_posts_by_body(tmp_path):
+    url = "https://api.studio.thegraph.com/api/KEY/subgraphs/id/pools"
+
+    def interaction(query, data):
+        return {
+            "request": {
+                "method": "POST",
+                "uri": url,
+                "body": json.dumps({"query": query, "variables": {}}),
+            },
+            "response": {
+                "status": {"code": 200},
+                "headers": {"Content-Type": ["application/json"]},
+                "body": {"string": json.dumps({"data": data})},
+            },
+        }
+
+    cassette = {
+        "interactions": [
+            interaction("{ pools { id } }", {"pools": []}),
+            interaction("{ liquidityGauges { id } }", {"liquidityGauges": []}),
+        ]
+    }
+    (tmp_path / "subgraphs.yaml").write_text(yaml.safe_dump(cassette))
+    simulator = TestClient(
+        create_app(SimulatorConfig(http_latency_ms=0, cassettes_dir=str(tmp_path)))
+    )
+    path = "/api.studio.thegraph.com/api/MOCK_KEY/subgraphs/id/pools"
+
+    # The same query in any key order gets its own response
+    gauges = simulator.post(
+        path, json={"variables": {}, "query": "{ liquidityGauges { id } }"}
+    )
+    assert gauges.json() == {"data": {"liquidityGauges": []}}
+    pools = simulator.post(path, json={"query": "{ pools { id } }", "variables": {}})
+    assert pools.json() == {"data": {"pools": []}}
+    assert simulator.post(path, json={"query": "{ other }"}).status_code == 404
+
+
+def test_percentile():
+    values = [i / 100 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 99) == 0.99
+    assert percentile([], 99) == 0
@@ -9,6 +9,7 @@ from defi_repertoire.main import app
 from defi_repertoire.strategies.disassembling.disassembling_balancer import (
     WithdrawAllAssetsProportional,
 )
+from defi_repertoire.strategies.manifest import MANIFEST
 from tests.vcr import my_vcr
 
 client = TestClient(app)
@@ -419,3 +420,32 @@ def test_multisend():
                 "contract_address": "0xA238CBeb142c10Ef7Ad8442C6D1f9E89e07e7761",
             }
         }
+
+
+def test_unknown_strategy_is_not_found():
+    response = client.post(
+        "/txns/unknown__strategy?blockchain=ethereum"
+        "&avatar_safe_address=0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF",
+        json={},
+    )
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Strategy not found"}
+
+
+def test_openapi_has_the_strategy_schemas():
+    paths = client.get("/openapi.json").json()["paths"]
+
+    txns = paths["/txns/{strategy_id}"]["post"]
+    schema = txns["requestBody"]["content"]["application/json"]["schema"]
+    assert {s["title"] for s in schema["anyOf"]} == set(MANIFEST)
+    assert "balancer__withdraw_all_assets_proportional" in next(
+        p["schema"]["enum"] for p in txns["parameters"] if p["name"] == "strategy_id"
+    )
+
+    options = paths["/txns/{strategy_id}/options"]["post"]
+    schema = options["requestBody"]["content"]["application/json"]["schema"]
+    assert "balancer__withdraw_single" in {s["title"] for s in schema["anyOf"]}
+    schema = options["responses"]["200"]["content"]["application/json"]["schema"]
+    assert "balancer__unstake_withdraw_single" in {
+        s["title"] for s in schema["properties"]["options"]["anyOf"]
+    }
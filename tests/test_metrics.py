@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+from defi_repertoire.main import app
+
+client = TestClient(app)
+
+
+def test_metrics():
+    assert client.get("/status").status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'repertoire_request_duration_seconds_count{endpoint="/status",method="GET",strategy=""}'
+        in response.text
+    )
+    assert "repertoire_rpc_duration_seconds" in response.text
+    assert "repertoire_cache_lookups_total" in response.text
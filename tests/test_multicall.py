@@ -0,0 +1,40 @@
+from unittest.mock import MagicMock, patch
+
+from eth_abi import decode, encode
+
+from defi_repertoire import multicall
+
+OWNER = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+
+
+def fake_multicall(tx, block):
+    assert tx["to"] == multicall.MULTICALL3_ADDRESS
+    assert tx["data"][:4] == multicall.AGGREGATE3_SELECTOR
+    [calls] = decode(["(address,bool,bytes)[]"], tx["data"][4:])
+    results = []
+    for target, allow_failure, data in calls:
+        assert allow_failure
+        assert data[:4] == multicall.BALANCE_OF_SELECTOR
+        # the balance is the last byte of the token address, token 0x..00 reverts
+        balance = int(target[-2:], 16)
+        results.append(
+            (balance != 0, encode(["uint256"], [balance]) if balance else b"")
+        )
+    return encode(["(bool,bytes)[]"], [results])
+
+
+def test_balances_of():
+    tokens = [f"0x{i:040x}" for i in range(1200)]
+    w3 = MagicMock()
+    w3.eth.call.side_effect = fake_multicall
+
+    with patch.object(multicall, "CHUNK_SIZE", 500):
+        balances = multicall.balances_of(w3, tokens, OWNER, block=10)
+
+    # one eth_call per chunk
+    assert w3.eth.call.call_count == 3
+    assert w3.eth.call.call_args.args[1] == 10
+    assert len(balances) == 1200 - 5
+    assert balances[tokens[1]] == 1
+    assert balances[tokens[255]] == 255
+    assert tokens[256] not in balances
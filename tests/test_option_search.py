@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from defi_repertoire import stale_while_revalidate
+from defi_repertoire.option_search import InvalidCursor, OptionIndex, OptionIndexes
+from defi_repertoire.strategies.base import AddressOption
+
+USDC = AddressOption(
+    address="0xA0b86991c6218b36c1D19D4a2e9Eb0cE3606eB48", label="USDC", liquidity=9e8
+)
+USDT = AddressOption(
+    address="0xdAC17F958D2ee523a2206206994597C13D831ec7", label="USDT", liquidity=8e8
+)
+SUSD = AddressOption(address="0x57Ab1ec28D129707052df4dF418D58a2D46d5f51", label="sUSD")
+WETH = AddressOption(
+    address="0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2", label="WETH", liquidity=5e9
+)
+
+
+def labels(page) -> list[str]:
+    return [o.label for o in page.options]
+
+
+def test_prefix_search_on_label_and_address():
+    index = OptionIndex([USDC, USDT, SUSD, WETH])
+
+    assert labels(index.search("us")) == ["USDC", "USDT"]
+    assert labels(index.search("0xc02a")) == ["WETH"]
+    assert labels(index.search("susd")) == ["sUSD"]
+    assert labels(index.search("")) == ["USDC", "USDT", "sUSD", "WETH"]
+
+
+def test_substring_search():
+    index = OptionIndex([USDC, USDT, SUSD, WETH])
+
+    assert labels(index.search("usd", match="substring")) == ["USDC", "USDT", "sUSD"]
+    assert labels(index.search("ec7", match="substring")) == ["USDT"]
+
+
+def test_min_liquidity_leaves_out_options_without_liquidity():
+    index = OptionIndex([USDC, USDT, SUSD, WETH])
+
+    assert labels(index.search(min_liquidity=8.5e8)) == ["USDC", "WETH"]
+
+
+def test_cursor_pagination():
+    index = OptionIndex([USDC, USDT, SUSD, WETH])
+
+    first = index.search("", limit=3)
+    assert labels(first) == ["USDC", "USDT", "sUSD"]
+    second = index.search("", cursor=first.next_cursor, limit=3)
+    assert labels(second) == ["WETH"]
+    assert second.next_cursor is None
+
+    first = index.search("usd", match="substring", limit=2)
+    second = index.search("usd", match="substring", cursor=first.next_cursor)
+    assert labels(second) == ["sUSD"]
+
+    # Another worker with the same list accepts the cursor, a changed list rejects it
+    again = OptionIndex([USDC, USDT, SUSD, WETH]).search("", cursor=first.next_cursor)
+    assert labels(again) == ["sUSD", "WETH"]
+    with pytest.raises(InvalidCursor):
+        OptionIndex([USDC, USDT, WETH, SUSD]).search("", cursor=first.next_cursor)
+    with pytest.raises(InvalidCursor):
+        OptionIndex([USDC]).search("", cursor=first.next_cursor)
+    with pytest.raises(InvalidCursor):
+        index.search("", cursor="not-a-cursor")
+
+
+class FakeStrategy:
+    protocol = "fake"
+    id = "swap"
+    tokens = [USDC, USDT]
+    calls = 0
+
+    class BaseOptions(BaseModel):
+        token_in_address: list[AddressOption]
+
+    @classmethod
+    async def get_base_options(cls, blockchain):
+        cls.calls += 1
+        return cls.BaseOptions(token_in_address=cls.tokens)
+
+
+def test_indexes_rebuilt_when_the_caches_change(monkeypatch):
+    generation = 0
+    monkeypatch.setattr(stale_while_revalidate, "generation", lambda: generation)
+    indexes = OptionIndexes()
+
+    def get(field="token_in_address"):
+        return asyncio.run(indexes.get(FakeStrategy, "ethereum", field))
+
+    index = get()
+    assert get() is index
+    assert FakeStrategy.calls == 1
+
+    # Refreshed with the same options: the cursors are still valid
+    generation = 1
+    assert get() is index
+    assert FakeStrategy.calls == 2
+
+    monkeypatch.setattr(FakeStrategy, "tokens", [USDC, USDT, WETH])
+    generation = 2
+    rebuilt = get()
+    assert labels(rebuilt.search("")) == ["USDC", "USDT", "WETH"]
+    assert rebuilt.version != index.version
+
+    assert get("amount") is None
@@ -0,0 +1,185 @@
+import asyncio
+
+from defabipedia.tokens import NATIVE, Addresses
+from defabipedia.types import Chain
+
+from defi_repertoire import planner
+from defi_repertoire.planner import plan_position
+from defi_repertoire.positions import Position
+
+BPT = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+
+
+def bpt_position():
+    return Position(
+        protocol="balancer",
+        kind="bpt",
+        address=BPT,
+        label="B-50WETH-50DAI",
+        balance=1000,
+        strategies=[
+            "balancer__withdraw_all_assets_proportional",
+            "balancer__withdraw_single",
+        ],
+        arguments={"bpt_address": BPT, "amount": 1000},
+    )
+
+
+def test_plan_pool_position():
+    blockchain = Chain.ETHEREUM
+    weth = Addresses[blockchain].WETH
+    pool_tokens = {BPT.lower(): [weth.lower(), Addresses[blockchain].DAI.lower()]}
+
+    # the target is a pool token: single token exit
+    plan = plan_position(blockchain, bpt_position(), NATIVE, 0.5, pool_tokens)
+    assert [c.id for c in plan.exits] == ["balancer__withdraw_single"]
+    assert plan.exits[0].arguments == {
+        "bpt_address": BPT,
+        "amount": 1000,
+        "max_slippage": 0.5,
+        "token_out_address": weth,
+    }
+    assert plan.swaps == []
+
+    assert plan.pending is None
+
+    # otherwise proportional exit, and the pool tokens are left to swap
+    usdc = Addresses[blockchain].USDC
+    plan = plan_position(blockchain, bpt_position(), usdc, 0.5, pool_tokens)
+    assert [c.id for c in plan.exits] == ["balancer__withdraw_all_assets_proportional"]
+    assert plan.swaps == []
+    assert "pool tokens" in plan.pending
+
+
+def test_plan_dsr_position():
+    blockchain = Chain.ETHEREUM
+    position = Position(
+        protocol="dsr",
+        kind="dsr",
+        address=BPT,
+        label="DSR",
+        balance=500,
+        strategies=["dsr__withdraw_without_proxy"],
+        arguments={"amount": 500},
+    )
+    usdc = Addresses[blockchain].USDC
+    plan = plan_position(blockchain, position, usdc, 1, {})
+    assert [c.id for c in plan.exits] == ["dsr__withdraw_without_proxy"]
+    [swap] = plan.swaps
+    assert swap.id == "cowswap__swap_on_cowswap"
+    assert swap.arguments == {
+        "token_in_address": Addresses[blockchain].DAI,
+        "token_out_address": usdc,
+        "amount": 500,
+        "max_slippage": 1,
+    }
+
+
+def test_plan_lido_position_to_eth_is_pending():
+    position = Position(
+        protocol="lido",
+        kind="token",
+        address=BPT,
+        label="stETH",
+        balance=500,
+        strategies=["lido__unstake_stETH"],
+        arguments={"amount": 500},
+    )
+    plan = plan_position(Chain.ETHEREUM, position, NATIVE, 1, {})
+    assert [c.id for c in plan.exits] == ["lido__unstake_stETH"]
+    assert plan.swaps == []
+    assert "lido__claim_withdrawals" in plan.pending
+
+
+class FakeRepertoire:
+    def __init__(self, positions, failing=()):
+        self._positions = positions
+        self.failing = failing
+        self.built = []
+        self.wrapped = None
+
+    async def positions(self, blockchain, avatar):
+        return self._positions
+
+    async def abuild(self, blockchain, avatar, calls):
+        self.built.append([c.id for c in calls])
+        if any(c.id in self.failing for c in calls):
+            raise ValueError("Pool paused")
+        return [c.id for c in calls]
+
+    def wrap_with_role(self, blockchain, avatar, roles_mod, role, txns, estimate_gas):
+        self.wrapped = txns
+        return None, None
+
+
+def test_swaps_are_built_after_the_exits(monkeypatch):
+    blockchain = Chain.ETHEREUM
+    dsr = Position(
+        protocol="dsr",
+        kind="dsr",
+        address=BPT,
+        label="DSR",
+        balance=500,
+        strategies=["dsr__withdraw_without_proxy"],
+        arguments={"amount": 500},
+    )
+
+    async def fetch_pool_tokens(blockchain):
+        return {}
+
+    monkeypatch.setattr(planner, "_fetch_pool_tokens", fetch_pool_tokens)
+    repertoire = FakeRepertoire(
+        [bpt_position(), dsr], failing={"balancer__withdraw_all_assets_proportional"}
+    )
+    plan = asyncio.run(
+        planner.plan_full_exit(
+            repertoire,
+            blockchain,
+            BPT,
+            BPT,
+            1,
+            Addresses[blockchain].USDC,
+            1,
+            estimate_gas=False,
+        )
+    )
+    exits, swaps = repertoire.built[:2], repertoire.built[2:]
+    assert sorted(exits) == [
+        ["balancer__withdraw_all_assets_proportional"],
+        ["dsr__withdraw_without_proxy"],
+    ]
+    # No swaps are built for the position whose exit failed
+    assert swaps == [["cowswap__swap_on_cowswap"]]
+    assert repertoire.wrapped == [
+        "dsr__withdraw_without_proxy",
+        "cowswap__swap_on_cowswap",
+    ]
+    assert [s.position.protocol for s in plan.steps] == ["dsr"]
+    assert [s.reason for s in plan.skipped] == ["Pool paused"]
+
+
+def test_pool_tokens_left_to_swap_are_pending(monkeypatch):
+    blockchain = Chain.ETHEREUM
+
+    async def fetch_pool_tokens(blockchain):
+        return {BPT.lower(): [Addresses[blockchain].DAI.lower()]}
+
+    monkeypatch.setattr(planner, "_fetch_pool_tokens", fetch_pool_tokens)
+    repertoire = FakeRepertoire([bpt_position()])
+    plan = asyncio.run(
+        planner.plan_full_exit(
+            repertoire,
+            blockchain,
+            BPT,
+            BPT,
+            1,
+            Addresses[blockchain].USDC,
+            1,
+            estimate_gas=False,
+        )
+    )
+    assert repertoire.wrapped == ["balancer__withdraw_all_assets_proportional"]
+    assert plan.steps == []
+    [pending] = plan.pending
+    assert pending.position.protocol == "balancer"
+    assert "pool tokens" in pending.reason
@@ -0,0 +1,154 @@
+import asyncio
+
+from defabipedia.lido import ContractSpecs as LidoSpecs
+from defabipedia.maker import ContractSpecs as MakerSpecs
+from defabipedia.spark import ContractSpecs as SparkSpecs
+from defabipedia.types import Chain
+from eth_abi import encode
+
+from defi_repertoire import multicall, positions
+from defi_repertoire.positions import RAY
+from defi_repertoire.strategies.disassembling import (
+    disassembling_aura,
+    disassembling_balancer,
+)
+
+AVATAR = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+BPT = "0x0000000000000000000000000000000000000001"
+EMPTY_BPT = "0x0000000000000000000000000000000000000002"
+GAUGE = "0x0000000000000000000000000000000000000003"
+AURA_REWARDS = "0x0000000000000000000000000000000000000004"
+POT = "0x197E90f9FAD81970bA7976f33CbD77088E5D7cf7"
+PIE_OF = multicall.encode_call("pieOf(address)", ["address"], [AVATAR])
+
+
+class FakeMulticall:
+    """multicall.aggregate answering balanceOf with the balances, and the DSR calls"""
+
+    def __init__(self, balances: dict[str, int], pie: int = 0, chi: int = RAY):
+        self.balances = {str.lower(t): b for t, b in balances.items()}
+        self.pie = pie
+        self.chi = chi
+        self.calls = []
+
+    def aggregate(self, w3, calls, block="latest"):
+        self.calls.append((calls, block))
+        return [self.answer(call) for call in calls]
+
+    def answer(self, call: multicall.Call) -> bytes:
+        if call.data[:4] == multicall.BALANCE_OF_SELECTOR:
+            balance = self.balances.get(str.lower(call.target), 0)
+            return encode(["uint256"], [balance])
+        if call.data == PIE_OF:
+            return encode(["uint256"], [self.pie])
+        if call.data == multicall.encode_call("pot()"):
+            return encode(["address"], [POT])
+        if call.data == multicall.encode_call("chi()"):
+            assert call.target == POT
+            return encode(["uint256"], [self.chi])
+        raise AssertionError(f"Unexpected call {call}")
+
+
+def patch_fetchers(monkeypatch):
+    async def fetch_pools(blockchain):
+        return [
+            {"address": BPT.lower(), "symbol": "B-50WETH-50DAI"},
+            {"address": EMPTY_BPT.lower(), "symbol": "B-EMPTY"},
+        ]
+
+    async def fetch_gauges(blockchain):
+        return [
+            {"id": GAUGE.lower(), "symbol": "B-50WETH-50DAI-gauge", "poolAddress": BPT}
+        ]
+
+    async def fetch_aura_pools(blockchain):
+        return [
+            {
+                "rewardPool": AURA_REWARDS.lower(),
+                "depositToken": {"symbol": "auraB-50WETH-50DAI"},
+                "lpToken": {"id": BPT.lower()},
+            }
+        ]
+
+    monkeypatch.setattr(disassembling_balancer, "fetch_pools", fetch_pools)
+    monkeypatch.setattr(disassembling_balancer, "fetch_gauges", fetch_gauges)
+    monkeypatch.setattr(disassembling_aura, "fetch_pools", fetch_aura_pools)
+
+
+def get_positions(monkeypatch, fake: FakeMulticall):
+    patch_fetchers(monkeypatch)
+    monkeypatch.setattr(multicall, "aggregate", fake.aggregate)
+    return asyncio.run(positions.get_positions(None, Chain.ETHEREUM, AVATAR, block=123))
+
+
+def test_get_positions(monkeypatch):
+    blockchain = Chain.ETHEREUM
+    steth = LidoSpecs[blockchain].stETH.address
+    wsteth = LidoSpecs[blockchain].wstETH.address
+    sdai = SparkSpecs[blockchain].sDAI.address
+    fake = FakeMulticall(
+        {
+            BPT: 1000,
+            EMPTY_BPT: 0,
+            GAUGE: 2000,
+            AURA_REWARDS: 3000,
+            steth: 4000,
+            wsteth: 5000,
+            sdai: 6000,
+        },
+        pie=2 * 10**18,
+        chi=RAY * 105 // 100,
+    )
+    found = get_positions(monkeypatch, fake)
+
+    by_label = {p.label: p for p in found}
+    # the empty pool is left out
+    assert list(by_label) == [
+        "B-50WETH-50DAI",
+        "B-50WETH-50DAI-gauge",
+        "auraB-50WETH-50DAI",
+        "stETH",
+        "wstETH",
+        "sDAI",
+        "DSR",
+    ]
+
+    bpt = by_label["B-50WETH-50DAI"]
+    assert (bpt.protocol, bpt.kind, bpt.balance) == ("balancer", "bpt", 1000)
+    assert bpt.strategies == [
+        "balancer__withdraw_all_assets_proportional",
+        "balancer__withdraw_single",
+    ]
+    assert bpt.arguments == {"amount": 1000, "bpt_address": BPT}
+
+    gauge = by_label["B-50WETH-50DAI-gauge"]
+    assert (gauge.kind, gauge.balance) == ("gauge", 2000)
+    assert gauge.arguments == {"amount": 2000, "gauge_address": GAUGE}
+
+    aura = by_label["auraB-50WETH-50DAI"]
+    assert (aura.protocol, aura.kind, aura.balance) == ("aura", "aura", 3000)
+    assert aura.arguments == {"amount": 3000, "rewards_address": AURA_REWARDS}
+
+    assert by_label["stETH"].strategies == ["lido__unstake_stETH"]
+    assert by_label["stETH"].arguments == {"amount": 4000}
+    assert by_label["wstETH"].strategies == ["lido__unwrap_and_unstake_wstETH"]
+    assert by_label["wstETH"].arguments == {"amount": 5000}
+    assert by_label["sDAI"].strategies == ["spark__withdraw_with_proxy"]
+    assert by_label["sDAI"].arguments == {"amount": 6000}
+
+    # the DAI of the DSR is pieOf * chi
+    dsr = by_label["DSR"]
+    assert dsr.address == MakerSpecs[blockchain].DsrManager.address
+    assert dsr.balance == 21 * 10**17
+    assert dsr.arguments == {"amount": 21 * 10**17}
+
+    # one sweep of the balances and the DSR, then chi
+    assert len(fake.calls) == 2
+    assert all(block == 123 for _, block in fake.calls)
+
+
+def test_empty_positions_are_left_out(monkeypatch):
+    fake = FakeMulticall({})
+    assert get_positions(monkeypatch, fake) == []
+    # chi is not read without a DSR position
+    assert len(fake.calls) == 1
@@ -0,0 +1,149 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from defi_repertoire import tracing
+from defi_repertoire.providers import BatchingHTTPProvider
+
+
+def rpc_result(request):
+    if request["method"] == "eth_getBalance":
+        return {
+            "jsonrpc": "2.0",
+            "id": request["id"],
+            "error": {"code": -32000, "message": "boom"},
+        }
+    return {"jsonrpc": "2.0", "id": request["id"], "result": hex(request["params"][0])}
+
+
+@pytest.fixture
+def rpc_server():
+    posts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            posts.append(body)
+            batch = body if isinstance(body, list) else [body]
+            if any(r["method"] == "eth_crash" for r in batch):
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if isinstance(body, list):
+                # answer in reverse order, responses are matched by id
+                response = [rpc_result(r) for r in reversed(body)]
+            else:
+                response = rpc_result(body)
+            data = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", posts
+    server.shutdown()
+
+
+def test_batching_provider(rpc_server):
+    url, posts = rpc_server
+    provider = BatchingHTTPProvider(url, window=0.1)
+
+    # Outside a batching block every call is a single request
+    assert provider.make_request("eth_echo", [1])["result"] == "0x1"
+    assert len(posts) == 1
+    assert posts[0]["method"] == "eth_echo"
+    posts.clear()
+
+    def echo(i):
+        return provider.make_request("eth_echo", [i])
+
+    with provider.batching():
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            responses = list(executor.map(tracing.propagate(echo), range(5)))
+    assert [r["result"] for r in responses] == ["0x0", "0x1", "0x2", "0x3", "0x4"]
+    assert len(posts) == 1
+    assert len(posts[0]) == 5
+
+
+def test_batching_is_per_context(rpc_server):
+    url, posts = rpc_server
+    provider = BatchingHTTPProvider(url, window=0.2)
+
+    def other_request():
+        # Another request using the shared provider outside a batching block
+        return provider.make_request("eth_echo", [9])
+
+    with provider.batching():
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            other = executor.submit(other_request)
+            batched = list(
+                executor.map(
+                    tracing.propagate(lambda i: provider.make_request("eth_echo", [i])),
+                    range(2),
+                )
+            )
+    assert other.result()["result"] == "0x9"
+    assert [r["result"] for r in batched] == ["0x0", "0x1"]
+    single, batch = sorted(posts, key=lambda post: isinstance(post, list))
+    assert single["params"] == [9]
+    assert len(batch) == 2
+
+
+def test_concurrent_batching_contexts(rpc_server):
+    url, posts = rpc_server
+    provider = BatchingHTTPProvider(url, window=0.2)
+
+    def batched_request(methods):
+        # A request of its own, batching its concurrent calls
+        def call(method_and_param):
+            method, param = method_and_param
+            try:
+                return provider.make_request(method, [param])["result"]
+            except requests.HTTPError as error:
+                return error.response.status_code
+
+        with provider.batching():
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                return list(executor.map(tracing.propagate(call), methods))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        failing = executor.submit(batched_request, [("eth_crash", 1), ("eth_echo", 2)])
+        other = executor.submit(batched_request, [("eth_echo", 3), ("eth_echo", 4)])
+
+    # each request sends its own batch, the failure of one does not reach the other
+    assert failing.result() == [500, 500]
+    assert other.result() == ["0x3", "0x4"]
+    assert sorted(sorted(r["params"][0] for r in post) for post in posts) == [
+        [1, 2],
+        [3, 4],
+    ]
+
+
+def test_batching_provider_errors(rpc_server):
+    url, posts = rpc_server
+    provider = BatchingHTTPProvider(url, window=0.1)
+
+    def call(method):
+        return provider.make_request(method, [7])
+
+    with provider.batching():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            echo, balance = list(
+                executor.map(tracing.propagate(call), ["eth_echo", "eth_getBalance"])
+            )
+
+    assert len(posts) == 1
+    assert echo["result"] == "0x7"
+    assert balance["error"] == {"code": -32000, "message": "boom"}
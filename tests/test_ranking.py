@@ -0,0 +1,38 @@
+from defi_repertoire.ranking import ranked, to_liquidity, with_liquidity
+
+
+def test_ranked_by_liquidity_with_the_unranked_last():
+    items = [
+        {"symbol": "A", "liquidity": 10.0},
+        {"symbol": "B", "liquidity": None},
+        {"symbol": "C", "liquidity": 30.0},
+        {"symbol": "D"},
+        {"symbol": "E", "liquidity": 20.0},
+    ]
+
+    assert [i["symbol"] for i in ranked(items)] == ["C", "E", "A", "B", "D"]
+
+
+def test_with_liquidity_by_address_in_any_case():
+    gauges = [
+        {"id": "0x01", "poolAddress": "0xAA"},
+        {"id": "0x02", "poolAddress": "0xbb"},
+        {"id": "0x03", "poolAddress": None},
+    ]
+
+    result = with_liquidity(gauges, {"0xaa": 1.0, "0xbb": 2.0}, field="poolAddress")
+
+    assert [(g["id"], g["liquidity"]) for g in result] == [
+        ("0x02", 2.0),
+        ("0x01", 1.0),
+        ("0x03", None),
+    ]
+    # The fetched entities are not modified
+    assert "liquidity" not in gauges[0]
+
+
+def test_to_liquidity():
+    assert to_liquidity("1234.5") == 1234.5
+    assert to_liquidity(7) == 7.0
+    assert to_liquidity(None) is None
+    assert to_liquidity("n/a") is None
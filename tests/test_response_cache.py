@@ -0,0 +1,88 @@
+from unittest.mock import patch
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from defi_repertoire import stale_while_revalidate
+from defi_repertoire.response_cache import ResponseCache, cache_key
+
+
+def make_client(cache: ResponseCache):
+    app = FastAPI()
+    calls = []
+
+    def respond(request: Request, arguments: dict):
+        key = cache_key("options", arguments)
+        cached = cache.get(key)
+        hit = cached is not None
+        if not hit:
+            calls.append(arguments)
+            generation = stale_while_revalidate.generation()
+            cached = cache.put(key, {"options": [len(calls)]}, generation)
+        return cache.respond(request, cached, hit)
+
+    @app.post("/options")
+    async def options(request: Request, arguments: dict):
+        return respond(request, arguments)
+
+    @app.get("/catalog")
+    async def catalog(request: Request, a: int):
+        return respond(request, {"a": a})
+
+    return TestClient(app), calls
+
+
+def test_cache_key_is_canonical():
+    assert cache_key("a", {"x": 1, "y": 2}) == cache_key("a", {"y": 2, "x": 1})
+    assert cache_key("a", {"x": 1}) != cache_key("b", {"x": 1})
+
+
+def test_cached_until_the_caches_are_updated():
+    client, calls = make_client(ResponseCache("test"))
+
+    first = client.post("/options", json={"a": 1, "b": 2})
+    second = client.post("/options", json={"b": 2, "a": 1})
+    assert first.json() == second.json() == {"options": [1]}
+    assert len(calls) == 1
+    assert first.headers["ETag"] == second.headers["ETag"]
+    # CDNs do not cache POST responses
+    assert "Cache-Control" not in first.headers
+
+    generation = stale_while_revalidate.generation()
+    with patch.object(stale_while_revalidate, "_generation", generation + 1):
+        third = client.post("/options", json={"a": 1, "b": 2})
+    assert third.json() == {"options": [2]}
+    assert third.headers["ETag"] != first.headers["ETag"]
+
+    response = client.get("/catalog", params={"a": 3})
+    assert response.headers["Cache-Control"] == "public, max-age=60"
+
+
+def test_not_modified_with_the_etag():
+    client, calls = make_client(ResponseCache("test"))
+
+    etag = client.get("/catalog", params={"a": 1}).headers["ETag"]
+    response = client.get("/catalog", params={"a": 1}, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    assert len(calls) == 1
+
+    # Other methods get a 412 with a matching ETag
+    response = client.post("/options", json={"a": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 412
+    assert len(calls) == 1
+
+
+def test_expired_and_evicted_responses():
+    client, calls = make_client(ResponseCache("test", max_age=0))
+    client.post("/options", json={"a": 1})
+    client.post("/options", json={"a": 1})
+    assert len(calls) == 2
+
+    client, calls = make_client(ResponseCache("test", max_entries=1))
+    client.post("/options", json={"a": 1})
+    client.post("/options", json={"a": 2})
+    client.post("/options", json={"a": 1})
+    assert len(calls) == 3
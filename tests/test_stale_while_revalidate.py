@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+from defi_repertoire.stale_while_revalidate import StaleWhileRevalidateCache
+
+
+def make_cache(func, snapshot_dir, ttl=60):
+    cache = StaleWhileRevalidateCache(func, ttl=ttl, use_stale_ttl=120)
+    cache.snapshot_dir = str(snapshot_dir)
+    return cache
+
+
+def test_snapshot_restored_fresh(tmp_path):
+    async def fetch_tokens(blockchain):
+        return [{"address": "0x01", "symbol": blockchain}]
+
+    async def fetch_tokens_down(blockchain):
+        raise ConnectionError("upstream down")
+
+    fetch_tokens_down.__name__ = "fetch_tokens"
+
+    cache = make_cache(fetch_tokens, tmp_path)
+    assert asyncio.run(cache("gnosis")) == [{"address": "0x01", "symbol": "gnosis"}]
+    assert os.listdir(tmp_path) == [f"{cache.name}.msgpack"]
+
+    # A restarted worker serves the snapshot without reaching the upstream
+    restarted = make_cache(fetch_tokens_down, tmp_path)
+    assert asyncio.run(restarted("gnosis")) == [{"address": "0x01", "symbol": "gnosis"}]
+
+
+def test_snapshot_restored_stale(tmp_path):
+    calls = []
+
+    async def fetch_pools(blockchain):
+        calls.append(blockchain)
+        return len(calls)
+
+    asyncio.run(make_cache(fetch_pools, tmp_path, ttl=0)("ethereum"))
+
+    async def restart():
+        restarted = make_cache(fetch_pools, tmp_path, ttl=0)
+        # The old value is served while it is revalidated in the background
+        assert await restarted("ethereum") == 1
+        await asyncio.gather(*restarted.pending_updates.values())
+        assert restarted.cache[(("ethereum",), ())] == 2
+
+    asyncio.run(restart())
+    assert calls == ["ethereum", "ethereum"]
+
+
+def test_snapshots_of_the_workers_are_merged(tmp_path):
+    async def fetch_pools(blockchain):
+        return blockchain
+
+    # Two workers caching different keys in the same snapshot
+    asyncio.run(make_cache(fetch_pools, tmp_path)("ethereum"))
+    asyncio.run(make_cache(fetch_pools, tmp_path)("gnosis"))
+
+    async def fetch_pools_down(blockchain):
+        raise ConnectionError("upstream down")
+
+    fetch_pools_down.__name__ = "fetch_pools"
+
+    async def restart():
+        restarted = make_cache(fetch_pools_down, tmp_path)
+        assert await restarted("gnosis") == "gnosis"
+        # Caching a key keeps the entries of the snapshot not looked up yet
+        await restarted._save_snapshot()
+        assert await make_cache(fetch_pools_down, tmp_path)("ethereum") == "ethereum"
+
+    asyncio.run(restart())
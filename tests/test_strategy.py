@@ -1,7 +1,24 @@
+from unittest.mock import MagicMock, patch
+
 import pytest
+from defabipedia.types import Chain
+from eth_abi import decode, encode
 from pydantic import BaseModel, ValidationError
 
-from defi_repertoire.strategies.base import ChecksumAddress
+from defi_repertoire import multicall
+from defi_repertoire.strategies.base import (
+    STRATEGIES,
+    STRATEGIES_METADATA,
+    ChecksumAddress,
+    GenericTxContext,
+    get_balance_queries,
+    get_strategy_id,
+    get_strategy_metadata,
+    prefetch_balances,
+    resolve_amount,
+)
+from defi_repertoire.strategies.disassembling import disassembling_balancer as balancer
+from defi_repertoire.strategies.manifest import MANIFEST
 
 
 def test_checkum_address():
@@ -31,3 +48,113 @@ def test_checkum_address():
     # must start with 0x
     with pytest.raises(ValidationError):
         DemoModel(address="8353157092ED8Be69a9DF8F95af097bbF33Cb2aF")
+
+
+def test_strategy_metadata():
+    metadata = get_strategy_metadata(balancer.WithdrawSingle)
+    assert metadata is STRATEGIES_METADATA["balancer__withdraw_single"]
+    assert metadata.id == "balancer__withdraw_single"
+    assert metadata.arguments_type is balancer.WithdrawSingle.Args
+    assert metadata.arguments_schema == balancer.WithdrawSingle.Args.model_json_schema()
+    assert metadata.opt_types["arguments"] is balancer.WithdrawSingle.OptArgs
+    assert metadata.opt_types["return"] is balancer.WithdrawSingle.Options
+
+    arguments = metadata.arguments_adapter.validate_python(
+        {
+            "bpt_address": "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF",
+            "amount": 10,
+            "max_slippage": 1,
+            "token_out_address": "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF",
+        }
+    )
+    assert isinstance(arguments, balancer.WithdrawSingle.Args)
+
+    with pytest.raises(ValidationError):
+        metadata.arguments_adapter.validate_python({"amount": 10})
+
+    # strategies without options
+    assert get_strategy_metadata(balancer.WithdrawAllAssetsProportional).opt_types == {}
+
+
+def test_manifest():
+    STRATEGIES.load_all()
+
+    # every registered strategy is in the manifest
+    assert set(STRATEGIES) == set(MANIFEST)
+
+    for id, manifest in MANIFEST.items():
+        strategy = STRATEGIES[id]
+        assert get_strategy_id(strategy) == id
+        assert strategy.kind == manifest.kind
+        assert strategy.protocol == manifest.protocol
+        assert strategy.__module__ == manifest.module
+
+
+def test_amount_or_percentage():
+    Args = balancer.WithdrawAllAssetsProportional.Args
+    bpt = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+
+    assert Args(bpt_address=bpt, max_slippage=1, amount=10).amount == 10
+    assert Args(bpt_address=bpt, max_slippage=1, percentage=50).percentage == 50
+    with pytest.raises(ValidationError):
+        Args(bpt_address=bpt, max_slippage=1)
+    with pytest.raises(ValidationError):
+        Args(bpt_address=bpt, max_slippage=1, amount=10, percentage=50)
+    with pytest.raises(ValidationError):
+        Args(bpt_address=bpt, max_slippage=1, percentage=0)
+
+
+def test_resolve_percentages_in_one_multicall():
+    avatar = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+    bpts = [f"0x{i:040x}" for i in range(1, 4)]
+
+    def fake_multicall(tx, block):
+        [calls] = decode(["(address,bool,bytes)[]"], tx["data"][4:])
+        # balance of 1000 * the last byte of the token address
+        return encode(
+            ["(bool,bytes)[]"],
+            [
+                [
+                    (True, encode(["uint256"], [1000 * int(t[-2:], 16)]))
+                    for t, _, _ in calls
+                ]
+            ],
+        )
+
+    w3 = MagicMock()
+    w3.eth.block_number = 123
+    w3.eth.call.side_effect = fake_multicall
+    with patch.object(Chain, "get_blockchain_from_web3", lambda x: Chain.ETHEREUM):
+        ctx = GenericTxContext(w3=w3, avatar_safe_address=avatar)
+
+    strategy = balancer.WithdrawAllAssetsProportional
+    strategy_arguments = [
+        (strategy, strategy.Args(bpt_address=bpt, max_slippage=1, percentage=50))
+        for bpt in bpts
+    ]
+    strategy_arguments.append(
+        (strategy, strategy.Args(bpt_address=bpts[0], max_slippage=1, amount=7))
+    )
+    prefetch_balances(ctx, get_balance_queries(ctx, strategy_arguments))
+
+    # pinned to the block
+    assert ctx.block == 123
+    assert w3.eth.call.call_count == 1
+    assert w3.eth.call.call_args.args[1] == 123
+    amounts = [resolve_amount(ctx, s, a) for s, a in strategy_arguments]
+    assert amounts == [500, 1000, 1500, 7]
+    assert w3.eth.call.call_count == 1
+
+
+def test_resolve_percentages_of_large_balances():
+    avatar = "0x8353157092ED8Be69a9DF8F95af097bbF33Cb2aF"
+    bpt = f"0x{1:040x}"
+    # More digits than the default decimal context (28)
+    balance = 123_456_789_123_456_789 * 10**18 + 7
+    with patch.object(Chain, "get_blockchain_from_web3", lambda x: Chain.ETHEREUM):
+        ctx = GenericTxContext(w3=MagicMock(), avatar_safe_address=avatar)
+    strategy = balancer.WithdrawAllAssetsProportional
+    arguments = strategy.Args(bpt_address=bpt, max_slippage=1, percentage=33.3)
+    ctx.ctx["balances"][strategy.get_balance_query(ctx, arguments).calls] = balance
+
+    assert resolve_amount(ctx, strategy, arguments) == balance * 333 // 1000
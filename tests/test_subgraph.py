@@ -0,0 +1,82 @@
+import re
+from unittest.mock import MagicMock, patch
+
+from defi_repertoire.subgraph import SubgraphIndex, greater_than
+
+
+class FakeSubgraph:
+    """Answers the queries of SubgraphIndex from a dict of entities by id"""
+
+    def __init__(self, entities: dict[str, dict], block: int):
+        self.entities = entities
+        self.block = block
+        self.changed_since: dict[str, int] = {}
+        self.queries = []
+
+    def post(self, url, json):
+        query = json["query"]
+        self.queries.append(query)
+        first = int(re.search(r"first: (\d+)", query).group(1))
+        cursor = re.search(r'id_gt: "([^"]*)"', query).group(1)
+        change = re.search(r"_change_block: {number_gte: (\d+)}", query)
+        entities = [
+            e
+            for id, e in sorted(self.entities.items())
+            if id > cursor
+            and (not change or self.changed_since.get(id, 0) >= int(change.group(1)))
+            and (
+                "totalLiquidity_gt" not in query
+                or greater_than("totalLiquidity", 10)(e)
+            )
+        ]
+        data = {"pools": entities[:first], "_meta": {"block": {"number": self.block}}}
+        return MagicMock(json=lambda: {"data": data})
+
+
+def pool(id: str, liquidity: int) -> dict:
+    return {"id": id, "totalLiquidity": str(liquidity)}
+
+
+def test_paginated_full_sync():
+    subgraph = FakeSubgraph({str(i): pool(str(i), 100 - i) for i in range(5)}, 10)
+    index = SubgraphIndex(
+        "url",
+        "pools",
+        "id totalLiquidity",
+        where='totalLiquidity_gt: "10"',
+        keep=greater_than("totalLiquidity", 10),
+        order_by="totalLiquidity",
+        page_size=2,
+    )
+    with patch("defi_repertoire.subgraph.requests.post", subgraph.post):
+        pools = index.sync()
+
+    # 3 pages, the last ones read at the block of the first one
+    assert len(subgraph.queries) == 3
+    assert 'id_gt: "1"' in subgraph.queries[1]
+    assert "block: {number: 10}" in subgraph.queries[2]
+    assert [p["id"] for p in pools] == ["4", "3", "2", "1", "0"]
+    assert index.block == 10
+
+
+def test_delta_sync():
+    subgraph = FakeSubgraph({str(i): pool(str(i), 100) for i in range(3)}, 10)
+    index = SubgraphIndex(
+        "url",
+        "pools",
+        "id totalLiquidity",
+        keep=greater_than("totalLiquidity", 10),
+    )
+    with patch("defi_repertoire.subgraph.requests.post", subgraph.post):
+        index.sync()
+
+        # a pool drops below the minimum liquidity, another one is created
+        subgraph.block = 20
+        subgraph.entities["1"] = pool("1", 5)
+        subgraph.entities["3"] = pool("3", 50)
+        subgraph.changed_since = {"1": 15, "3": 18}
+        pools = index.sync()
+
+    assert "_change_block: {number_gte: 10}" in subgraph.queries[-1]
+    assert [p["id"] for p in pools] == ["0", "2", "3"]
+    assert index.block == 20
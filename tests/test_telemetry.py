@@ -0,0 +1,66 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+from opentelemetry import trace
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+
+from defi_repertoire import telemetry
+from defi_repertoire.stale_while_revalidate import cache_af
+
+
+@pytest.fixture(scope="module")
+def exporter():
+    exporter = InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return exporter
+
+
+def test_strategy_spans(exporter):
+    exporter.clear()
+
+    class Inner:
+        @classmethod
+        def get_txns(cls, ctx, arguments):
+            return [arguments]
+
+    class Outer:
+        @classmethod
+        def get_txns(cls, ctx, arguments):
+            return Inner.get_txns(ctx=ctx, arguments=arguments + 1)
+
+    telemetry.instrument_strategy(Inner, "demo__inner")
+    telemetry.instrument_strategy(Outer, "demo__outer")
+
+    ctx = MagicMock(blockchain="ethereum")
+    assert Outer.get_txns(ctx=ctx, arguments=1) == [2]
+
+    inner, outer = exporter.get_finished_spans()
+    assert outer.attributes["strategy.id"] == "demo__outer"
+    assert outer.attributes["chain"] == "ethereum"
+    assert inner.attributes["strategy.id"] == "demo__inner"
+    # the nested strategy is a child span
+    assert inner.parent.span_id == outer.context.span_id
+
+
+def test_cache_spans(exporter):
+    exporter.clear()
+
+    @cache_af()
+    async def fetch_demo(value):
+        return value
+
+    async def run():
+        await fetch_demo(1)
+        await fetch_demo(1)
+
+    asyncio.run(run())
+    outcomes = [s.attributes["cache.outcome"] for s in exporter.get_finished_spans()]
+    assert outcomes == ["miss", "hit"]
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+from defabipedia.types import Chain
+from eth_abi import encode
+from pydantic import BaseModel
+
+from defi_repertoire import tokens
+from defi_repertoire.strategies.base import AddressOption
+from defi_repertoire.tokens import Token, TokenRegistry
+
+USDC = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+MKR = "0x9f8F72aA9304c8B593d555F12eF6589cC3A579A2"
+EEEE = "0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE"
+
+
+def fake_aggregate(w3, calls, block="latest"):
+    """symbol(), name() and decimals() of MKR (bytes32 strings), the rest revert"""
+    values = {
+        "symbol()": encode(["bytes32"], [b"MKR"]),
+        "name()": encode(["bytes32"], [b"Maker"]),
+        "decimals()": encode(["uint8"], [18]),
+    }
+    selectors = {tokens.multicall.encode_call(sig): v for sig, v in values.items()}
+    return [
+        selectors[c.data] if c.target.lower() == MKR.lower() else None for c in calls
+    ]
+
+
+def test_registry_merge_and_resolve(tmp_path):
+    registry = TokenRegistry(persist_dir=str(tmp_path))
+    registry.add(Chain.ETHEREUM, [Token(address=USDC.lower(), symbol="USDC")])
+    registry.add(
+        Chain.ETHEREUM,
+        [Token(address=USDC, symbol="USD Coin", name="USD Coin", decimals=6)],
+    )
+    # the fields already known take precedence, the missing ones are filled
+    assert registry.get(Chain.ETHEREUM, USDC) == Token(
+        address=USDC.lower(), symbol="USDC", name="USD Coin", decimals=6
+    )
+
+    with patch.object(tokens.multicall, "aggregate", fake_aggregate):
+        registry.resolve(None, Chain.ETHEREUM, [USDC, MKR, EEEE])
+    assert registry.get(Chain.ETHEREUM, MKR) == Token(
+        address=MKR, symbol="MKR", name="Maker", decimals=18
+    )
+    assert registry.get(Chain.ETHEREUM, EEEE) is None
+
+    # the resolved tokens are persisted
+    restarted = TokenRegistry(persist_dir=str(tmp_path))
+    assert restarted.get(Chain.ETHEREUM, MKR).decimals == 18
+
+
+def test_enrich_options(tmp_path):
+    class Options(BaseModel):
+        token_in_address: list[AddressOption]
+
+    async def fetch_sources(blockchain):
+        return {
+            "cowswap": [
+                {"address": USDC, "symbol": "USDC", "name": "USDC", "decimals": 6}
+            ],
+            "curve": ConnectionError("down"),
+        }
+
+    registry = TokenRegistry(persist_dir=str(tmp_path))
+    options = Options(
+        token_in_address=[
+            AddressOption(address=USDC, label="USDC"),
+            AddressOption(address=MKR, label="MKR"),
+        ]
+    )
+    with (
+        patch.object(tokens, "_fetch_sources", fetch_sources),
+        patch.object(tokens, "_get_w3", lambda blockchain: object()),
+        patch.object(tokens.multicall, "aggregate", fake_aggregate),
+    ):
+        enriched = asyncio.run(
+            tokens.enrich_options(Chain.ETHEREUM, options, registry=registry)
+        )
+
+    assert enriched.model_dump()["token_in_address"] == [
+        {"address": USDC, "label": "USDC", "name": "USDC", "decimals": 6},
+        {"address": MKR, "label": "MKR", "name": "Maker", "decimals": 18},
+    ]
+    # not enriched options do not have the metadata fields
+    assert options.model_dump()["token_in_address"][0] == {
+        "address": USDC,
+        "label": "USDC",
+    }
+
+
+def test_the_workers_merge_their_persisted_tokens(tmp_path):
+    usdc = Token(address=USDC, symbol="USDC", name="USD Coin", decimals=6)
+
+    def aggregate_usdc(w3, calls, block="latest"):
+        values = [encode(["string"], ["USDC"]), encode(["string"], ["USD Coin"])]
+        return values + [encode(["uint8"], [6])]
+
+    # two workers, each one resolving a different token
+    worker = TokenRegistry(persist_dir=str(tmp_path))
+    other_worker = TokenRegistry(persist_dir=str(tmp_path))
+    with patch.object(tokens.multicall, "aggregate", fake_aggregate):
+        worker.resolve(None, Chain.ETHEREUM, [MKR])
+    with patch.object(tokens.multicall, "aggregate", aggregate_usdc):
+        other_worker.resolve(None, Chain.ETHEREUM, [USDC])
+
+    restarted = TokenRegistry(persist_dir=str(tmp_path))
+    assert restarted.get(Chain.ETHEREUM, MKR).decimals == 18
+    assert restarted.get(Chain.ETHEREUM, USDC) == usdc
+
+
+def test_concurrent_resolutions_read_the_tokens_once(tmp_path):
+    registry = TokenRegistry(persist_dir=str(tmp_path))
+    aggregated = []
+    started = threading.Event()
+
+    def slow_aggregate(w3, calls, block="latest"):
+        aggregated.append(calls)
+        started.set()
+        time.sleep(0.1)
+        return fake_aggregate(w3, calls, block)
+
+    with patch.object(tokens.multicall, "aggregate", slow_aggregate):
+        first = threading.Thread(
+            target=registry.resolve, args=(None, Chain.ETHEREUM, [MKR])
+        )
+        first.start()
+        started.wait(5)
+        # resolved while the first resolution of MKR is in flight
+        registry.resolve(None, Chain.ETHEREUM, [MKR.lower()])
+        first.join()
+
+    assert len(aggregated) == 1
+    assert registry.get(Chain.ETHEREUM, MKR).decimals == 18
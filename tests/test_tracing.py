@@ -0,0 +1,47 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from defi_repertoire import tracing
+from defi_repertoire.stale_while_revalidate import cache_af
+
+
+def test_trace_request():
+    assert tracing.get_trace() is None
+    # nothing is recorded out of a request
+    tracing.record_rpc("eth_call", 0.1)
+
+    with tracing.trace_request() as trace:
+        tracing.record_rpc("eth_call", 0.01)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(
+                executor.map(
+                    tracing.propagate(lambda m: tracing.record_rpc(m, 0.02)),
+                    ["eth_call", "eth_chainId"],
+                )
+            )
+        with tracing.timed("encoding"):
+            pass
+
+    summary = trace.summary()
+    assert summary["rpc"]["count"] == 3
+    assert summary["rpc"]["by_method"] == {"eth_call": 2, "eth_chainId": 1}
+    assert summary["rpc"]["duration_ms"] == 50
+    assert "encoding" in summary["timings_ms"]
+    assert trace.server_timing().startswith('rpc;dur=50.0;desc="3 calls", cache;')
+    assert tracing.get_trace() is None
+
+
+def test_trace_cache():
+    @cache_af(ttl=60)
+    async def fetch(value):
+        return value
+
+    async def run():
+        with tracing.trace_request() as trace:
+            await fetch(1)
+            await fetch(1)
+            await fetch(2)
+        return trace
+
+    trace = asyncio.run(run())
+    assert trace.summary()["cache"] == {"hit": 1, "miss": 2, "stale": 0}
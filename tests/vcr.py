@@ -1,11 +1,15 @@
+import contextlib
 import os
 import re
+import tempfile
 
 import vcr
+import yaml
 
 THEGRAPH_API_KEY = os.getenv("THEGRAPH_API_KEY", "MOCK_KEY")
 RPC_MAINNET_URL = os.getenv("RPC_MAINNET_URL", "MOCK_MAINNET_RPC_URL")
 RPC_GNOSIS_URL = os.getenv("RPC_GNOSIS_URL", "MOCK_GNOSIS_RPC_URL")
+CASSETTES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "cassettes")
 
 
 def scrub_api_keys(request):
@@ -35,3 +39,30 @@ my_vcr = vcr.VCR(
     ignore_hosts=["testserver"],
     before_record_request=scrub_api_keys,
 )
+
+
+def replay_cassette(name: str):
+    """Replay a recorded cassette, e.g. "swapping/test_curve_options_gnosis", any number of times"""
+    return my_vcr.use_cassette(
+        os.path.join(CASSETTES_DIR, name),
+        path_transformer=vcr.VCR.ensure_suffix(".yaml"),
+        record_mode="none",
+        allow_playback_repeats=True,
+    )
+
+
+@contextlib.contextmanager
+def replay_cassettes(*names: str):
+    """Replay the interactions of several recorded cassettes together, as one cassette"""
+    interactions = []
+    for name in names:
+        with open(os.path.join(CASSETTES_DIR, f"{name}.yaml")) as f:
+            interactions += yaml.load(f, Loader=yaml.CSafeLoader)["interactions"]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cassette.yaml")
+        with open(path, "w") as f:
+            yaml.dump(
+                {"interactions": interactions, "version": 1}, f, Dumper=yaml.CSafeDumper
+            )
+        with my_vcr.use_cassette(path, record_mode="none", allow_playback_repeats=True):
+            yield